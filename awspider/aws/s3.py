@@ -26,7 +26,8 @@ class AmazonS3:
     host = "s3.amazonaws.com"
     reserved_headers = ["x-amz-id-2", "x-amz-request-id", "date", "last-modified", "etag", "content-type", "content-length", "server"]
     
-    def __init__(self, aws_access_key_id, aws_secret_access_key, rq=None):
+    def __init__(self, aws_access_key_id, aws_secret_access_key, rq=None,
+                 max_retries=0, hedge=False):
         """
         **Arguments:**
          * *aws_access_key_id* -- Amazon AWS access key ID
@@ -34,7 +35,14 @@ class AmazonS3:
        
         **Keyword arguments:**
          * *rq* -- Optional RequestQueuer object.
+         * *max_retries* -- Number of times the RequestQueuer retries a 
+           failed request, with backoff. If 0, failed requests are retried
+           immediately up to 3 times. (Default 0)
+         * *hedge* -- Hedge object GET and HEAD requests against tail 
+           latency. See ``RequestQueuer.getPage()``. (Default False)
         """
+        self.max_retries = max_retries
+        self.hedge = hedge
         if rq is None:
             self.rq = RequestQueuer()
         else:
@@ -139,7 +147,8 @@ class AmazonS3:
         bucket = convertToUTF8(bucket)
         headers = self._getAuthorization("GET", "", "", {}, "/" + bucket)
         url = "http://%s/%s" % (self.host, bucket)
-        d = self.rq.getPage(url, method="GET", headers=headers)
+        d = self.rq.getPage(url, method="GET", headers=headers,
+                            max_retries=self.max_retries)
         d.addErrback(self._genericErrback, url, method="GET", headers=headers)
         return d       
         
@@ -157,7 +166,8 @@ class AmazonS3:
         auth = self._getAuthorization("PUT", "", "", headers, "/" + bucket)
         headers.update(auth)
         url = "http://%s/%s" % (self.host, bucket)
-        d = self.rq.getPage(url, method="PUT", headers=headers)
+        d = self.rq.getPage(url, method="PUT", headers=headers,
+                            max_retries=self.max_retries)
         d.addErrback(self._genericErrback, url, method="PUT", headers=headers)
         return d
 
@@ -175,7 +185,8 @@ class AmazonS3:
         auth = self._getAuthorization("DELETE", "", "", headers, "/" + bucket)
         headers.update(auth)
         url = "http://%s/%s" % (self.host, bucket)
-        d = self.rq.getPage(url, method="DELETE", headers=headers)
+        d = self.rq.getPage(url, method="DELETE", headers=headers,
+                            max_retries=self.max_retries)
         d.addErrback(self._genericErrback, url, method="DELETE",    
                      headers=headers)
         return d
@@ -194,7 +205,8 @@ class AmazonS3:
         path = "/" + bucket + "/" + key
         headers = self._getAuthorization("HEAD", "", "", {}, path)
         url = "http://%s/%s/%s" % (self.host, bucket, key)
-        d = self.rq.getPage(url, method="HEAD", headers=headers)
+        d = self.rq.getPage(url, method="HEAD", headers=headers,
+                            max_retries=self.max_retries, hedge=self.hedge)
         d.addCallback(self._getObjectCallback)
         d.addErrback(self._genericErrback, url, method="HEAD", headers=headers)
         return d
@@ -227,7 +239,8 @@ class AmazonS3:
         path = "/" + bucket + "/" + key
         headers = self._getAuthorization("GET", "", "", {}, path)
         url = "http://%s/%s/%s" % (self.host, bucket, key)
-        d = self.rq.getPage(url, method="GET", headers=headers)
+        d = self.rq.getPage(url, method="GET", headers=headers,
+                            max_retries=self.max_retries, hedge=self.hedge)
         d.addCallback(self._getObjectCallback)
         d.addErrback(self._genericErrback, url, method="GET", headers=headers)
         return d   
@@ -260,7 +273,7 @@ class AmazonS3:
         return dict(zip(["%s%s" % (meta, x) for x in keys], values))
        
     def putObject(self, bucket, key, data, content_type="text/html", 
-                  public=True, headers=None, gzip=False):
+                  public=True, headers=None, gzip=False, priority=None):
         """
         Add an object to a bucket.
        
@@ -274,6 +287,7 @@ class AmazonS3:
          * *public* -- Boolean flag representing access (Default True)
          * *headers* -- Custom header dictionary (Default empty dictionary)
          * *gzip* -- Boolean flag to gzip data (Default False)
+         * *priority* -- RequestQueuer priority level (Default None)
         """
         bucket = convertToUTF8(bucket)
         key = convertToUTF8(key)
@@ -306,9 +320,10 @@ class AmazonS3:
                                       headers, path)
         headers.update(auth)
         url = "http://%s/%s/%s" % (self.host, bucket, key)
-        d = self.rq.getPage(url, method="PUT", headers=headers, postdata=data)
+        d = self.rq.getPage(url, method="PUT", headers=headers, postdata=data,
+                            priority=priority, max_retries=self.max_retries)
         d.addErrback(self._genericErrback, url, method="PUT", headers=headers, 
-                     postdata=data)
+                     postdata=data, priority=priority)
         return d
 
     def deleteObject(self, bucket, key):
@@ -324,13 +339,14 @@ class AmazonS3:
         path = "/" + bucket + "/" + key
         headers = self._getAuthorization("DELETE", "", "", {}, path)
         url = "http://%s/%s/%s" % (self.host, bucket, key)
-        d = self.rq.getPage(url, method="DELETE", headers=headers)
+        d = self.rq.getPage(url, method="DELETE", headers=headers,
+                            max_retries=self.max_retries)
         d.addErrback(self._genericErrback, url, method="DELETE", 
                      headers=headers)
         return d
            
     def _genericErrback(self, error, url, method="GET", headers=None,
-                        postdata=None, count=0):
+                        postdata=None, count=0, priority=None):
         if headers is None:
             headers = {}
         if "status" in error.value.__dict__:
@@ -345,12 +361,14 @@ class AmazonS3:
                     }
             # Something other than a 40x error. Something is wrong, but let's
             # try that again a few times.          
+            # Requests retried by the RequestQueuer are not retried again.
             elif int(error.value.status) not in self.ACCEPTABLE_ERROR_CODES \
-                 and count < 3:
+                 and count < 3 and self.max_retries == 0:
                 d = self.rq.getPage(url,       
                                     method=method,
                                     headers=headers,
-                                    postdata=postdata
+                                    postdata=postdata,
+                                    priority=priority
                                     )
                                    
                 d.addErrback(self._genericErrback,
@@ -358,7 +376,8 @@ class AmazonS3:
                                 method=method,
                                 headers=headers,
                                 postdata=postdata,
-                                count=count + 1
+                                count=count + 1,
+                                priority=priority
                                 )
                 return d
             # 404 or other normal error, pass it along.
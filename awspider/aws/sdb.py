@@ -135,7 +135,8 @@ class AmazonSDB:
     host = "sdb.amazonaws.com"
     box_usage = 0.0
    
-    def __init__(self, aws_access_key_id, aws_secret_access_key, rq=None):
+    def __init__(self, aws_access_key_id, aws_secret_access_key, rq=None,
+                 max_retries=0, hedge=False):
         """
         **Arguments:**
          * *aws_access_key_id* -- Amazon AWS access key ID
@@ -143,7 +144,13 @@ class AmazonSDB:
        
         **Keyword arguments:**
          * *rq* -- Optional RequestQueuer object.
+         * *max_retries* -- Number of times the RequestQueuer retries a 
+           failed request, with backoff. (Default 0)
+         * *hedge* -- Hedge select requests against tail latency. See 
+           ``RequestQueuer.getPage()``. (Default False)
         """
+        self.max_retries = max_retries
+        self.hedge = hedge
         if rq is None:
             self.rq = RequestQueuer()
         else:
@@ -626,7 +633,7 @@ class AmazonSDB:
         parameters["SelectExpression"] = select_expression
         if next_token is not None:
             parameters["NextToken"] = next_token
-        d = self._request(parameters)
+        d = self._request(parameters, hedge=self.hedge)
         d.addCallback(self._selectCountCallback, 
                       select_expression=select_expression,
                       previous_count=previous_count,
@@ -665,7 +672,7 @@ class AmazonSDB:
         parameters["SelectExpression"] = select_expression
         if next_token is not None:
             parameters["NextToken"] = next_token
-        d = self._request(parameters)
+        d = self._request(parameters, hedge=self.hedge)
         d.addCallback(self._selectCallback, 
                       select_expression=select_expression,
                       previous_results=previous_results,
@@ -715,12 +722,16 @@ class AmazonSDB:
             total_box_usage))
         return results       
 
-    def _request(self, parameters):
+    def _request(self, parameters, hedge=False):
         """
         Add authentication parameters and make request to Amazon.
        
         **Arguments:**
          * *parameters* -- Key value pairs of parameters
+
+        **Keyword arguments:**
+         * *hedge* -- Hedge the request against tail latency. Only for 
+           requests without side effects. (Default False)
         """
         parameters = self._getAuthorization("GET", parameters)
         query_string = urllib.urlencode(parameters)       
@@ -730,10 +741,14 @@ class AmazonSDB:
             parameters = self._getAuthorization("POST", parameters)
             query_string = urllib.urlencode(parameters)       
             url = "https://%s" % (self.host)
-            d = self.rq.getPage(url, method="POST", postdata=query_string)
+            # SimpleDB actions are safe to repeat, even when POSTed.
+            d = self.rq.getPage(url, method="POST", postdata=query_string,
+                                max_retries=self.max_retries, idempotent=True,
+                                hedge=hedge)
             return d
         else:
-            d = self.rq.getPage(url, method="GET")
+            d = self.rq.getPage(url, method="GET", 
+                                max_retries=self.max_retries, hedge=hedge)
             return d
          
     def _canonicalize(self, parameters):
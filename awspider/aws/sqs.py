@@ -11,6 +11,10 @@ from .lib import return_true, safe_quote_tuple
 
 
 SQS_NAMESPACE = "{http://queue.amazonaws.com/doc/2009-02-01/}"
+# Actions that only read state, and can be retried. Retrying others could 
+# send a message twice or lose received messages to the visibility 
+# timeout.
+READ_ONLY_ACTIONS = ["ListQueues", "GetQueueAttributes"]
 
 
 class AmazonSQS:
@@ -21,7 +25,8 @@ class AmazonSQS:
    
     host = "queue.amazonaws.com"
    
-    def __init__(self, aws_access_key_id, aws_secret_access_key, rq=None):
+    def __init__(self, aws_access_key_id, aws_secret_access_key, rq=None,
+                 max_retries=0):
         """
         **Arguments:**
          * *aws_access_key_id* -- Amazon AWS access key ID string
@@ -29,7 +34,10 @@ class AmazonSQS:
        
         **Keyword arguments:**
          * *rq* -- Optional RequestQueuer object.
+         * *max_retries* -- Number of times the RequestQueuer retries a 
+           failed request that only reads state, with backoff. (Default 0)
         """
+        self.max_retries = max_retries
         if rq is None:
             self.rq = RequestQueuer()
         else:
@@ -492,6 +500,7 @@ class AmazonSQS:
          * Deferred of server response.
         """
 
+        idempotent = parameters["Action"] in READ_ONLY_ACTIONS
         parameters = self._getAuthorization(method, parameters, 
                                             resource=resource)
            
@@ -501,7 +510,8 @@ class AmazonSQS:
        
         #print url
        
-        d = self.rq.getPage(url, method=method)
+        d = self.rq.getPage(url, method=method, max_retries=self.max_retries,
+            idempotent=idempotent)
         return d
 
     def _getAuthorization(self, method, parameters, resource="/"):
@@ -0,0 +1,141 @@
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+
+class BulkFetch(object):
+
+    """
+    Requests pages for an iterable of URLs with a limited number in
+    flight, handing each result to a callback as it arrives. URLs are
+    read from the iterable only as slots free up.
+    """
+
+    def __init__(self,
+                 get_page,
+                 urls,
+                 callback,
+                 errback=None,
+                 max_in_flight=10,
+                 request_kwargs=None):
+        """
+        **Arguments:**
+         * *get_page* -- Function that requests a URL and returns a
+           Deferred, such as ``RequestQueuer.getPage``.
+         * *urls* -- Iterable of URLs, or of ``(url, kwargs)`` tuples of
+           URLs and keyword arguments for that request.
+         * *callback* -- Called with each result and its URL. If it
+           returns a Deferred, the URL's slot is held until it fires.
+
+        **Keyword arguments:**
+         * *errback* -- Called with each failure and its URL. If
+           ``None``, the first failure stops new requests and fails
+           the Deferred returned by ``start()``. (Default ``None``)
+         * *max_in_flight* -- Maximum number of URLs requested, or held by
+           *callback*, at once. (Default 10)
+         * *request_kwargs* -- Dictionary of keyword arguments for every
+           request. (Default ``None``)
+        """
+        self.get_page = get_page
+        self.urls = iter(urls)
+        self.callback = callback
+        self.errback = errback
+        self.max_in_flight = max(1, int(max_in_flight))
+        if request_kwargs is None:
+            request_kwargs = {}
+        self.request_kwargs = request_kwargs
+        self.deferred = Deferred(self._cancel)
+        # Set of Deferreds of URLs in flight.
+        self.active = set()
+        self.count = 0
+        self.exhausted = False
+        self.stopped = False
+        self.error = None
+        # Results that arrive synchronously while requests are being
+        # started make _fill() loop instead of recursing.
+        self.filling = False
+        self.refill = False
+
+    def start(self):
+        """
+        Start requesting URLs. Returns a Deferred that fires with the
+        number of URLs requested once every result has been handled.
+        """
+        self._fill()
+        return self.deferred
+
+    def _fill(self):
+        if self.filling:
+            self.refill = True
+            return
+        self.filling = True
+        self.refill = True
+        try:
+            while self.refill:
+                self.refill = False
+                while not self.exhausted and not self.stopped and \
+                        len(self.active) < self.max_in_flight:
+                    try:
+                        item = self.urls.next()
+                    except StopIteration:
+                        self.exhausted = True
+                        break
+                    except Exception:
+                        # Fails once the URLs in flight are handled.
+                        self._stop(Failure())
+                        break
+                    self._request(item)
+        finally:
+            self.filling = False
+        self._checkDone()
+
+    def _request(self, item):
+        if isinstance(item, tuple):
+            url, item_kwargs = item
+            kwargs = dict(self.request_kwargs)
+            kwargs.update(item_kwargs)
+        else:
+            url = item
+            kwargs = self.request_kwargs
+        self.count += 1
+        d = maybeDeferred(self.get_page, url, **kwargs)
+        self.active.add(d)
+        d.addCallbacks(self.callback, self._requestErrback,
+            callbackArgs=(url,), errbackArgs=(url,))
+        d.addBoth(self._requestFinished, d)
+
+    def _requestErrback(self, error, url):
+        if self.errback is None:
+            return error
+        return self.errback(error, url)
+
+    def _requestFinished(self, result, d):
+        self.active.discard(d)
+        if isinstance(result, Failure):
+            self._stop(result)
+        self._fill()
+        return None
+
+    def _stop(self, error):
+        if self.error is not None or self.deferred.called:
+            return
+        LOGGER.debug("Stopping bulk fetch: %s" % error)
+        self.error = error
+        self.stopped = True
+
+    def _checkDone(self):
+        if len(self.active) > 0 or self.deferred.called:
+            return
+        if self.error is not None:
+            self.deferred.errback(self.error)
+        elif self.exhausted or self.stopped:
+            self.deferred.callback(self.count)
+
+    def _cancel(self, deferred):
+        # The Deferred errbacks with CancelledError once this returns.
+        self.stopped = True
+        for d in list(self.active):
+            d.cancel()
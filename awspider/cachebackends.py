@@ -0,0 +1,365 @@
+import time
+import cPickle
+from twisted.internet import reactor, protocol
+from twisted.internet.defer import Deferred, succeed
+from twisted.protocols.memcache import MemCacheProtocol, DEFAULT_PORT
+from .exceptions import CacheMissException
+from .localcache import LocalCache
+from .requestqueuer import PRIORITY_CACHE_WRITE
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+
+def _getHeaders(content_type, headers):
+    if headers is None:
+        headers = {}
+    headers = dict([(x, [headers[x]]) for x in headers])
+    headers["content-type"] = [content_type]
+    return headers
+
+
+class CacheBackend(object):
+
+    """
+    Store of HTTP cache entries used by PageGetter. Every method returns a
+    Deferred. Entries that do not exist fail with ``CacheMissException``.
+    Results are dictionaries like those of ``AmazonS3.getObject()``, with
+    a ``headers`` dictionary of lists of header values and a ``response``
+    body.
+    """
+
+    def getMetadata(self, key):
+        """
+        Get the headers of an entry. The ``response`` of the result is
+        empty.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        raise NotImplementedError()
+
+    def get(self, key):
+        """
+        Get the headers and body of an entry.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        raise NotImplementedError()
+
+    def put(self, key, data, content_type="text/html", headers=None):
+        """
+        Store an entry, replacing any entry with the same key.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+         * *data* -- Body string.
+
+        **Keyword arguments:**
+         * *content_type* -- Content type header. (Default 'text/html')
+         * *headers* -- Dictionary of strings to store with the body.
+           (Default ``None``)
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """
+        Remove an entry.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        raise NotImplementedError()
+
+
+class S3CacheBackend(CacheBackend):
+
+    """
+    Stores entries as objects in an S3 bucket, with headers as object
+    metadata. Shared by every server using the bucket.
+    """
+
+    def __init__(self, s3, bucket):
+        """
+        **Arguments:**
+         * *s3* -- S3 client object.
+         * *bucket* -- S3 bucket to use for the HTTP cache.
+        """
+        self.s3 = s3
+        self.bucket = bucket
+
+    def getMetadata(self, key):
+        return self.s3.headObject(self.bucket, key)
+
+    def get(self, key):
+        return self.s3.getObject(self.bucket, key)
+
+    def put(self, key, data, content_type="text/html", headers=None):
+        return self.s3.putObject(
+            self.bucket,
+            key,
+            data,
+            content_type=content_type,
+            headers=headers,
+            priority=PRIORITY_CACHE_WRITE)
+
+    def delete(self, key):
+        return self.s3.deleteObject(self.bucket, key)
+
+    def clear(self):
+        return self.s3.emptyBucket(self.bucket)
+
+
+class MemoryCacheBackend(CacheBackend):
+
+    """
+    Stores entries in memory, bounded in bytes with least recently used
+    entries evicted first. Useful for single servers and benchmarks that
+    run without S3.
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        """
+        **Keyword arguments:**
+         * *max_size* -- Maximum bytes of bodies and headers stored.
+           (Default 64MB)
+        """
+        self.cache = LocalCache(max_memory_size=max_size)
+
+    def getMetadata(self, key):
+        d = self.cache.getHeaders(key)
+        d.addCallback(self._getMetadataCallback, key)
+        return d
+
+    def _getMetadataCallback(self, headers, key):
+        if headers is None:
+            raise CacheMissException(key)
+        return {"headers":headers, "response":"", "status":"200"}
+
+    def get(self, key):
+        d = self.cache.get(key)
+        d.addCallback(self._getCallback, key)
+        return d
+
+    def _getCallback(self, entry, key):
+        if entry is None:
+            raise CacheMissException(key)
+        return {
+            "headers":entry[0],
+            "response":entry[1],
+            "status":"200"}
+
+    def put(self, key, data, content_type="text/html", headers=None):
+        d = self.cache.put(key, _getHeaders(content_type, headers), data)
+        d.addCallback(self._putCallback)
+        return d
+
+    def _putCallback(self, data):
+        return True
+
+    def delete(self, key):
+        self.cache.delete(key)
+        return succeed(True)
+
+    def clear(self):
+        self.cache.clear()
+        return succeed(True)
+
+
+class FilesystemCacheBackend(MemoryCacheBackend):
+
+    """
+    Stores entries as files in a local directory, bounded in bytes with
+    least recently used entries deleted first. Entries survive restarts.
+    """
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        """
+        **Arguments:**
+         * *directory* -- Directory of the cache. Created if it does not
+           exist.
+
+        **Keyword arguments:**
+         * *max_size* -- Maximum bytes of entries stored. (Default 1GB)
+        """
+        self.cache = LocalCache(
+            max_memory_size=0,
+            directory=directory,
+            max_disk_size=max_size)
+
+
+class MemcachedCacheBackend(CacheBackend):
+
+    """
+    Stores entries in memcached, each as a single pickled value of headers
+    and body. Entries over the server's item size limit (usually 1MB) are
+    not stored.
+
+    Keys include a generation number stored on the server, which 
+    ``clear()`` increments. Processes sharing the server read it when they
+    connect.
+    """
+
+    def __init__(self,
+                 host="127.0.0.1",
+                 port=DEFAULT_PORT,
+                 key_prefix="awspider_",
+                 expiration=60 * 60 * 24 * 7):
+        """
+        **Keyword arguments:**
+         * *host* -- Memcached host. (Default ``'127.0.0.1'``)
+         * *port* -- Memcached port. (Default 11211)
+         * *key_prefix* -- String prepended to cache keys, to share a
+           memcached server. (Default ``'awspider_'``)
+         * *expiration* -- Seconds entries are stored, 0 for no
+           expiration. (Default 604800)
+        """
+        self.host = host
+        self.port = port
+        self.key_prefix = key_prefix
+        self.expiration = expiration
+        self.memc_ClientCreator = protocol.ClientCreator(
+            reactor, MemCacheProtocol)
+        self.memc = None
+        self.generation = None
+        # List of Deferreds waiting on the connection, or None if it is 
+        # not being made.
+        self.pending_connection = None
+
+    def _getClient(self):
+        # Connects on first use, and again after the connection drops.
+        if self.memc is not None and not self.memc._disconnected and \
+                self.generation is not None:
+            return succeed(self.memc)
+        d = Deferred()
+        if self.pending_connection is not None:
+            self.pending_connection.append(d)
+            return d
+        self.pending_connection = [d]
+        if self.memc is not None and not self.memc._disconnected:
+            connection = succeed(self.memc)
+        else:
+            LOGGER.info("Connecting to memcached at %s:%s." % (
+                self.host,
+                self.port))
+            self.generation = None
+            connection = self.memc_ClientCreator.connectTCP(
+                self.host, 
+                self.port)
+        connection.addCallback(self._getClientCallback)
+        connection.addCallbacks(self._getClientCallback2, 
+            self._getClientErrback)
+        return d
+
+    def _getClientCallback(self, memc):
+        self.memc = memc
+        return self._getGeneration()
+
+    def _getClientCallback2(self, generation):
+        self.generation = generation
+        pending_connection = self.pending_connection
+        self.pending_connection = None
+        for d in pending_connection:
+            d.callback(self.memc)
+
+    def _getClientErrback(self, error):
+        pending_connection = self.pending_connection
+        self.pending_connection = None
+        for d in pending_connection:
+            d.errback(error)
+
+    def _getGeneration(self):
+        d = self.memc.get(self.key_prefix + "generation")
+        d.addCallback(self._getGenerationCallback)
+        return d
+
+    def _getGenerationCallback(self, data):
+        flags, generation = data
+        if generation is not None:
+            return generation
+        # A new or evicted generation starts from the time, so it is 
+        # unlikely to reuse an old generation's keys.
+        generation = str(int(time.time()))
+        d = self.memc.add(self.key_prefix + "generation", generation)
+        d.addCallback(self._getGenerationCallback2, generation)
+        return d
+
+    def _getGenerationCallback2(self, stored, generation):
+        if stored:
+            return generation
+        # Another process added it first.
+        return self._getGeneration()
+
+    def _call(self, method, key, *args):
+        d = self._getClient()
+        d.addCallback(self._callCallback, method, key, args)
+        return d
+
+    def _callCallback(self, memc, method, key, args):
+        key = "%s%s_%s" % (self.key_prefix, self.generation, key)
+        return getattr(memc, method)(key, *args)
+
+    def getMetadata(self, key):
+        d = self.get(key)
+        d.addCallback(self._getMetadataCallback)
+        return d
+
+    def _getMetadataCallback(self, data):
+        data["response"] = ""
+        return data
+
+    def get(self, key):
+        d = self._call("get", key)
+        d.addCallback(self._getCallback, key)
+        return d
+
+    def _getCallback(self, data, key):
+        flags, value = data
+        if value is None:
+            raise CacheMissException(key)
+        headers, response = cPickle.loads(value)
+        return {"headers":headers, "response":response, "status":"200"}
+
+    def put(self, key, data, content_type="text/html", headers=None):
+        value = cPickle.dumps(
+            (_getHeaders(content_type, headers), data),
+            cPickle.HIGHEST_PROTOCOL)
+        return self._call("set", key, value, 0, self.expiration)
+
+    def delete(self, key):
+        return self._call("delete", key)
+
+    def clear(self):
+        # Memcached cannot list keys, and flushing would remove other
+        # users' keys, so entries are left under the old generation until
+        # they expire or are evicted.
+        d = self._getClient()
+        d.addCallback(self._clearCallback)
+        return d
+
+    def _clearCallback(self, memc):
+        d = memc.increment(self.key_prefix + "generation")
+        d.addCallback(self._clearCallback2)
+        return d
+
+    def _clearCallback2(self, generation):
+        if generation is False:
+            # Evicted.
+            generation = max(int(time.time()), int(self.generation) + 1)
+            d = self.memc.set(self.key_prefix + "generation", 
+                str(generation))
+            d.addCallback(self._clearCallback3, generation)
+            return d
+        return self._clearCallback3(True, generation)
+
+    def _clearCallback3(self, stored, generation):
+        self.generation = str(generation)
+        return None
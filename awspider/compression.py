@@ -0,0 +1,65 @@
+import bz2
+import zlib
+
+
+# Dictionary of (compress, decompress) functions, by codec name. Compress
+# functions take data and a compression level from 1 to 9.
+CODECS = {
+    "zlib":(zlib.compress, zlib.decompress),
+    "bz2":(bz2.compress, bz2.decompress)}
+
+# Media types worth compressing besides text/*, +xml and +json types.
+COMPRESSIBLE_CONTENT_TYPES = [
+    "application/json",
+    "application/javascript",
+    "application/x-javascript",
+    "application/ecmascript",
+    "application/xml",
+    "application/xhtml+xml",
+    "application/x-www-form-urlencoded",
+    "image/svg+xml"]
+
+
+def isCompressible(content_type):
+    """
+    Return True if bodies of a content type are usually text that
+    compresses well, and False for media that is already compressed.
+
+    **Arguments:**
+     * *content_type* -- Content type header.
+       (Example, ``"text/html; charset=UTF-8"``)
+    """
+    if content_type is None:
+        return False
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type.startswith("text/"):
+        return True
+    if media_type.endswith("+xml") or media_type.endswith("+json"):
+        return True
+    return media_type in COMPRESSIBLE_CONTENT_TYPES
+
+
+def compress(codec, data, level=6):
+    """
+    Compress a string.
+
+    **Arguments:**
+     * *codec* -- Name of a codec in ``CODECS``. (Example, ``"zlib"``)
+     * *data* -- String to compress.
+
+    **Keyword arguments:**
+     * *level* -- Compression level, 1 for fastest to 9 for smallest.
+       (Default 6)
+    """
+    return CODECS[codec][0](data, level)
+
+
+def decompress(codec, data):
+    """
+    Decompress a string compressed with ``compress()``.
+
+    **Arguments:**
+     * *codec* -- Name of a codec in ``CODECS``. (Example, ``"zlib"``)
+     * *data* -- Compressed string.
+    """
+    return CODECS[codec][1](data)
@@ -0,0 +1,142 @@
+import time
+from twisted.internet.abstract import isIPAddress
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.internet.error import DNSLookupError
+from twisted.names import dns
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+
+class DNSCache(object):
+
+    """
+    Asynchronous hostname cache that honors record TTLs and caches failed
+    lookups for a short time.
+    """
+
+    def __init__(self,
+                 resolver=None,
+                 negative_ttl=30,
+                 min_ttl=0,
+                 max_ttl=3600,
+                 max_entries=10000):
+        """
+        **Keyword arguments:**
+         * *resolver* -- A ``twisted.names`` resolver. If ``None``, the
+           system resolver from ``twisted.names.client.getResolver()`` is
+           used. (Default ``None``)
+         * *negative_ttl* -- Seconds a failed lookup is cached. (Default 30)
+         * *min_ttl* -- Lower bound on cached record TTLs, in seconds.
+           (Default 0)
+         * *max_ttl* -- Upper bound on cached record TTLs, in seconds.
+           (Default 3600)
+         * *max_entries* -- Maximum number of hostnames cached. (Default
+           10000)
+        """
+        self.resolver = resolver
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        # Dictionary of (address, expiration timestamp), by hostname.
+        # Failed lookups are stored with an address of None.
+        self.cache = {}
+        # Dictionary of lists of Deferreds waiting on a lookup, by hostname.
+        self.pending_lookups = {}
+
+    def _getResolver(self):
+        if self.resolver is None:
+            from twisted.names import client
+            self.resolver = client.getResolver()
+        return self.resolver
+
+    def getCachedHostByName(self, name):
+        """
+        Return the cached address for a hostname, or ``None`` if it is not
+        cached, has expired or failed to resolve.
+
+        **Arguments:**
+         * *name* -- Hostname. (Example, ``"google.com"``)
+        """
+        if isIPAddress(name):
+            return name
+        if name in self.cache:
+            address, expires = self.cache[name]
+            if expires > time.time():
+                return address
+        return None
+
+    def getHostByName(self, name):
+        """
+        Resolve a hostname to an IPv4 address. Returns a Deferred.
+
+        **Arguments:**
+         * *name* -- Hostname. (Example, ``"google.com"``)
+        """
+        if isIPAddress(name):
+            return succeed(name)
+        if name in self.cache:
+            address, expires = self.cache[name]
+            if expires > time.time():
+                if address is None:
+                    return fail(DNSLookupError(
+                        "address %r not found (cached)" % name))
+                return succeed(address)
+            del self.cache[name]
+        d = Deferred()
+        if name in self.pending_lookups:
+            self.pending_lookups[name].append(d)
+            return d
+        self.pending_lookups[name] = [d]
+        lookup = self._getResolver().lookupAddress(name)
+        lookup.addCallback(self._lookupCallback, name)
+        lookup.addErrback(self._lookupErrback, name)
+        return d
+
+    def prefetch(self, name):
+        """
+        Start resolving a hostname if its address is not cached, so a later
+        ``getHostByName()`` does not wait on the resolver.
+
+        **Arguments:**
+         * *name* -- Hostname. (Example, ``"google.com"``)
+        """
+        if name in self.pending_lookups:
+            return
+        if name in self.cache and self.cache[name][1] > time.time():
+            return
+        d = self.getHostByName(name)
+        d.addErrback(self._prefetchErrback, name)
+
+    def _prefetchErrback(self, error, name):
+        LOGGER.debug("Could not prefetch address for %s: %s" % (name, error))
+        return None
+
+    def _lookupCallback(self, result, name):
+        answers = result[0]
+        records = [x for x in answers if x.type == dns.A]
+        if len(records) == 0:
+            return self._lookupErrback(None, name)
+        address = records[0].payload.dottedQuad()
+        ttl = min([x.ttl for x in records])
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        self._cacheAddress(name, address, ttl)
+        for d in self.pending_lookups.pop(name):
+            d.callback(address)
+
+    def _lookupErrback(self, error, name):
+        self._cacheAddress(name, None, self.negative_ttl)
+        for d in self.pending_lookups.pop(name):
+            d.errback(DNSLookupError("address %r not found" % name))
+
+    def _cacheAddress(self, name, address, ttl):
+        now = time.time()
+        if name not in self.cache and len(self.cache) >= self.max_entries:
+            for key in self.cache.keys():
+                if self.cache[key][1] <= now:
+                    del self.cache[key]
+            if len(self.cache) >= self.max_entries:
+                self.cache.clear()
+        self.cache[name] = (address, now + ttl)
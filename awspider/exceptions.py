@@ -2,4 +2,13 @@ class DeleteReservationException(Exception):
     pass
 
 class StaleContentException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class CircuitOpenException(Exception):
+    pass
+
+class RobotsDisallowedException(Exception):
+    pass
+
+class CacheMissException(Exception):
+    pass
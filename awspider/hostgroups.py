@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from twisted.internet.abstract import isIPAddress
+from twisted.internet.defer import succeed
+from .dnscache import DNSCache
+import logging
+
+# Full public suffix matching, if installed.
+# Available from http://pypi.python.org/pypi/publicsuffix
+try:
+    import publicsuffix
+except ImportError:
+    publicsuffix = None
+
+
+LOGGER = logging.getLogger("main")
+
+# Common public suffixes with more than one label, used when neither a
+# public suffix list file nor the publicsuffix package is available. Any
+# single label top level domain is treated as a public suffix.
+PUBLIC_SUFFIXES = [
+    "ac.uk", "co.uk", "gov.uk", "ltd.uk", "me.uk", "net.uk", "org.uk",
+    "plc.uk", "sch.uk",
+    "com.au", "edu.au", "gov.au", "id.au", "net.au", "org.au",
+    "co.nz", "govt.nz", "net.nz", "org.nz",
+    "ac.jp", "co.jp", "go.jp", "ne.jp", "or.jp",
+    "co.kr", "or.kr",
+    "com.cn", "edu.cn", "gov.cn", "net.cn", "org.cn",
+    "com.hk", "com.sg", "com.tw", "com.my",
+    "co.in", "firm.in", "gen.in", "ind.in", "net.in", "org.in",
+    "co.za", "org.za",
+    "com.br", "net.br", "org.br",
+    "com.ar", "com.mx", "com.tr", "com.ua", "co.il",
+    "appspot.com", "blogspot.com", "cloudfront.net", "github.io",
+    "herokuapp.com", "s3.amazonaws.com"]
+
+
+class ExactHostGrouping(object):
+
+    """
+    Groups requests by exact hostname.
+    """
+
+    def getHostGroup(self, host):
+        """
+        Return a Deferred that fires with the group of a hostname.
+
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"www.google.com"``)
+        """
+        return succeed(self.getCachedHostGroup(host))
+
+    def getCachedHostGroup(self, host):
+        """
+        Return the group of a hostname, or ``None`` if it is not known
+        without a lookup.
+
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"www.google.com"``)
+        """
+        return host
+
+
+class RegisteredDomainGrouping(ExactHostGrouping):
+
+    """
+    Groups requests by registered domain, one label below the hostname's
+    public suffix. ``a.example.co.uk`` and ``b.example.co.uk`` are both in
+    ``example.co.uk``.
+    """
+
+    def __init__(self, public_suffix_list=None, max_entries=10000):
+        """
+        **Keyword arguments:**
+         * *public_suffix_list* -- Path to a public suffix list file, in
+           the format of http://publicsuffix.org/list/ If ``None``, the
+           publicsuffix package is used if it is installed, otherwise a
+           short built in list of common suffixes. (Default ``None``)
+         * *max_entries* -- Maximum number of hostnames whose registered
+           domain is cached. Least recently used hostnames are evicted
+           first. (Default 10000)
+        """
+        self.max_entries = max_entries
+        self.psl = None
+        # Sets of public suffix rules, wildcard rules without their
+        # leading "*." and exception rules without their leading "!".
+        self.rules = set()
+        self.wildcard_rules = set()
+        self.exception_rules = set()
+        if public_suffix_list is not None:
+            self._loadRules(open(public_suffix_list))
+        elif publicsuffix is not None:
+            self.psl = publicsuffix.PublicSuffixList()
+        else:
+            self.rules.update(PUBLIC_SUFFIXES)
+        # Ordered dictionary of registered domains, by hostname, from 
+        # least to most recently used.
+        self.cache = OrderedDict()
+
+    def _loadRules(self, lines):
+        for line in lines:
+            rule = line.strip().split()[0:1]
+            if len(rule) == 0 or rule[0].startswith("//"):
+                continue
+            rule = rule[0].lower()
+            if rule.startswith("!"):
+                self.exception_rules.add(rule[1:])
+            elif rule.startswith("*."):
+                self.wildcard_rules.add(rule[2:])
+            else:
+                self.rules.add(rule)
+
+    def getCachedHostGroup(self, host):
+        host = host.lower().rstrip(".")
+        if host in self.cache:
+            domain = self.cache.pop(host)
+        else:
+            domain = self._getRegisteredDomain(host)
+            if len(self.cache) >= self.max_entries:
+                self.cache.popitem(last=False)
+        self.cache[host] = domain
+        return domain
+
+    def _getRegisteredDomain(self, host):
+        if isIPAddress(host) or "." not in host:
+            return host
+        if self.psl is not None:
+            return self.psl.get_public_suffix(host)
+        labels = host.split(".")
+        # Length, in labels, of the longest matching public suffix.
+        suffix_length = 1
+        for i in range(len(labels) - 1, -1, -1):
+            suffix = ".".join(labels[i:])
+            if suffix in self.exception_rules:
+                suffix_length = len(labels) - i - 1
+                break
+            if suffix in self.rules:
+                suffix_length = len(labels) - i
+            elif i > 0 and suffix in self.wildcard_rules:
+                suffix_length = len(labels) - i + 1
+        if suffix_length >= len(labels):
+            return host
+        return ".".join(labels[-suffix_length - 1:])
+
+
+class ResolvedAddressGrouping(ExactHostGrouping):
+
+    """
+    Groups requests by the IPv4 address their hostname resolves to, so
+    virtual hosts sharing a server share its limits.
+    """
+
+    def __init__(self, dns_cache=None):
+        """
+        **Keyword arguments:**
+         * *dns_cache* -- DNSCache object used to resolve hostnames. If
+           ``None``, one is created. (Default ``None``)
+        """
+        if dns_cache is None:
+            dns_cache = DNSCache()
+        self.dns_cache = dns_cache
+
+    def getHostGroup(self, host):
+        return self.dns_cache.getHostByName(host)
+
+    def getCachedHostGroup(self, host):
+        return self.dns_cache.getCachedHostByName(host)
@@ -0,0 +1,379 @@
+import os
+import cPickle
+import tempfile
+from collections import OrderedDict
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+# Entries are written to uniquely named temporary files starting with 
+# this prefix, then renamed. Cache keys never start with a dot.
+TEMPORARY_FILE_PREFIX = ".localcache-"
+
+
+def _copyHeaders(headers):
+    return dict([(x, list(headers[x])) for x in headers])
+
+
+def _getHeadersSize(headers):
+    size = 0
+    for key in headers:
+        size += len(key) + sum([len(x) for x in headers[key]])
+    return size
+
+
+def _scanDirectory(directory):
+    """
+    Return a list of (modification time, filename, size) tuples of the 
+    entries in a directory, oldest first. Run in a thread.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    files = []
+    for path, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.startswith(TEMPORARY_FILE_PREFIX) or \
+                    filename.endswith(".tmp"):
+                # Left by an interrupted write.
+                _removeFile(os.path.join(path, filename))
+                continue
+            filename = os.path.join(path, filename)
+            stat = os.stat(filename)
+            files.append((stat.st_mtime, filename, stat.st_size))
+    files.sort()
+    return files
+
+
+def _readFile(filename, read_body):
+    """
+    Return a tuple of the headers and body of an entry file. The body is
+    ``None`` if *read_body* is False. Run in a thread.
+    """
+    f = open(filename, "rb")
+    try:
+        headers = cPickle.load(f)
+        if read_body:
+            body = f.read()
+        else:
+            body = None
+    finally:
+        f.close()
+    os.utime(filename, None)
+    return (headers, body)
+
+
+def _writeFile(filename, data, body):
+    """
+    Write an entry file. Run in a thread.
+    """
+    # Written to a temporary file of its own and renamed, so readers never
+    # see a partial entry, and simultaneous writes of a key never share a
+    # file.
+    directory = os.path.dirname(filename)
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    fd, temporary_filename = tempfile.mkstemp(
+        prefix=TEMPORARY_FILE_PREFIX, 
+        dir=directory)
+    try:
+        f = os.fdopen(fd, "wb")
+        try:
+            f.write(data)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(temporary_filename, filename)
+    except:
+        _removeFile(temporary_filename)
+        raise
+
+
+def _removeFile(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class LocalCache(object):
+
+    """
+    Two tier cache of HTTP cache entries on this node: a memory LRU and an
+    optional directory on disk, both bounded in bytes. Entries are a
+    dictionary of lists of header values, like those returned by
+    ``AmazonS3.headObject()``, and a body.
+
+    Files of the disk tier are read, written and scanned in threads, so 
+    lookups return Deferreds.
+    """
+
+    def __init__(self,
+                 max_memory_size=64 * 1024 * 1024,
+                 directory=None,
+                 max_disk_size=1024 * 1024 * 1024):
+        """
+        **Keyword arguments:**
+         * *max_memory_size* -- Maximum bytes of bodies and headers held in
+           memory. Least recently used entries are evicted first.
+           (Default 64MB)
+         * *directory* -- Directory of the disk tier. If ``None``, only
+           memory is used. Entries already in the directory are loaded in
+           the background, and are misses until ``waitForLoad()`` fires.
+           (Default ``None``)
+         * *max_disk_size* -- Maximum bytes of entries held on disk. Least
+           recently used entries are deleted first. (Default 1GB)
+        """
+        self.max_memory_size = max_memory_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        # Ordered dictionaries of (headers, body) tuples and of file
+        # sizes, by key, from least to most recently used.
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.disk = OrderedDict()
+        self.disk_size = 0
+        self.hits = 0
+        self.misses = 0
+        # Incremented by clear(), so writes started before it are undone.
+        self.generation = 0
+        # List of Deferreds waiting on the directory to load, or None once
+        # it has loaded.
+        self.pending_load = None
+        if self.directory is not None:
+            self._loadDirectory()
+
+    def _loadDirectory(self):
+        self.pending_load = []
+        d = deferToThread(_scanDirectory, self.directory)
+        d.addCallbacks(self._loadDirectoryCallback, 
+            self._loadDirectoryErrback, callbackArgs=(self.generation,))
+
+    def _loadDirectoryCallback(self, files, generation):
+        # Entries written since the scan started are more recent.
+        disk = OrderedDict()
+        for mtime, filename, size in files:
+            key = os.path.basename(filename)
+            if key in self.disk:
+                continue
+            if generation != self.generation:
+                # Cleared while the directory was scanned.
+                deferToThread(_removeFile, filename)
+                continue
+            disk[key] = size
+            self.disk_size += size
+        disk.update(self.disk)
+        self.disk = disk
+        self._evictDisk()
+        LOGGER.debug("Loaded %s local cache entries, %s bytes, from %s." % (
+            len(self.disk),
+            self.disk_size,
+            self.directory))
+        self._finishLoad()
+
+    def _loadDirectoryErrback(self, error):
+        LOGGER.error("Could not load local cache directory %s: %s" % (
+            self.directory,
+            error))
+        self._finishLoad()
+
+    def _finishLoad(self):
+        pending_load = self.pending_load
+        self.pending_load = None
+        for d in pending_load:
+            d.callback(None)
+
+    def waitForLoad(self):
+        """
+        Return a Deferred that fires once entries already in the directory
+        have been loaded.
+        """
+        if self.pending_load is None:
+            return succeed(None)
+        d = Deferred()
+        self.pending_load.append(d)
+        return d
+
+    def getStats(self):
+        """
+        Return a dictionary of entry counts, sizes, hits and misses.
+        """
+        return {
+            "memory_entries":len(self.memory),
+            "memory_size":self.memory_size,
+            "disk_entries":len(self.disk),
+            "disk_size":self.disk_size,
+            "hits":self.hits,
+            "misses":self.misses}
+
+    def get(self, key):
+        """
+        Return a Deferred that fires with a tuple of a copy of the headers 
+        and the body of an entry, or with ``None`` if it is not cached.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        if key in self.memory:
+            headers, body = self.memory.pop(key)
+            self.memory[key] = (headers, body)
+            self.hits += 1
+            return succeed((_copyHeaders(headers), body))
+        return self._readFile(key, read_body=True)
+
+    def getHeaders(self, key):
+        """
+        Return a Deferred that fires with a copy of the headers of an 
+        entry, or with ``None`` if it is not cached. Reads only the 
+        headers of entries on disk.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        if key in self.memory:
+            headers, body = self.memory.pop(key)
+            self.memory[key] = (headers, body)
+            self.hits += 1
+            return succeed(_copyHeaders(headers))
+        d = self._readFile(key, read_body=False)
+        d.addCallback(self._getHeadersCallback)
+        return d
+
+    def _getHeadersCallback(self, entry):
+        if entry is None:
+            return None
+        return entry[0]
+
+    def put(self, key, headers, body):
+        """
+        Cache an entry, replacing any entry with the same key. Returns a 
+        Deferred that fires once the entry is written to disk.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+         * *headers* -- Dictionary of lists of header values.
+         * *body* -- Body string.
+        """
+        headers = _copyHeaders(headers)
+        self._putMemory(key, headers, body)
+        if self.directory is not None:
+            return self._writeFile(key, headers, body)
+        return succeed(None)
+
+    def delete(self, key):
+        """
+        Remove an entry from both tiers.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        self._deleteMemory(key)
+        self._deleteFile(key)
+
+    def clear(self):
+        """
+        Remove every entry from both tiers.
+        """
+        self.memory.clear()
+        self.memory_size = 0
+        self.generation += 1
+        for key in self.disk.keys():
+            self._deleteFile(key)
+
+    def _putMemory(self, key, headers, body):
+        self._deleteMemory(key)
+        size = len(body) + _getHeadersSize(headers)
+        if size > self.max_memory_size:
+            return
+        self.memory[key] = (headers, body)
+        self.memory_size += size
+        while self.memory_size > self.max_memory_size:
+            evicted_headers, evicted_body = self.memory.popitem(last=False)[1]
+            self.memory_size -= len(evicted_body) + \
+                _getHeadersSize(evicted_headers)
+
+    def _deleteMemory(self, key):
+        if key in self.memory:
+            headers, body = self.memory.pop(key)
+            self.memory_size -= len(body) + _getHeadersSize(headers)
+
+    def _getFilename(self, key):
+        return os.path.join(self.directory, key[0:2], key)
+
+    def _readFile(self, key, read_body=True):
+        if key not in self.disk:
+            self.misses += 1
+            return succeed(None)
+        filename = self._getFilename(key)
+        d = deferToThread(_readFile, filename, read_body)
+        d.addCallbacks(self._readFileCallback, self._readFileErrback, 
+            callbackArgs=(key, read_body), errbackArgs=(key, filename))
+        return d
+
+    def _readFileCallback(self, entry, key, read_body):
+        headers, body = entry
+        if key in self.disk:
+            self.disk[key] = self.disk.pop(key)
+        self.hits += 1
+        if read_body:
+            self._putMemory(key, headers, body)
+        return (_copyHeaders(headers), body)
+
+    def _readFileErrback(self, error, key, filename):
+        error.trap(IOError, OSError, EOFError, cPickle.UnpicklingError)
+        LOGGER.error("Could not read local cache file %s: %s" % (
+            filename,
+            error.value))
+        self._deleteFile(key)
+        self.misses += 1
+        return None
+
+    def _writeFile(self, key, headers, body):
+        filename = self._getFilename(key)
+        data = cPickle.dumps(headers, cPickle.HIGHEST_PROTOCOL)
+        size = len(data) + len(body)
+        if size > self.max_disk_size:
+            self._deleteFile(key)
+            return succeed(None)
+        d = deferToThread(_writeFile, filename, data, body)
+        d.addCallbacks(self._writeFileCallback, self._writeFileErrback, 
+            callbackArgs=(key, size, self.generation), 
+            errbackArgs=(filename,))
+        return d
+
+    def _writeFileCallback(self, data, key, size, generation):
+        if generation != self.generation:
+            # Cleared while the file was written.
+            if key not in self.disk:
+                deferToThread(_removeFile, self._getFilename(key))
+            return None
+        if key in self.disk:
+            self.disk_size -= self.disk.pop(key)
+        self.disk[key] = size
+        self.disk_size += size
+        self._evictDisk()
+        return None
+
+    def _writeFileErrback(self, error, filename):
+        error.trap(IOError, OSError)
+        LOGGER.error("Could not write local cache file %s: %s" % (
+            filename,
+            error.value))
+        return None
+
+    def _deleteFile(self, key):
+        if key not in self.disk:
+            return
+        self.disk_size -= self.disk.pop(key)
+        deferToThread(_removeFile, self._getFilename(key))
+
+    def _evictDisk(self):
+        while self.disk_size > self.max_disk_size:
+            self._deleteFile(iter(self.disk).next())
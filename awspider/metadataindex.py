@@ -0,0 +1,219 @@
+import time
+import cPickle
+import sqlite3
+from collections import OrderedDict
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+
+class MetadataIndex(object):
+
+    """
+    SQLite index of the headers of HTTP cache entries, so freshness can be
+    checked and conditional requests built without reading the cache
+    backend. Holds no bodies, so it can track far more entries than the
+    local cache.
+
+    Lookups are synchronous. Writes are held in memory and committed in
+    batches by one write at a time in a thread, which also prunes the
+    index.
+    """
+
+    # Number of rows deleted per commit when pruning.
+    prune_chunk_size = 1000
+
+    def __init__(self, filename=":memory:", max_entries=1000000):
+        """
+        **Keyword arguments:**
+         * *filename* -- SQLite database file. Created if it does not
+           exist. (Default ``':memory:'``)
+         * *max_entries* -- Maximum number of entries. Least recently
+           written entries are deleted first. (Default 1000000)
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        # Shared with the writing thread. Only one write runs at a time.
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.text_factory = str
+        # The index is a cache, so writes are not synced to disk.
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata "
+            "(key TEXT PRIMARY KEY, headers BLOB, updated REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS "
+            "metadata_updated ON metadata (updated)")
+        self.connection.commit()
+        self.entries = self.connection.execute(
+            "SELECT COUNT(*) FROM metadata").fetchone()[0]
+        # Ordered dictionaries of (pickled headers, timestamp) tuples, or
+        # None for deletions, by key: writes not yet started, and writes
+        # being committed.
+        self.pending_writes = OrderedDict()
+        self.writing = None
+        # Whether a clear() is waiting to be, or being, committed.
+        self.pending_clear = False
+        self.clearing = False
+        # List of Deferreds waiting on pending writes to be committed.
+        self.pending_flush = []
+        if self.entries > self.max_entries:
+            self._write()
+
+    def __len__(self):
+        return self.entries
+
+    def get(self, key):
+        """
+        Return the dictionary of lists of header values of an entry, or
+        ``None`` if it is not indexed.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        if key in self.pending_writes:
+            return self._loadHeaders(self.pending_writes[key])
+        if self.pending_clear:
+            return None
+        if self.writing is not None and key in self.writing:
+            return self._loadHeaders(self.writing[key])
+        if self.clearing:
+            return None
+        row = self.connection.execute(
+            "SELECT headers FROM metadata WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return cPickle.loads(str(row[0]))
+
+    def _loadHeaders(self, write):
+        if write is None:
+            return None
+        return cPickle.loads(write[0])
+
+    def put(self, key, headers):
+        """
+        Index the headers of an entry, replacing any with the same key.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+         * *headers* -- Dictionary of lists of header values.
+        """
+        self.pending_writes.pop(key, None)
+        self.pending_writes[key] = (
+            cPickle.dumps(headers, cPickle.HIGHEST_PROTOCOL),
+            time.time())
+        self._write()
+
+    def delete(self, key):
+        """
+        Remove an entry.
+
+        **Arguments:**
+         * *key* -- Cache key. (Example, a request hash)
+        """
+        self.pending_writes.pop(key, None)
+        self.pending_writes[key] = None
+        self._write()
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        self.pending_writes.clear()
+        self.pending_clear = True
+        self._write()
+
+    def flush(self):
+        """
+        Return a Deferred that fires once pending writes are committed.
+        """
+        if self.writing is None and len(self.pending_writes) == 0 and \
+                not self.pending_clear:
+            return succeed(None)
+        d = Deferred()
+        self.pending_flush.append(d)
+        return d
+
+    def _write(self):
+        if self.writing is not None:
+            # Batched into the next write.
+            return
+        self.writing = self.pending_writes
+        self.pending_writes = OrderedDict()
+        self.clearing = self.pending_clear
+        self.pending_clear = False
+        d = deferToThread(self._writeRows, self.writing.items(),
+            self.clearing, self.entries)
+        d.addCallbacks(self._writeCallback, self._writeErrback)
+
+    def _writeRows(self, rows, clear, entries):
+        """
+        Commit a batch of writes and prune the index. Returns the number
+        of entries. Run in a thread.
+        """
+        try:
+            if clear:
+                self.connection.execute("DELETE FROM metadata")
+                entries = 0
+            for key, write in rows:
+                if write is None:
+                    cursor = self.connection.execute(
+                        "DELETE FROM metadata WHERE key = ?", (key,))
+                    entries -= cursor.rowcount
+                    continue
+                headers = sqlite3.Binary(write[0])
+                cursor = self.connection.execute("UPDATE metadata "
+                    "SET headers = ?, updated = ? WHERE key = ?",
+                    (headers, write[1], key))
+                if cursor.rowcount == 0:
+                    self.connection.execute(
+                        "INSERT INTO metadata (key, headers, updated) "
+                        "VALUES (?, ?, ?)",
+                        (key, headers, write[1]))
+                    entries += 1
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            raise
+        return self._prune(entries)
+
+    def _prune(self, entries):
+        if entries <= self.max_entries:
+            return entries
+        # Deletes a tenth more than needed, so pruning is infrequent, in
+        # chunks so lookups are not held up by one long delete.
+        target = self.max_entries - self.max_entries / 10
+        LOGGER.debug("Pruning %s entries from the metadata index." % (
+            entries - target))
+        while entries > target:
+            count = min(entries - target, self.prune_chunk_size)
+            cursor = self.connection.execute("DELETE FROM metadata WHERE "
+                "key IN (SELECT key FROM metadata ORDER BY updated LIMIT ?)",
+                (count,))
+            self.connection.commit()
+            if cursor.rowcount == 0:
+                break
+            entries -= cursor.rowcount
+        return entries
+
+    def _writeCallback(self, entries):
+        self.entries = entries
+        self._finishWrite()
+
+    def _writeErrback(self, error):
+        LOGGER.error("Could not write to the metadata index %s: %s" % (
+            self.filename,
+            error))
+        self._finishWrite()
+
+    def _finishWrite(self):
+        self.writing = None
+        self.clearing = False
+        if len(self.pending_writes) > 0 or self.pending_clear:
+            self._write()
+            return
+        pending_flush = self.pending_flush
+        self.pending_flush = []
+        for d in pending_flush:
+            d.callback(None)
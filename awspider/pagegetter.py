@@ -6,8 +6,12 @@ import hashlib
 import logging
 import time
 import copy
-from twisted.internet.defer import maybeDeferred
+from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.threads import deferToThread
 from .requestqueuer import RequestQueuer
+from .cachebackends import S3CacheBackend
+from .compression import CODECS, isCompressible, compress, decompress
+from .bulkfetch import BulkFetch
 from .unicodeconverter import convertToUTF8, convertToUnicode
 from .exceptions import StaleContentException
 
@@ -32,6 +36,17 @@ class CoordinatedUniversalTime(datetime.tzinfo):
 UTC = CoordinatedUniversalTime()
 LOGGER = logging.getLogger("main")
 
+# Headers of HTTP cache entries kept in the local cache and metadata 
+# index.
+CACHE_HEADERS = [
+    "content-type", 
+    "content-sha1", 
+    "content-changes", 
+    "request-failures", 
+    "cache-expires", 
+    "cache-etag", 
+    "cache-last-modified"]
+
 
 class PageGetter:
     
@@ -39,7 +54,14 @@ class PageGetter:
         s3, 
         aws_s3_http_cache_bucket,
         time_offset=0,
-        rq=None):
+        rq=None,
+        local_cache=None,
+        cache_backend=None,
+        metadata_index=None,
+        compression=None,
+        compression_level=6,
+        min_compression_size=256,
+        deduplicate=False):
         """
         Create an S3 based HTTP cache.
 
@@ -49,11 +71,45 @@ class PageGetter:
 
         **Keyword arguments:**
          * *rq* -- Request Queuer object. (Default ``None``)      
+         * *local_cache* -- LocalCache object checked before the cache 
+           backend and updated with every cache read and write. 
+           (Default ``None``)
+         * *cache_backend* -- CacheBackend object that stores the HTTP 
+           cache in place of the S3 bucket. (Default ``None``)
+         * *metadata_index* -- MetadataIndex object of cache headers, 
+           checked before the cache backend in cache mode 0 and updated 
+           with every cache read and write. (Default ``None``)
+         * *compression* -- Codec used to compress cached text, HTML, 
+           JSON and XML bodies, ``'zlib'`` or ``'bz2'``. Other content 
+           types are stored as they are. Compressed bodies are read 
+           whatever this is set to. (Default ``None``)
+         * *compression_level* -- Compression level, 1 for fastest to 9 
+           for smallest. (Default 6)
+         * *min_compression_size* -- Bodies shorter than this many bytes 
+           are not compressed. (Default 256)
+         * *deduplicate* -- Store each distinct body once, keyed by its 
+           SHA-1, with a small pointer object per request. Bodies that 
+           are already stored are not uploaded again. Pointers are read 
+           whatever this is set to. (Default ``False``)
 
         """
         self.s3 = s3
         self.aws_s3_http_cache_bucket = aws_s3_http_cache_bucket
         self.time_offset = time_offset
+        self.local_cache = local_cache
+        self.metadata_index = metadata_index
+        if compression is not None and compression not in CODECS:
+            raise ValueError("Unknown compression codec %s." % compression)
+        self.compression = compression
+        self.compression_level = int(compression_level)
+        self.min_compression_size = min_compression_size
+        self.deduplicate = deduplicate
+        # Set of keys of bodies known to be stored.
+        self.stored_bodies = set()
+        if cache_backend is None:
+            self.cache_backend = S3CacheBackend(s3, aws_s3_http_cache_bucket)
+        else:
+            self.cache_backend = cache_backend
         if rq is None:
             self.rq = RequestQueuer()
         else:
@@ -61,9 +117,15 @@ class PageGetter:
     
     def clearCache(self):
         """
-        Clear the S3 bucket containing the S3 cache.
+        Clear the cache backend, by default the S3 bucket containing the 
+        S3 cache, the local cache and the metadata index.
         """
-        d = self.s3.emptyBucket(self.aws_s3_http_cache_bucket)
+        if self.local_cache is not None:
+            self.local_cache.clear()
+        if self.metadata_index is not None:
+            self.metadata_index.clear()
+        self.stored_bodies.clear()
+        d = self.cache_backend.clear()
         return d
         
     def getPage(self, 
@@ -76,10 +138,12 @@ class PageGetter:
             cookies=None, 
             follow_redirect=1, 
             prioritize=False,
+            priority=None,
             hash_url=None, 
             cache=0,
             content_sha1=None,
-            confirm_cache_write=False):
+            confirm_cache_write=False,
+            tenant=None):
         """
         Make a cached HTTP Request.
 
@@ -101,6 +165,8 @@ class PageGetter:
            (Default ``True``)
          * *prioritize* -- Move this request to the front of the request 
            queue. (Default ``False``)
+         * *priority* -- RequestQueuer priority level for the request. 
+           (Default ``None``)
          * *hash_url* -- URL string used to indicate a common resource.
            Example: "http://digg.com" and "http://www.digg.com" could both
            use hash_url, "http://digg.com" (Default ``None``)      
@@ -111,6 +177,8 @@ class PageGetter:
            hash of data returned by the resource, raises a 
            StaleContentException.  
          * *confirm_cache_write* -- Wait to confirm cache write before returning.       
+         * *tenant* -- RequestQueuer tenant tag, usually the name of the 
+           calling function. (Default ``None``)
         """       
         request_kwargs = {
             "method":method.upper(), 
@@ -120,7 +188,9 @@ class PageGetter:
             "timeout":timeout, 
             "cookies":cookies, 
             "follow_redirect":follow_redirect, 
-            "prioritize":prioritize}
+            "prioritize":prioritize,
+            "priority":priority,
+            "tenant":tenant}
         cache = int(cache)
         if cache not in [-1,0,1]:
             raise Exception("Unknown caching mode.")
@@ -163,9 +233,9 @@ class PageGetter:
             return d
         elif cache == 0:
             # Cache mode 0. Check cache, send cached headers, possibly use cached data.
-            LOGGER.debug("Checking S3 Head object request %s for URL %s." % (request_hash, url))
+            LOGGER.debug("Checking cache headers of request %s for URL %s." % (request_hash, url))
             # Check if there is a cache entry, return headers.
-            d = self.s3.headObject(self.aws_s3_http_cache_bucket, request_hash)
+            d = self._headCachedObject(request_hash)
             d.addCallback(self._checkCacheHeaders, 
                 request_hash,
                 url,  
@@ -181,8 +251,8 @@ class PageGetter:
             return d
         elif cache == 1:
             # Cache mode 1. Use cache immediately, if possible.
-            LOGGER.debug("Getting S3 object request %s for URL %s." % (request_hash, url))
-            d = self.s3.getObject(self.aws_s3_http_cache_bucket, request_hash)
+            LOGGER.debug("Getting cached request %s for URL %s." % (request_hash, url))
+            d = self._getCachedObject(request_hash)
             d.addCallback(self._returnCachedData, request_hash)
             d.addErrback(self._requestWithNoCacheHeaders, 
                 request_hash, 
@@ -192,6 +262,208 @@ class PageGetter:
             d.addCallback(self._checkForStaleContent, content_sha1, request_hash)    
             return d      
                   
+    def getPages(self, urls, callback, errback=None, max_in_flight=10, 
+                 **kwargs):
+        """
+        Make cached HTTP requests for many URLs, at most *max_in_flight* 
+        at a time. Takes the same arguments as ``RequestQueuer.getPages()``,
+        and passes other keyword arguments to ``getPage()``.
+        """
+        return BulkFetch(self.getPage, urls, callback, errback=errback, 
+            max_in_flight=max_in_flight, request_kwargs=kwargs).start()
+
+    def _headCachedObject(self, request_hash):
+        if self.local_cache is not None:
+            d = self.local_cache.getHeaders(request_hash)
+            d.addCallback(self._headLocalCacheCallback, request_hash)
+            return d
+        return self._headRemoteObject(request_hash)
+
+    def _headLocalCacheCallback(self, headers, request_hash):
+        if headers is None:
+            return self._headRemoteObject(request_hash)
+        LOGGER.debug("Got headers of request %s from the local cache." % request_hash)
+        return {
+            "headers":headers, 
+            "response":"", 
+            "status":"200"}
+
+    def _headRemoteObject(self, request_hash):
+        if self.metadata_index is not None:
+            headers = self.metadata_index.get(request_hash)
+            if headers is not None:
+                LOGGER.debug("Got headers of request %s from the metadata index." % request_hash)
+                return succeed({
+                    "headers":headers, 
+                    "response":"", 
+                    "status":"200"})
+            d = self.cache_backend.getMetadata(request_hash)
+            d.addCallback(self._headCachedObjectCallback, request_hash)
+            return d
+        return self.cache_backend.getMetadata(request_hash)
+
+    def _headCachedObjectCallback(self, data, request_hash):
+        self.metadata_index.put(request_hash, self._getCacheHeaders(data["headers"]))
+        return data
+
+    def _getCachedObject(self, request_hash):
+        if self.local_cache is not None:
+            d = self.local_cache.get(request_hash)
+            d.addCallback(self._getLocalCacheCallback, request_hash)
+            return d
+        return self._getRemoteObject(request_hash)
+
+    def _getLocalCacheCallback(self, entry, request_hash):
+        if entry is None:
+            return self._getRemoteObject(request_hash)
+        LOGGER.debug("Got request %s from the local cache." % request_hash)
+        return {
+            "headers":entry[0], 
+            "response":entry[1], 
+            "status":"200"}
+
+    def _getRemoteObject(self, request_hash):
+        d = self.cache_backend.get(request_hash)
+        d.addCallback(self._decompressCachedObject)
+        d.addCallback(self._getCachedBody)
+        if self.local_cache is not None or self.metadata_index is not None:
+            d.addCallback(self._getCachedObjectCallback, request_hash)
+        return d
+
+    def _decompressCachedObject(self, data):
+        if "cache-content-encoding" not in data["headers"]:
+            return data
+        codec = data["headers"].pop("cache-content-encoding")[0]
+        d = deferToThread(decompress, codec, data["response"])
+        d.addCallback(self._decompressCachedObjectCallback, data)
+        return d
+
+    def _decompressCachedObjectCallback(self, response, data):
+        data["response"] = response
+        return data
+
+    def _getCachedBody(self, data):
+        # Deduplicated entries point to their body.
+        if "cache-content-location" not in data["headers"]:
+            return data
+        body_key = data["headers"].pop("cache-content-location")[0]
+        d = self.cache_backend.get(body_key)
+        d.addCallback(self._decompressCachedObject)
+        d.addCallbacks(self._getCachedBodyCallback, self._getCachedBodyErrback,
+            callbackArgs=(data,), errbackArgs=(body_key,))
+        return d
+
+    def _getCachedBodyCallback(self, body_data, data):
+        data["response"] = body_data["response"]
+        return data
+
+    def _getCachedBodyErrback(self, error, body_key):
+        # The backend may have evicted the body.
+        self.stored_bodies.discard(body_key)
+        return error
+
+    def _getCachedObjectCallback(self, data, request_hash):
+        self._putLocalCache(request_hash, data["response"], data["headers"])
+        return data
+
+    def _putCachedObject(self, request_hash, response, content_type, headers):
+        headers = dict(headers)
+        # Set below for compressed or deduplicated bodies.
+        for key in ["cache-content-encoding", "cache-content-location"]:
+            if key in headers:
+                del headers[key]
+        if self.local_cache is not None or self.metadata_index is not None:
+            local_headers = dict([(x, [headers[x]]) for x in headers])
+            local_headers["content-type"] = [content_type]
+            self._putLocalCache(request_hash, response, local_headers)
+        if self.deduplicate and len(response) > 0:
+            body_key = "%s.body" % hashlib.sha1(response).hexdigest()
+            headers["cache-content-location"] = body_key
+            d = self._putBody(body_key, response, content_type)
+            d.addCallback(self._putCachedObjectCallback, 
+                request_hash, 
+                content_type, 
+                headers)
+            return d
+        return self._putObject(request_hash, response, content_type, headers)
+
+    def _putCachedObjectCallback(self, data, request_hash, content_type, headers):
+        LOGGER.debug("Writing pointer for request %s to %s." % (
+            request_hash, 
+            headers["cache-content-location"]))
+        return self._putObject(request_hash, "", content_type, headers)
+
+    def _putBody(self, body_key, response, content_type):
+        if body_key in self.stored_bodies:
+            return succeed(True)
+        d = self.cache_backend.getMetadata(body_key)
+        d.addCallbacks(self._putBodyCallback, self._putBodyErrback, 
+            callbackArgs=(body_key,), 
+            errbackArgs=(body_key, response, content_type))
+        return d
+
+    def _putBodyCallback(self, data, body_key):
+        if len(self.stored_bodies) >= 100000:
+            self.stored_bodies.clear()
+        self.stored_bodies.add(body_key)
+        return data
+
+    def _putBodyErrback(self, error, body_key, response, content_type):
+        LOGGER.debug("Writing body %s to the cache." % body_key)
+        d = self._putObject(body_key, response, content_type, {})
+        d.addCallback(self._putBodyCallback, body_key)
+        return d
+
+    def _putObject(self, key, response, content_type, headers):
+        if self.compression is not None and \
+                len(response) >= self.min_compression_size and \
+                isCompressible(content_type):
+            d = deferToThread(
+                compress, 
+                self.compression, 
+                response, 
+                self.compression_level)
+            d.addCallback(self._putCompressedObject, 
+                key, 
+                response, 
+                content_type, 
+                headers)
+            return d
+        return self.cache_backend.put(
+            key, 
+            response, 
+            content_type=content_type, 
+            headers=headers)
+
+    def _putCompressedObject(self, 
+            compressed_response, 
+            key, 
+            response, 
+            content_type, 
+            headers):
+        if len(compressed_response) < len(response):
+            LOGGER.debug("Compressed %s from %s to %s bytes." % (
+                key, 
+                len(response), 
+                len(compressed_response)))
+            response = compressed_response
+            headers["cache-content-encoding"] = self.compression
+        return self.cache_backend.put(
+            key, 
+            response, 
+            content_type=content_type, 
+            headers=headers)
+
+    def _getCacheHeaders(self, headers):
+        return dict([(x, headers[x]) for x in CACHE_HEADERS if x in headers])
+
+    def _putLocalCache(self, request_hash, response, headers):
+        headers = self._getCacheHeaders(headers)
+        if self.local_cache is not None:
+            self.local_cache.put(request_hash, headers, response)
+        if self.metadata_index is not None:
+            self.metadata_index.put(request_hash, headers)
+
     def _checkCacheHeaders(self, 
             data, 
             request_hash, 
@@ -199,7 +471,7 @@ class PageGetter:
             request_kwargs,
             confirm_cache_write,
             content_sha1):
-        LOGGER.debug("Got S3 Head object request %s for URL %s." % (request_hash, url))
+        LOGGER.debug("Got cache headers of request %s for URL %s." % (request_hash, url))
         http_history = {}
         #if "content-length" in data["headers"] and int(data["headers"]["content-length"][0]) == 0:
         #    raise Exception("Zero Content length, do not use as cache.")
@@ -218,8 +490,8 @@ class PageGetter:
                 if "content-sha1" in http_history and http_history["content-sha1"] == content_sha1:
                     LOGGER.debug("Raising StaleContentException (1) on %s" % request_hash)
                     raise StaleContentException()
-                LOGGER.debug("Cached data %s for URL %s is not stale. Getting from S3." % (request_hash, url))
-                d = self.s3.getObject(self.aws_s3_http_cache_bucket, request_hash)
+                LOGGER.debug("Cached data %s for URL %s is not stale. Getting from the cache." % (request_hash, url))
+                d = self._getCachedObject(request_hash)
                 d.addCallback(self._returnCachedData, request_hash)
                 d.addErrback(
                     self._requestWithNoCacheHeaders, 
@@ -293,7 +565,7 @@ class PageGetter:
         except Exception, e:
             pass
         # No header stored in the cache. Make the request.
-        LOGGER.debug("Unable to find header for request %s on S3, fetching from %s." % (request_hash, url))
+        LOGGER.debug("Unable to find header for request %s in the cache, fetching from %s." % (request_hash, url))
         d = self.rq.getPage(url, **request_kwargs)
         d.addCallback(
             self._returnFreshData, 
@@ -329,15 +601,14 @@ class PageGetter:
         else:
             http_history["request-failures"].append(str(int(self.time_offset + time.time())))
         http_history["request-failures"] = http_history["request-failures"][-3:]
-        LOGGER.debug("Writing data for failed request %s to S3." % request_hash)
+        LOGGER.debug("Writing data for failed request %s to the cache." % request_hash)
         headers = {}
         headers["request-failures"] = ",".join(http_history["request-failures"])
-        d = self.s3.putObject(
-            self.aws_s3_http_cache_bucket, 
+        d = self._putCachedObject(
             request_hash, 
             "", 
-            content_type="text/plain", 
-            headers=headers)
+            "text/plain", 
+            headers)
         if confirm_cache_write:
             d.addCallback(self._requestWithNoCacheHeadersErrbackCallback, error)
             return d       
@@ -359,8 +630,8 @@ class PageGetter:
             if "content-sha1" in http_history and http_history["content-sha1"] == content_sha1:
                 LOGGER.debug("Raising StaleContentException (3) on %s" % request_hash)
                 raise StaleContentException()
-            LOGGER.debug("Request %s for URL %s hasn't been modified since it was last downloaded. Getting data from S3." % (request_hash, url))
-            d = self.s3.getObject(self.aws_s3_http_cache_bucket, request_hash)
+            LOGGER.debug("Request %s for URL %s hasn't been modified since it was last downloaded. Getting data from the cache." % (request_hash, url))
+            d = self._getCachedObject(request_hash)
             d.addCallback(self._returnCachedData, request_hash)
             d.addErrback(
                 self._requestWithNoCacheHeaders, 
@@ -378,17 +649,16 @@ class PageGetter:
             else:
                 http_history["request-failures"].append(str(int(self.time_offset + time.time())))
             http_history["request-failures"] = http_history["request-failures"][-3:]
-            LOGGER.debug("Writing data for failed request %s to S3. %s" % (request_hash, error))
+            LOGGER.debug("Writing data for failed request %s to the cache. %s" % (request_hash, error))
             headers = {}
             for key in data["headers"]:
                 headers[key] = data["headers"][key][0]
             headers["request-failures"] = ",".join(http_history["request-failures"])
-            d = self.s3.putObject(
-                self.aws_s3_http_cache_bucket, 
+            d = self._putCachedObject(
                 request_hash, 
                 data["response"], 
-                content_type=data["headers"]["content-type"][0], 
-                headers=headers)
+                data["headers"]["content-type"][0], 
+                headers)
             if confirm_cache_write:
                 d.addCallback(self._handleRequestWithCacheHeadersErrorCallback, error)
                 return d
@@ -398,7 +668,7 @@ class PageGetter:
         return ReportedFailure(error)
         
     def _returnCachedData(self, data, request_hash):
-        LOGGER.debug("Got request %s from S3." % (request_hash))
+        LOGGER.debug("Got request %s from the cache." % (request_hash))
         data["pagegetter-cache-hit"] = True
         data["status"] = 304
         data["message"] = "Not Modified"
@@ -435,7 +705,7 @@ class PageGetter:
         if data["content-sha1"] != http_history["content-sha1"]:
             http_history["content-changes"].append(str(int(self.time_offset + time.time())))
         http_history["content-changes"] = http_history["content-changes"][-10:]
-        LOGGER.debug("Writing data for request %s to S3." % request_hash)
+        LOGGER.debug("Writing data for request %s to the cache." % request_hash)
         headers = {}
         http_history["content-changes"] = filter(lambda x:len(x) > 0, http_history["content-changes"])
         headers["content-changes"] = ",".join(http_history["content-changes"])
@@ -451,12 +721,11 @@ class PageGetter:
             headers["cache-last-modified"] = data["headers"]["last-modified"][0]
         if "content-type" in data["headers"]:
             content_type = data["headers"]["content-type"][0]
-        d = self.s3.putObject(
-            self.aws_s3_http_cache_bucket, 
+        d = self._putCachedObject(
             request_hash, 
             data["response"], 
-            content_type=content_type, 
-            headers=headers)
+            content_type, 
+            headers)
         if confirm_cache_write:
             d.addCallback(self._storeDataCallback, data)
             d.addErrback(self._storeDataErrback, data, request_hash)
@@ -0,0 +1,363 @@
+import cStringIO
+import functools
+import urlparse
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, TimeoutError, succeed
+from twisted.internet.endpoints import TCP4ClientEndpoint, SSL4ClientEndpoint
+from twisted.internet.protocol import Protocol
+from twisted.web import error
+from twisted.web.client import HTTPConnectionPool, FileBodyProducer, _parse
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+from twisted.web._newclient import Request, ResponseDone
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+# Statuses HTTPClientFactory treats as a successful response.
+SUCCESS_STATUSES = [200, 201, 202]
+REDIRECT_STATUSES = [301, 302, 303, 307]
+
+
+class _BodyCollector(Protocol):
+
+    """
+    Collects a response body and fires a Deferred with it.
+
+    The throttle pauses the connection itself rather than the transport 
+    the response hands over, which stops passing pauses and resumes along
+    once the body is read. A connection paused on its last read is resumed
+    when the body is complete, so it does not go back to the pool paused.
+    """
+
+    def __init__(self, deferred, throttle=None, watchdog=None, 
+                 connection=None):
+        self.deferred = deferred
+        self.throttle = throttle
+        self.watchdog = watchdog
+        self.connection = connection
+        self.resume_calls = []
+        self.data = []
+
+    def dataReceived(self, data):
+        self.data.append(data)
+        if self.throttle is not None:
+            resume_call = self.throttle.consume(
+                self.connection or self.transport, 
+                len(data))
+            if resume_call is not None:
+                self.resume_calls.append(resume_call)
+        if self.watchdog is not None:
+            self.watchdog.consume(len(data))
+
+    def connectionLost(self, reason):
+        paused = False
+        for resume_call in self.resume_calls:
+            if resume_call.active():
+                resume_call.cancel()
+                paused = True
+        self.resume_calls = []
+        if paused and self.connection is not None:
+            self.throttle.resume(self.connection)
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.deferred.callback("".join(self.data))
+        else:
+            self.deferred.errback(reason)
+
+
+class PersistentHTTPClient(object):
+
+    """
+    HTTP/1.1 client that keeps connections open between requests.
+
+    Idle connections are pooled by (scheme, host, port). Results have the
+    same shape, and failures the same exception types, as RequestQueuer's
+    HTTPClientFactory based requests.
+    """
+
+    def __init__(self,
+                 context_factory,
+                 max_idle_connections_per_host=2,
+                 idle_connection_timeout=240,
+                 redirect_limit=20,
+                 dns_cache=None):
+        """
+        **Arguments:**
+         * *context_factory* -- SSL client context factory used for https
+           connections.
+
+        **Keyword arguments:**
+         * *max_idle_connections_per_host* -- Maximum number of idle
+           connections kept open to each (scheme, host, port). (Default 2)
+         * *idle_connection_timeout* -- Seconds an idle connection is kept
+           open before it is closed. (Default 240)
+         * *redirect_limit* -- Maximum number of redirects to follow.
+           (Default 20)
+         * *dns_cache* -- DNSCache object used to resolve hostnames for new
+           connections. (Default ``None``)
+        """
+        self.context_factory = context_factory
+        self.dns_cache = dns_cache
+        self.redirect_limit = redirect_limit
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = int(max_idle_connections_per_host)
+        self.pool.cachedConnectionTimeout = idle_connection_timeout
+
+    def closeConnections(self):
+        """
+        Close all idle connections. Returns a Deferred that fires when
+        they have closed.
+        """
+        return self.pool.closeCachedConnections()
+
+    def getPage(self,
+                url,
+                method="GET",
+                postdata=None,
+                headers=None,
+                agent="RequestQueuer",
+                timeout=60,
+                cookies=None,
+                follow_redirect=True,
+                throttle=None,
+                watchdog=None,
+                connect_timeout=None,
+                proxy=None):
+        """
+        Make an HTTP request over a pooled connection.
+
+        **Arguments:**
+         * *url* -- URL for the request.
+
+        **Keyword arguments:**
+         * *method* -- HTTP request method. (Default ``'GET'``)
+         * *postdata* -- Request body string. (Default ``None``)
+         * *headers* -- Dictionary of strings to send as request headers.
+           (Default ``None``)
+         * *agent* -- User agent to send with request. (Default
+           ``'RequestQueuer'``)
+         * *timeout* -- Request timeout, in seconds. (Default ``60``)
+         * *cookies* -- Dictionary of strings to send as request cookies.
+           (Default ``None``).
+         * *follow_redirect* -- Boolean switch to follow HTTP redirects.
+           (Default ``True``)
+         * *throttle* -- Object with a ``consume(transport, length)`` method
+           called as response data is read, which may pause the transport.
+           (Default ``None``)
+         * *watchdog* -- TransferWatchdog notified when the connection is 
+           ready, the response starts and body data is read. It may abort
+           the request. (Default ``None``)
+         * *connect_timeout* -- Seconds allowed to connect. If ``None``, 
+           *timeout* applies. (Default ``None``)
+         * *proxy* -- ``(host, port)`` tuple of an HTTP proxy ``http`` 
+           requests are sent through. ``https`` requests are sent 
+           directly. (Default ``None``)
+        """
+        state = {
+            "protocol":None,
+            "timeout_call":None,
+            "redirects":0,
+            "url":url,
+            "timeout":timeout,
+            "throttle":throttle,
+            "watchdog":watchdog,
+            "proxy":proxy,
+            "connect_timeout":connect_timeout or timeout or 30}
+        state["deferred"] = Deferred(functools.partial(self._cancel, state))
+        if timeout:
+            state["timeout_call"] = reactor.callLater(
+                timeout,
+                self._timeout,
+                state)
+        if watchdog is not None:
+            watchdog.start(self._abortRequest, state)
+        self._request(state, url, method, postdata, headers, agent, cookies,
+            follow_redirect)
+        return state["deferred"]
+
+    def _request(self, state, url, method, postdata, headers, agent, cookies,
+                 follow_redirect):
+        scheme, host, port, path = _parse(url)[0:4]
+        request_headers = Headers()
+        if (scheme, port) in [("http", 80), ("https", 443)]:
+            request_headers.addRawHeader("Host", host)
+        else:
+            request_headers.addRawHeader("Host", "%s:%s" % (host, port))
+        request_headers.addRawHeader("User-Agent", agent)
+        cookie_data = []
+        if headers is not None:
+            for name in headers:
+                if name.lower() in ["host", "user-agent"]:
+                    continue
+                if name.lower() == "content-length" and postdata is not None:
+                    # Written by the body producer.
+                    continue
+                if name.lower() == "cookie":
+                    cookie_data.append(str(headers[name]))
+                    continue
+                request_headers.addRawHeader(name, str(headers[name]))
+        if cookies:
+            for name in cookies:
+                cookie_data.append("%s=%s" % (name, cookies[name]))
+        if len(cookie_data) > 0:
+            request_headers.addRawHeader("Cookie", "; ".join(cookie_data))
+        if postdata is not None:
+            body_producer = FileBodyProducer(cStringIO.StringIO(postdata))
+        else:
+            body_producer = None
+        if scheme == "http" and state["proxy"] is not None:
+            # Proxies take the absolute URL. Pooled connections to a proxy
+            # are shared by all hosts.
+            path = url
+            host, port = state["proxy"]
+        request = Request(method, path, request_headers, body_producer,
+            persistent=True)
+        if self.dns_cache is not None:
+            d = self.dns_cache.getHostByName(host)
+        else:
+            d = succeed(host)
+        d.addCallback(self._getConnection, state, scheme, host, port)
+        d.addCallback(self._connected, state, request)
+        d.addCallback(self._gotResponse, state, url, method, postdata,
+            headers, agent, cookies, follow_redirect)
+        d.addErrback(self._requestError, state)
+
+    def _getConnection(self, address, state, scheme, host, port):
+        if scheme == "https":
+            endpoint = SSL4ClientEndpoint(reactor, address, port,
+                self.context_factory, timeout=state["connect_timeout"])
+        else:
+            endpoint = TCP4ClientEndpoint(reactor, address, port,
+                timeout=state["connect_timeout"])
+        return self.pool.getConnection((scheme, host, port), endpoint)
+
+    def _connected(self, protocol, state, request):
+        state["protocol"] = protocol
+        if state["deferred"].called:
+            # Timed out while connecting.
+            self._abort(protocol)
+            return None
+        if state["watchdog"] is not None:
+            state["watchdog"].connected()
+        return protocol.request(request)
+
+    def _gotResponse(self, response, state, url, method, postdata, headers,
+                     agent, cookies, follow_redirect):
+        if response is None or state["deferred"].called:
+            return
+        if state["watchdog"] is not None:
+            state["watchdog"].responseStarted()
+        response_headers = {}
+        for name, values in response.headers.getAllRawHeaders():
+            response_headers[name.lower()] = list(values)
+        if cookies is not None and "set-cookie" in response_headers:
+            for cookie in response_headers["set-cookie"]:
+                if "=" in cookie:
+                    name, value = cookie.split(";")[0].split("=", 1)
+                    cookies[name.strip()] = value.strip()
+        status = response.code
+        if status in REDIRECT_STATUSES and \
+                "location" in response_headers and follow_redirect:
+            state["redirects"] += 1
+            if state["redirects"] >= self.redirect_limit:
+                self._fail(state, error.InfiniteRedirection(
+                    str(status),
+                    "Infinite redirection detected",
+                    location=response_headers["location"][0]))
+                return
+            location = urlparse.urljoin(url, response_headers["location"][0])
+            if status == 303:
+                method = "GET"
+                postdata = None
+            # Discard the redirect body so the connection can be reused.
+            d = Deferred()
+            d.addErrback(self._ignoreError)
+            response.deliverBody(_BodyCollector(d, state["throttle"], 
+                connection=self._getTransport(state["protocol"])))
+            self._request(state, location, method, postdata, headers,
+                agent, cookies, follow_redirect)
+            return
+        d = Deferred()
+        response.deliverBody(_BodyCollector(d, state["throttle"], 
+            state["watchdog"], 
+            connection=self._getTransport(state["protocol"])))
+        d.addCallback(self._gotBody, state, response, response_headers,
+            method)
+        return d
+
+    def _gotBody(self, body, state, response, response_headers, method):
+        if state["deferred"].called:
+            return
+        status = str(response.code)
+        if response.code not in SUCCESS_STATUSES:
+            if response.code in REDIRECT_STATUSES and \
+                    "location" in response_headers:
+                exception = error.PageRedirect(
+                    status,
+                    response.phrase,
+                    body,
+                    location=response_headers["location"][0])
+            else:
+                exception = error.Error(status, response.phrase, body)
+            exception.headers = response_headers
+            self._fail(state, exception)
+            return
+        if method == "HEAD":
+            body = ""
+        self._succeed(state, {
+            "response":body,
+            "headers":response_headers,
+            "status":response.code,
+            "message":response.phrase})
+
+    def _ignoreError(self, error):
+        return None
+
+    def _requestError(self, error, state):
+        if not state["deferred"].called:
+            self._cancelTimeout(state)
+            state["deferred"].errback(error)
+
+    def _succeed(self, state, data):
+        self._cancelTimeout(state)
+        state["deferred"].callback(data)
+
+    def _fail(self, state, exception):
+        self._cancelTimeout(state)
+        state["deferred"].errback(exception)
+
+    def _cancelTimeout(self, state):
+        if state["timeout_call"] is not None and \
+                state["timeout_call"].active():
+            state["timeout_call"].cancel()
+
+    def _timeout(self, state):
+        self._abortRequest(TimeoutError(
+            "Getting %s took longer than %s seconds." % (
+                state["url"],
+                state["timeout"])), state)
+
+    def _abortRequest(self, exception, state):
+        if state["deferred"].called:
+            return
+        self._cancelTimeout(state)
+        if state["protocol"] is not None:
+            self._abort(state["protocol"])
+        state["deferred"].errback(exception)
+
+    def _cancel(self, state, deferred):
+        # The Deferred errbacks with CancelledError once this returns.
+        self._cancelTimeout(state)
+        if state["protocol"] is not None:
+            self._abort(state["protocol"])
+
+    def _abort(self, protocol):
+        transport = self._getTransport(protocol)
+        if transport is not None:
+            transport.loseConnection()
+
+    def _getTransport(self, protocol):
+        # HTTPConnectionPool wraps cached connections in a retrying proxy.
+        protocol = getattr(protocol, "_clientProtocol", protocol)
+        return protocol.transport
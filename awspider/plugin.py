@@ -72,5 +72,19 @@ class AWSpiderPlugin(object):
         return self.spider.setReservationCache(uuid, data)
     
     def getPage(self, *args, **kwargs):
+        self._setTenant(kwargs)
         return self.spider.getPage(*args, **kwargs)
-        
\ No newline at end of file
+
+    def getPages(self, *args, **kwargs):
+        self._setTenant(kwargs)
+        return self.spider.getPages(*args, **kwargs)
+
+    def setTenantWeight(self, *args, **kwargs):
+        return self.spider.setTenantWeight(*args, **kwargs)
+
+    def _setTenant(self, kwargs):
+        # The server tags pages requested while an exposed function runs
+        # with its name. Pages requested from callbacks are tagged with 
+        # the plugin's name.
+        if "tenant" not in kwargs and self.spider.current_tenant is None:
+            kwargs["tenant"] = self.__class__.__name__.lower()
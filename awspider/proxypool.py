@@ -0,0 +1,250 @@
+import time
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError, ConnectError, \
+    ConnectionLost
+from twisted.web.client import HTTPClientFactory, _parse
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+# Response statuses that mean the proxy, not the target, failed.
+PROXY_ERROR_STATUSES = [407, 502, 504]
+
+
+def _isProxyError(error):
+    """
+    Return True if a failure through a proxy counts against its health: a
+    timeout, a failed or dropped connection, or a status in
+    ``PROXY_ERROR_STATUSES``.
+    """
+    if error.check(defer.TimeoutError, TimeoutError, ConnectError,
+            ConnectionLost):
+        return True
+    status = getattr(error.value, "status", None)
+    if status is None:
+        return False
+    try:
+        return int(status) in PROXY_ERROR_STATUSES
+    except ValueError:
+        return False
+
+
+class ProxyHTTPClientFactory(HTTPClientFactory):
+
+    """
+    HTTPClientFactory that sends ``http`` requests, and the redirects they
+    follow, through an HTTP proxy. ``https`` URLs are fetched directly.
+    """
+
+    def __init__(self, proxy, *args, **kwargs):
+        self.proxy = proxy
+        self.proxied = False
+        HTTPClientFactory.__init__(self, *args, **kwargs)
+
+    def setURL(self, url):
+        HTTPClientFactory.setURL(self, url)
+        if self.scheme != "http":
+            if self.proxied:
+                # Redirected to an https URL.
+                del self.headers["host"]
+                self.proxied = False
+            return
+        self.proxied = True
+        if self.port == 80:
+            self.headers["host"] = self.host
+        else:
+            self.headers["host"] = "%s:%s" % (self.host, self.port)
+        # Proxies take the absolute URL.
+        self.path = url
+        self.host, self.port = self.proxy
+
+
+class ProxyPool(object):
+
+    """
+    Pool of HTTP proxies. Requests go to the least busy proxy. Each proxy
+    has a simultaneous request limit and a health score, and proxies that
+    keep failing are ejected for a while.
+    """
+
+    def __init__(self,
+                 proxies,
+                 max_simultaneous_requests_per_proxy=10,
+                 failure_threshold=5,
+                 min_health_score=0.5,
+                 ejection_time=30,
+                 max_ejection_time=300):
+        """
+        **Arguments:**
+         * *proxies* -- List of ``"host:port"`` proxy addresses.
+
+        **Keyword arguments:**
+         * *max_simultaneous_requests_per_proxy* -- Maximum number of
+           simultaneous requests through each proxy. (Default 10)
+         * *failure_threshold* -- Number of consecutive timeouts,
+           connection failures, 407, 502 or 504 responses after which a
+           proxy is ejected. (Default 5)
+         * *min_health_score* -- A proxy's health score is a moving
+           average of its successes, from 0 to 1. Proxies below this score
+           are ejected. (Default 0.5)
+         * *ejection_time* -- Seconds a proxy is ejected for the first
+           time. Each later ejection lasts this much longer. (Default 30)
+         * *max_ejection_time* -- Maximum seconds a proxy is ejected.
+           (Default 300)
+        """
+        self.max_simul_reqs_per_proxy = max(1,
+            int(max_simultaneous_requests_per_proxy))
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.min_health_score = min_health_score
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        # Dictionaries of addresses, active request counts, health scores,
+        # consecutive failure counts, ejection counts and ejection end
+        # timestamps, by proxy.
+        self.addresses = {}
+        self.active_reqs = {}
+        self.health_scores = {}
+        self.failures = {}
+        self.ejections = {}
+        self.ejected_until = {}
+        for proxy in proxies:
+            self.addProxy(proxy)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def addProxy(self, proxy):
+        """
+        Add a proxy to the pool.
+
+        **Arguments:**
+         * *proxy* -- Proxy address. (Example, ``"10.0.0.1:3128"``)
+        """
+        if "://" not in proxy:
+            proxy_url = "http://%s" % proxy
+        else:
+            proxy_url = proxy
+        host, port = _parse(proxy_url)[1:3]
+        self.addresses[proxy] = (host, port)
+        self.active_reqs.setdefault(proxy, 0)
+        self.health_scores[proxy] = 1.0
+        self.failures[proxy] = 0
+        self.ejections[proxy] = 0
+        self.ejected_until[proxy] = 0
+
+    def removeProxy(self, proxy):
+        """
+        Remove a proxy from the pool. Requests already sent through it
+        are not affected.
+
+        **Arguments:**
+         * *proxy* -- Proxy address. (Example, ``"10.0.0.1:3128"``)
+        """
+        del self.addresses[proxy]
+        for states in [self.health_scores, self.failures, self.ejections,
+                self.ejected_until]:
+            del states[proxy]
+        if self.active_reqs[proxy] == 0:
+            del self.active_reqs[proxy]
+
+    def getAddress(self, proxy):
+        """
+        Return a proxy's ``(host, port)`` tuple.
+
+        **Arguments:**
+         * *proxy* -- Proxy address. (Example, ``"10.0.0.1:3128"``)
+        """
+        return self.addresses[proxy]
+
+    def getProxyStates(self):
+        """
+        Return a dictionary of dictionaries of active request counts,
+        health scores and ejection states, by proxy.
+        """
+        now = time.time()
+        return dict([(x, {
+            "active":self.active_reqs[x],
+            "health_score":self.health_scores[x],
+            "ejected":self.ejected_until[x] > now}) for x in self.addresses])
+
+    def _getCandidates(self):
+        now = time.time()
+        proxies = [x for x in self.addresses if self.ejected_until[x] <= now]
+        if len(proxies) == 0:
+            # With every proxy ejected, ejections are ignored rather than
+            # stopping all requests.
+            proxies = self.addresses.keys()
+        return proxies
+
+    def isAvailable(self):
+        """
+        Return True if a proxy can take another request.
+        """
+        for proxy in self._getCandidates():
+            if self.active_reqs[proxy] < self.max_simul_reqs_per_proxy:
+                return True
+        return False
+
+    def acquire(self):
+        """
+        Return the least busy, then healthiest, proxy that is not ejected,
+        and count a request against it. Returns ``None`` if the pool is
+        empty.
+        """
+        proxies = self._getCandidates()
+        if len(proxies) == 0:
+            return None
+        proxy = min(proxies, key=self._loadKey)
+        self.active_reqs[proxy] += 1
+        return proxy
+
+    def _loadKey(self, proxy):
+        return (self.active_reqs[proxy], -self.health_scores[proxy])
+
+    def release(self, proxy, error=None, record_result=True):
+        """
+        Record the result of a request acquired with ``acquire()``.
+
+        **Arguments:**
+         * *proxy* -- Proxy address returned by ``acquire()``.
+
+        **Keyword arguments:**
+         * *error* -- Failure of the request, or ``None`` if it succeeded.
+           Only failures that point at the proxy count against its
+           health. (Default ``None``)
+         * *record_result* -- Whether the result counts towards the 
+           proxy's health, ``False`` for cancelled requests. 
+           (Default ``True``)
+        """
+        self.active_reqs[proxy] -= 1
+        if proxy not in self.addresses:
+            if self.active_reqs[proxy] == 0:
+                del self.active_reqs[proxy]
+            return
+        if not record_result:
+            return
+        if error is not None and not _isProxyError(error):
+            error = None
+        score = self.health_scores[proxy] * 0.9
+        if error is None:
+            self.health_scores[proxy] = score + 0.1
+            self.failures[proxy] = 0
+            return
+        self.health_scores[proxy] = score
+        self.failures[proxy] += 1
+        if self.failures[proxy] >= self.failure_threshold or \
+                score < self.min_health_score:
+            self._eject(proxy)
+
+    def _eject(self, proxy):
+        self.ejections[proxy] += 1
+        ejection_time = min(self.max_ejection_time,
+            self.ejection_time * self.ejections[proxy])
+        LOGGER.error("Ejecting proxy %s for %s seconds after %s failures, "
+            "health score %.2f." % (proxy, ejection_time,
+            self.failures[proxy], self.health_scores[proxy]))
+        self.ejected_until[proxy] = time.time() + ejection_time
+        # It returns with a clean slate.
+        self.health_scores[proxy] = 1.0
+        self.failures[proxy] = 0
@@ -1,16 +1,52 @@
 import urllib
 import time
-from twisted.internet.defer import Deferred
-from twisted.internet import reactor, ssl
-from twisted.web.client import HTTPClientFactory, _parse
+import calendar
+import copy
+import functools
+import heapq
+import random
+from collections import deque
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet import defer, reactor, ssl
+from twisted.internet.error import TimeoutError, ConnectError, \
+    ConnectionLost, ConnectionDone
+from twisted.python.failure import Failure
+from twisted.web.client import HTTPClientFactory, HTTPPageGetter, _parse
 import dateutil.parser
 from .unicodeconverter import convertToUTF8
+from .persistentclient import PersistentHTTPClient
+from .dnscache import DNSCache
+from .hostgroups import ExactHostGrouping, RegisteredDomainGrouping, \
+    ResolvedAddressGrouping
+from .proxypool import ProxyPool, ProxyHTTPClientFactory
+from .bulkfetch import BulkFetch
+from .exceptions import CircuitOpenException
 from OpenSSL import SSL
 import logging
 
 
 LOGGER = logging.getLogger("main")
 
+# Request priority levels, highest first.
+PRIORITY_PEER = 0
+PRIORITY_CACHE_WRITE = 1
+PRIORITY_INTERACTIVE = 2
+PRIORITY_BACKGROUND = 3
+PRIORITY_LEVELS = 4
+
+# Methods that may be repeated without changing the result.
+IDEMPOTENT_METHODS = ["GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"]
+# Response statuses worth retrying.
+RETRY_STATUSES = [408, 429, 500, 502, 503, 504]
+
+# Circuit breaker states.
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+# Headers of requests made without any. Shared, and never modified.
+NO_HEADERS = {}
+
 
 class AllCipherSSLClientContextFactory(ssl.ClientContextFactory):
     """A context factory for SSL clients that uses all ciphers."""
@@ -20,27 +56,532 @@ class AllCipherSSLClientContextFactory(ssl.ClientContextFactory):
         context.set_cipher_list("ALL")
         return context
     
+def _isOverloadError(error):
+    """
+    Return True if a request failure means the host is struggling: a 
+    timeout, a 429 or a 5xx response.
+    """
+    if error.check(defer.TimeoutError, TimeoutError):
+        return True
+    status = getattr(error.value, "status", None)
+    if status is None:
+        return False
+    try:
+        status = int(status)
+    except ValueError:
+        return False
+    return status == 429 or status >= 500
+
+def _isRetryableError(error):
+    """
+    Return True if a request failure is likely transient: a timeout, a 
+    failed or dropped connection, or a status in ``RETRY_STATUSES``.
+    """
+    if error.check(defer.TimeoutError, TimeoutError, ConnectError, 
+            ConnectionLost, ConnectionDone):
+        return True
+    status = getattr(error.value, "status", None)
+    if status is None:
+        return False
+    try:
+        return int(status) in RETRY_STATUSES
+    except ValueError:
+        return False
+
+def _getRetryAfter(error):
+    """
+    Return the number of seconds a failed response's ``Retry-After`` 
+    header asks the client to wait, or ``None``.
+    """
+    headers = getattr(error.value, "headers", None)
+    if not headers or "retry-after" not in headers:
+        return None
+    value = headers["retry-after"]
+    if isinstance(value, list):
+        value = value[0]
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        return None
+    return max(0, calendar.timegm(retry_time.utctimetuple()) - time.time())
+
+class TokenBucket(object):
+    
+    """
+    Token bucket that refills at a fixed rate up to a burst capacity.
+    """
+    
+    def __init__(self, rate, burst):
+        """
+        **Arguments:**
+         * *rate* -- Tokens added per second.
+         * *burst* -- Maximum number of tokens the bucket can hold. The 
+           bucket starts full.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.timestamp = time.time()
+    
+    def configure(self, rate, burst):
+        """
+        Change the refill rate and capacity, keeping the tokens earned so 
+        far.
+        """
+        self._refill()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = min(self.tokens, self.burst)
+    
+    def _refill(self):
+        now = time.time()
+        if now > self.timestamp:
+            self.tokens = min(
+                self.burst, 
+                self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+        
+    def waitTime(self, amount=1):
+        """
+        Return the number of seconds until *amount* tokens are available.
+        """
+        self._refill()
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+        
+    def consume(self, amount=1):
+        """
+        Remove *amount* tokens. The balance may go negative, in which case
+        later callers wait for the debt to be repaid.
+        """
+        self._refill()
+        self.tokens -= amount
+
+    def isFull(self):
+        """
+        Return True if the bucket holds its full burst, in which case it 
+        limits nothing that a new bucket would not.
+        """
+        self._refill()
+        return self.tokens >= self.burst
+
+class BandwidthThrottle(object):
+    
+    """
+    Meters bytes read from a transport against one or more TokenBuckets, 
+    pausing the transport until the buckets are out of debt.
+    """
+    
+    def __init__(self, buckets):
+        """
+        **Arguments:**
+         * *buckets* -- List of TokenBucket objects, in bytes per second.
+        """
+        self.buckets = buckets
+        # Time of the last pause, via time().
+        self.paused_at = 0
+    
+    def consume(self, transport, amount):
+        """
+        Record *amount* bytes read from *transport*, pausing it if any 
+        bucket is empty. Returns the delayed call that resumes the 
+        transport, or ``None`` if it was not paused.
+        """
+        wait = 0
+        for bucket in self.buckets:
+            bucket.consume(amount)
+            wait = max(wait, bucket.waitTime())
+        if wait > 0 and transport is not None:
+            self.paused_at = time.time()
+            transport.pauseProducing()
+            return reactor.callLater(wait, self.resume, transport)
+        return None
+    
+    def resume(self, transport):
+        """
+        Resume a paused transport, unless it has disconnected.
+        """
+        if getattr(transport, "disconnecting", False) or \
+                not getattr(transport, "connected", True):
+            return
+        transport.resumeProducing()
+
+class TransferWatchdog(object):
+    
+    """
+    Aborts a transfer whose server does not start responding in time, or 
+    whose body arrives slower than a minimum throughput.
+    """
+    
+    def __init__(self, url, first_byte_timeout=None, min_bytes_per_second=0,
+                 window=10, throttle=None):
+        """
+        **Arguments:**
+         * *url* -- URL being fetched, for error messages.
+        
+        **Keyword arguments:**
+         * *first_byte_timeout* -- Seconds from connecting until the 
+           response starts. (Default ``None``)
+         * *min_bytes_per_second* -- Minimum throughput of the response 
+           body. If set to 0, throughput is not checked. (Default 0)
+         * *window* -- Seconds over which throughput is measured. 
+           (Default 10)
+         * *throttle* -- BandwidthThrottle of the transfer. Windows in which
+           it paused the transfer are not checked. (Default ``None``)
+        """
+        self.url = url
+        self.first_byte_timeout = first_byte_timeout
+        self.min_bytes_per_second = min_bytes_per_second
+        self.window = window
+        self.throttle = throttle
+        self.abort = None
+        self.abort_args = ()
+        self.first_byte_call = None
+        self.window_call = None
+        self.window_start = None
+        self.window_bytes = 0
+        self.stopped = False
+    
+    def start(self, abort, *args):
+        """
+        Set the function called with an exception, followed by *args*, to
+        abort the transfer.
+        """
+        self.abort = abort
+        self.abort_args = args
+    
+    def connected(self):
+        """
+        Start the first byte timeout once the request can be sent.
+        """
+        if self.stopped or not self.first_byte_timeout:
+            return
+        if self.first_byte_call is None:
+            self.first_byte_call = reactor.callLater(
+                self.first_byte_timeout, 
+                self._firstByteTimeout)
+    
+    def responseStarted(self):
+        """
+        Stop the first byte timeout and start measuring throughput.
+        """
+        if self.stopped:
+            return
+        self._cancel("first_byte_call")
+        if self.min_bytes_per_second and self.window_call is None:
+            self.window_start = time.time()
+            self.window_bytes = 0
+            self.window_call = reactor.callLater(
+                self.window, 
+                self._checkThroughput)
+    
+    def consume(self, amount):
+        """
+        Record *amount* bytes of response body.
+        """
+        self.window_bytes += amount
+    
+    def stop(self):
+        self.stopped = True
+        self._cancel("first_byte_call")
+        self._cancel("window_call")
+    
+    def _cancel(self, name):
+        call = getattr(self, name)
+        if call is not None and call.active():
+            call.cancel()
+        setattr(self, name, None)
+    
+    def _firstByteTimeout(self):
+        self.first_byte_call = None
+        self._abort(defer.TimeoutError(
+            "%s did not start responding within %s seconds." % (
+                self.url, 
+                self.first_byte_timeout)))
+    
+    def _checkThroughput(self):
+        self.window_call = None
+        rate = self.window_bytes / float(self.window)
+        throttled = self.throttle is not None and \
+            self.throttle.paused_at >= self.window_start
+        if rate < self.min_bytes_per_second and not throttled:
+            self._abort(defer.TimeoutError(
+                "%s sent %.1f bytes per second, less than the minimum of "
+                "%s." % (self.url, rate, self.min_bytes_per_second)))
+            return
+        self.window_start = time.time()
+        self.window_bytes = 0
+        self.window_call = reactor.callLater(
+            self.window, 
+            self._checkThroughput)
+    
+    def _abort(self, exception):
+        self.stop()
+        if self.abort is not None:
+            self.abort(exception, *self.abort_args)
+
+class MonitoredHTTPPageGetter(HTTPPageGetter):
+    
+    """
+    HTTPPageGetter that reports the transfer to its factory's 
+    BandwidthThrottle and TransferWatchdog.
+    """
+    
+    def connectionMade(self):
+        if self.factory.watchdog is not None:
+            self.factory.watchdog.connected()
+        HTTPPageGetter.connectionMade(self)
+    
+    def handleStatus(self, version, status, message):
+        if self.factory.watchdog is not None:
+            self.factory.watchdog.responseStarted()
+        HTTPPageGetter.handleStatus(self, version, status, message)
+    
+    def handleResponsePart(self, data):
+        HTTPPageGetter.handleResponsePart(self, data)
+        if self.factory.throttle is not None:
+            self.factory.throttle.consume(self.transport, len(data))
+        if self.factory.watchdog is not None:
+            self.factory.watchdog.consume(len(data))
+
+class QueuedRequest(object):
+    
+    """
+    State of a request made with ``RequestQueuer.getPage()``. Slotted, as 
+    a large backlog holds one for every pending request.
+    """
+    
+    __slots__ = ["url", "method", "postdata", "headers", "agent", 
+        "timeout", "cookies", "follow_redirect", "coalescing_key", 
+        "max_retries", "retries", "idempotent", "hostname", "host", 
+        "state", "cancelled", "deadline", "deadline_call", "watchdog", 
+        "hedge", "hedge_call", "hedge_attempt", "tenant", "virtual_start",
+        "virtual_finish", "connect_timeout", "first_byte_timeout", 
+        "deferred", "priority", "dispatch_time", "factory", 
+        "page_deferred", "proxy"]
+    
+    def __init__(self, url, method, postdata, headers, agent, timeout, 
+                 cookies, follow_redirect, coalescing_key, max_retries, 
+                 idempotent, hostname, hedge, tenant, connect_timeout, 
+                 first_byte_timeout, priority):
+        self.url = url
+        self.method = method
+        self.postdata = postdata
+        self.headers = headers
+        self.agent = agent
+        self.timeout = timeout
+        self.cookies = cookies
+        self.follow_redirect = follow_redirect
+        self.coalescing_key = coalescing_key
+        self.max_retries = max_retries
+        self.retries = 0
+        self.idempotent = idempotent
+        self.hostname = hostname
+        # Name of the host group the request is queued in, once known.
+        self.host = None
+        # None, "waiting", "queued", "active" or "done".
+        self.state = None
+        self.cancelled = False
+        self.deadline = None
+        self.deadline_call = None
+        self.watchdog = None
+        self.hedge = hedge
+        self.hedge_call = None
+        self.hedge_attempt = None
+        self.tenant = tenant
+        self.virtual_start = 0.0
+        self.virtual_finish = 0.0
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.deferred = None
+        self.priority = priority
+        self.dispatch_time = None
+        self.factory = None
+        self.page_deferred = None
+        self.proxy = None
+    
+    def copy(self):
+        """
+        Return a copy of the request that shares its Deferred, for a 
+        hedged duplicate.
+        """
+        duplicate = object.__new__(QueuedRequest)
+        for name in self.__slots__:
+            setattr(duplicate, name, getattr(self, name))
+        duplicate.factory = None
+        duplicate.page_deferred = None
+        return duplicate
+
+class HostQueue(object):
+    
+    """
+    Pending requests for a single host. Each priority level keeps a FIFO 
+    deque of requests per tenant, whose tags only grow, and a heap of its 
+    tenants keyed by the ``virtual_finish`` tag of their first request, so
+    requests within a level are ordered by tag, and in the order they were
+    added when tags are equal.
+    """
+    
+    def __init__(self, levels):
+        # Heaps of (virtual finish, sequence, tenant) and dictionaries of 
+        # deques of requests by tenant, by priority level.
+        self.heaps = [[] for i in range(levels)]
+        self.queues = [{} for i in range(levels)]
+        self.length = 0
+        self.sequence = 0
+    
+    def __len__(self):
+        return self.length
+        
+    def append(self, req, priority):
+        queues = self.queues[priority]
+        if req.tenant in queues:
+            queues[req.tenant].append(req)
+        else:
+            queues[req.tenant] = deque([req])
+            self.sequence += 1
+            heapq.heappush(self.heaps[priority], 
+                (req.virtual_finish, self.sequence, req.tenant))
+        self.length += 1
+    
+    def discard(self):
+        """
+        Stop counting a queued request that has been cancelled. The request
+        is marked ``cancelled`` and dropped when it reaches the front of 
+        its tenant's deque.
+        """
+        self.length -= 1
+        if self.length == 0:
+            for level in range(len(self.heaps)):
+                self.heaps[level] = []
+                self.queues[level] = {}
+    
+    def promote(self, req, priority):
+        """
+        Move a queued request to a higher priority level. Its entry at the
+        old level is dropped when it reaches the front of its tenant's 
+        deque.
+        """
+        req.priority = priority
+        # Counted once, at its new level.
+        self.length -= 1
+        self.append(req, priority)
+
+    def first(self):
+        """
+        Return the request ``popleft()`` would return, without removing it.
+        """
+        level = self._firstLevel()
+        if level is None:
+            raise IndexError("first of an empty HostQueue")
+        return self.queues[level][self.heaps[level][0][2]][0]
+
+    def peek(self):
+        """
+        Return a ``(priority, virtual_finish)`` tuple for the request 
+        ``popleft()`` would return.
+        """
+        req = self.first()
+        return (req.priority, req.virtual_finish)
+    
+    def popleft(self):
+        """
+        Remove and return the request with the lowest virtual finish tag at
+        the highest priority level.
+        """
+        level = self._firstLevel()
+        if level is None:
+            raise IndexError("pop from an empty HostQueue")
+        tenant = self.heaps[level][0][2]
+        req = self.queues[level][tenant].popleft()
+        self._rekeyTenant(level, tenant)
+        self.length -= 1
+        return req
+
+    def _firstLevel(self):
+        """
+        Return the highest priority level with a request that has not been
+        cancelled, or ``None``, dropping cancelled requests and entries of
+        promoted requests on the way.
+        """
+        for level in range(len(self.heaps)):
+            heap = self.heaps[level]
+            while heap:
+                tenant = heap[0][2]
+                queue = self.queues[level][tenant]
+                if not queue[0].cancelled and queue[0].priority == level:
+                    return level
+                queue.popleft()
+                self._rekeyTenant(level, tenant)
+        return None
+
+    def _rekeyTenant(self, level, tenant):
+        """
+        Update the heap entry of the tenant at the top of a level's heap 
+        after the first request of its deque was removed.
+        """
+        heap = self.heaps[level]
+        queue = self.queues[level][tenant]
+        if queue:
+            self.sequence += 1
+            heapq.heapreplace(heap, 
+                (queue[0].virtual_finish, self.sequence, tenant))
+        else:
+            heapq.heappop(heap)
+            del self.queues[level][tenant]
+
 class RequestQueuer(object):
     
     """
     HTTP Request Queuer
     """
     
-    # Dictionary of lists of pending requests, by host
-    pending_reqs = {}
-    # Dictonary of timestamps - via time() - of last requests, by host
-    last_req = {}
-    # Dictonary of integer counts of active requests, by host
-    active_reqs = {}
-    # Dictionary of user specified minimum request intervals, by host
-    min_req_interval_per_hosts = {}
-    max_reqs_per_hosts_per_sec = {}
-    # Dictionary of user specified maximum simultaneous requests, by host
-    max_simul_reqs_per_hosts = {}
+    # Adaptive concurrency: multiplier applied to a host's limit when it
+    # times out or is overloaded, and how far its latency may rise above
+    # its baseline before the limit stops growing.
+    adaptive_decrease_factor = 0.5
+    adaptive_latency_tolerance = 2.0
+    # Hedging: latency samples kept per host, samples needed before 
+    # requests are hedged, and the most hedges a host can save up.
+    hedge_latency_samples = 100
+    hedge_min_samples = 20
+    hedge_burst = 10
+    # Number of hosts whose state is kept before the state of idle hosts
+    # is forgotten.
+    max_tracked_hosts = 10000
     
     def __init__(self, max_simultaneous_requests=50,
                  max_requests_per_host_per_second=1,
-                 max_simultaneous_requests_per_host=5): 
+                 max_simultaneous_requests_per_host=5,
+                 max_requests_per_host_burst=1,
+                 persistent_connections=False,
+                 max_idle_connections_per_host=2,
+                 idle_connection_timeout=240,
+                 priority_levels=PRIORITY_LEVELS,
+                 dns_cache=None,
+                 adaptive_concurrency=False,
+                 coalesce_requests=False,
+                 retry_backoff=0.5,
+                 max_retry_backoff=60,
+                 max_retries_per_host_per_second=1,
+                 max_retries_per_host_burst=10,
+                 circuit_breaker_threshold=0,
+                 circuit_breaker_timeout=30,
+                 max_bytes_per_second=0,
+                 max_bytes_per_host_per_second=0,
+                 connect_timeout=None,
+                 first_byte_timeout=None,
+                 min_bytes_per_second=0,
+                 throughput_window=10,
+                 hedge_ratio=0.05,
+                 host_grouping=None,
+                 proxies=None,
+                 max_simultaneous_requests_per_proxy=10): 
         """
         Set the maximum number of simultaneous requests for a particular host.
         
@@ -58,38 +599,251 @@ class RequestQueuer(object):
             RequestQueuer will not limit the number of simultaneous requests.
             Can be overridden for an individual host using 
             ``setHostMaxSimultaneousRequests()`` (Default 5)
+          * *max_requests_per_host_burst* -- Number of requests a host may
+            receive back to back once it has been idle long enough, while 
+            still averaging *max_requests_per_host_per_second*. If set to 1, 
+            requests are evenly spaced. Can be overridden for an individual 
+            host using ``setHostMaxRequestsBurst()`` (Default 1)
+          * *persistent_connections* -- Reuse HTTP/1.1 connections between
+            requests to the same scheme, host and port instead of opening a
+            new connection for every request. (Default False)
+          * *max_idle_connections_per_host* -- Maximum number of idle 
+            persistent connections kept open per scheme, host and port. 
+            (Default 2)
+          * *idle_connection_timeout* -- Seconds an idle persistent 
+            connection is kept open. (Default 240)
+          * *priority_levels* -- Number of request priority levels. Level 0
+            is dispatched first. (Default 4, see ``PRIORITY_PEER``, 
+            ``PRIORITY_CACHE_WRITE``, ``PRIORITY_INTERACTIVE`` and 
+            ``PRIORITY_BACKGROUND``)
+          * *dns_cache* -- A DNSCache object used to resolve hostnames, or
+            ``True`` to create one. Names of hosts waiting on rate limits
+            are prefetched. If ``None``, the reactor's resolver is used for
+            every connection. (Default ``None``)
+          * *adaptive_concurrency* -- Adjust each host's simultaneous
+            request limit from its responses. The limit starts at 1, grows
+            by one per round of successful requests while latency stays 
+            near its baseline, and is halved on timeouts, 429 and 5xx 
+            responses. It never exceeds the host's maximum simultaneous 
+            requests. Can be overridden for an individual host using 
+            ``setHostAdaptiveConcurrency()`` (Default False)
+          * *coalesce_requests* -- Share one request between identical GET 
+            and HEAD requests made while it is pending or active. Requests 
+            are identical if their method, URL, headers, cookies, agent and
+            redirect setting match. Each caller receives its own copy of 
+            the result. (Default False)
+          * *retry_backoff* -- Base delay, in seconds, before retrying a 
+            request that allows retries. Retry *n* waits a random time 
+            between 0 and ``retry_backoff * 2 ** n`` seconds, or longer if
+            the response had a ``Retry-After`` header. (Default 0.5)
+          * *max_retry_backoff* -- Maximum delay before a retry, in seconds,
+            ignoring ``Retry-After``. (Default 60)
+          * *max_retries_per_host_per_second* -- Retry budget. Maximum 
+            number of retries per host per second, so a failing host is 
+            not sent more traffic. (Default 1)
+          * *max_retries_per_host_burst* -- Number of retries per host 
+            that can be made at once before the retry budget applies.
+            (Default 10)
+          * *circuit_breaker_threshold* -- Number of consecutive timeouts, 
+            connection failures, 408, 429 or 5xx responses after which a 
+            host's circuit breaker opens. While it is open, requests to the
+            host fail immediately with ``CircuitOpenException``. If set to 
+            0, circuit breakers are off. (Default 0)
+          * *circuit_breaker_timeout* -- Seconds a circuit breaker stays 
+            open. It then lets a single probe request through, closing 
+            if the probe succeeds and opening again if it fails. 
+            (Default 30)
+          * *max_bytes_per_second* -- Maximum number of response bytes per
+            second read across all hosts. Reading from connections is 
+            paused when the limit is reached. If set to 0, RequestQueuer 
+            will not limit bandwidth. (Default 0)
+          * *max_bytes_per_host_per_second* -- Maximum number of response 
+            bytes per second read from each host. If set to 0, 
+            RequestQueuer will not limit per host bandwidth. Can be 
+            overridden for an individual host using 
+            ``setHostMaxBytesPerSecond()`` (Default 0)
+          * *connect_timeout* -- Seconds allowed to connect to a host. If 
+            ``None``, a request's *timeout* applies. (Default ``None``)
+          * *first_byte_timeout* -- Seconds allowed between connecting and
+            the start of the response. If ``None``, only a request's 
+            *timeout* applies. (Default ``None``)
+          * *min_bytes_per_second* -- Minimum throughput of a response 
+            body, measured over *throughput_window*. Slower transfers fail
+            with ``TimeoutError``, freeing their slot. If set to 0, 
+            throughput is not checked. (Default 0)
+          * *throughput_window* -- Seconds over which throughput is 
+            measured. (Default 10)
+          * *hedge_ratio* -- Hedging budget. Hedged requests to a host may
+            add at most this fraction of its hedgeable requests as 
+            duplicates. (Default 0.05)
+          * *host_grouping* -- How requests are grouped into hosts for 
+            queuing, rate limits, concurrency limits, circuit breakers and
+            the other per host settings. ``"host"`` groups by exact 
+            hostname, ``"domain"`` by registered domain, so 
+            ``a.example.com`` and ``b.example.com`` share the limits of 
+            ``example.com``, and ``"address"`` by resolved IP address, 
+            using *dns_cache*. Per host settings are set on the group's 
+            name. Any object with the methods of ``ExactHostGrouping`` 
+            may be used. If ``None``, requests are grouped by hostname. 
+            (Default ``None``)
+          * *proxies* -- List of ``"host:port"`` HTTP proxy addresses, or a
+            ProxyPool object. ``http`` requests are spread across the 
+            proxies, and wait while every proxy is at its simultaneous 
+            request limit. Proxies that keep failing are ejected for a 
+            while. ``https`` requests are sent directly. (Default ``None``)
+          * *max_simultaneous_requests_per_proxy* -- Maximum number of 
+            simultaneous requests through each proxy, if *proxies* is a 
+            list. (Default 10)
   
         """
+        # Dictionary of HostQueue objects of pending requests, by host
+        self.pending_reqs = {}
+        self.priority_levels = max(1, int(priority_levels))
+        # Dictonary of timestamps - via time() - of last requests, by host
+        self.last_req = {}
+        # Dictonary of integer counts of active requests, by host
+        self.active_reqs = {}
+        # Dictionary of user specified request rates and bursts, by host
+        self.max_reqs_per_hosts_per_sec = {}
+        self.max_reqs_bursts_per_hosts = {}
+        # Dictionary of TokenBucket objects enforcing request rates, by host
+        self.req_buckets = {}
+        # Dictionary of user specified maximum simultaneous requests, by host
+        self.max_simul_reqs_per_hosts = {}
+        # Adaptive concurrency settings and state, by host
+        self.adaptive_concurrency = adaptive_concurrency
+        self.adaptive_concurrency_hosts = {}
+        self.concurrency_limits = {}
+        self.latency_averages = {}
+        self.latency_baselines = {}
+        self.concurrency_decrease_times = {}
+        # Dictionary of lists of (Deferred, cookies, deadline call) waiting
+        # on a shared request, and of the shared requests, by coalescing 
+        # key
+        self.coalesce_requests = coalesce_requests
+        self.coalesced_reqs = {}
+        self.coalescing_reqs = {}
+        # Retry settings, and token buckets of retry budgets by host
+        self.retry_backoff = float(retry_backoff)
+        self.max_retry_backoff = float(max_retry_backoff)
+        self.max_retries_per_host_per_sec = max_retries_per_host_per_second
+        self.max_retries_burst_per_host = max(1, 
+            int(max_retries_per_host_burst))
+        self.retry_buckets = {}
+        # Circuit breaker settings, and states, consecutive failure counts
+        # and opening times by host
+        self.circuit_breaker_threshold = int(circuit_breaker_threshold)
+        self.circuit_breaker_timeout = circuit_breaker_timeout
+        self.circuit_states = {}
+        self.circuit_failures = {}
+        self.circuit_open_times = {}
+        # Bandwidth limits, and token buckets of bytes per second, global 
+        # and by host
+        self.max_bytes_per_sec = max_bytes_per_second
+        self.max_bytes_per_host_per_sec = max_bytes_per_host_per_second
+        self.max_bytes_per_hosts_per_sec = {}
+        self.bandwidth_buckets = {}
+        if max_bytes_per_second == 0:
+            self.bandwidth_bucket = None
+        else:
+            self.bandwidth_bucket = TokenBucket(max_bytes_per_second, 
+                max_bytes_per_second)
+        # Transfer timeouts and throughput floor
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.min_bytes_per_sec = min_bytes_per_second
+        self.throughput_window = throughput_window
+        # Hedging budget, and recent latencies and hedge tokens by host
+        self.hedge_ratio = hedge_ratio
+        self.latency_samples = {}
+        self.hedge_tokens = {}
+        # Weighted fair queuing: weights and virtual finish tag of the 
+        # last queued request, by tenant, and the virtual time of the last
+        # dispatch.
+        self.tenant_weights = {}
+        self.tenant_finish_tags = {}
+        self.virtual_time = 0.0
+        # Running totals of pending and active requests, maintained on 
+        # enqueue, dispatch and completion rather than summed on demand.
+        self.pending_count = 0
+        self.active_count = 0
+        # Min-heap of ((priority, virtual finish), sequence, host) for hosts
+        # with pending requests that may be dispatched right now, keyed by
+        # their first pending request. Entries whose key no longer matches 
+        # ready_keys[host] are stale and skipped.
+        self.ready_hosts = []
+        self.ready_keys = {}
+        self.ready_sequence = 0
+        # Min-heap of (next eligible time, host) for rate limited hosts.
+        self.eligible_heap = []
+        # Hosts with pending requests waiting for one of their own slots.
+        self.blocked_hosts = set()
+        # Hosts whose first pending request waits for a free proxy.
+        self.proxy_blocked_hosts = set()
+        # Hosts currently held in ready_hosts, eligible_heap, blocked_hosts
+        # or proxy_blocked_hosts.
+        self.scheduled_hosts = set()
+        # Delayed call that fires when the head of eligible_heap is due.
+        self.wakeup_call = None
+        self.wakeup_time = None
         if max_simultaneous_requests == 0:
             self.max_simul_reqs = 100000
         else:
             self.max_simul_reqs = int(max_simultaneous_requests)
-        # self.min_req_interval_per_host is the global minimum request
-        # interval. Can be overridden by self.min_req_interval_per_hosts[].
+        # self.max_reqs_per_host_per_sec and self.max_reqs_burst_per_host 
+        # are the global token bucket settings. Can be overridden by 
+        # self.max_reqs_per_hosts_per_sec[] and 
+        # self.max_reqs_bursts_per_hosts[].
         self.max_reqs_per_host_per_sec = max_requests_per_host_per_second
-        if max_requests_per_host_per_second == 0:
-            self.min_req_interval_per_host = 0
-        else:
-            max_req_per_host_per_sec = float(max_requests_per_host_per_second)
-            self.min_req_interval_per_host = 1.0 / max_req_per_host_per_sec
+        self.max_reqs_burst_per_host = max(1, int(max_requests_per_host_burst))
         # self.max_simul_reqs_per_host is the global maximum simultaneous 
         # request count. Can be overridden by self.max_simul_reqs_per_hosts[].
         if max_simultaneous_requests_per_host == 0:
             self.max_simul_reqs_per_host = self.max_simul_reqs
         else:
             self.max_simul_reqs_per_host = int(max_simultaneous_requests_per_host)
+        if dns_cache is True:
+            self.dns_cache = DNSCache()
+        else:
+            self.dns_cache = dns_cache
+        if proxies is None or isinstance(proxies, ProxyPool):
+            self.proxy_pool = proxies
+        else:
+            self.proxy_pool = ProxyPool(proxies, 
+                max_simultaneous_requests_per_proxy=\
+                    max_simultaneous_requests_per_proxy)
+        if host_grouping is None or host_grouping == "host":
+            self.host_grouping = ExactHostGrouping()
+        elif host_grouping == "domain":
+            self.host_grouping = RegisteredDomainGrouping()
+        elif host_grouping == "address":
+            if self.dns_cache is None:
+                self.dns_cache = DNSCache()
+            self.host_grouping = ResolvedAddressGrouping(self.dns_cache)
+        elif isinstance(host_grouping, basestring):
+            raise ValueError("Unknown host grouping %s." % host_grouping)
+        else:
+            self.host_grouping = host_grouping
+        if persistent_connections:
+            self.persistent_client = PersistentHTTPClient(
+                AllCipherSSLClientContextFactory(),
+                dns_cache=self.dns_cache,
+                max_idle_connections_per_host=max_idle_connections_per_host,
+                idle_connection_timeout=idle_connection_timeout)
+        else:
+            self.persistent_client = None
 
     def getPending(self):
         """
         Return the number of pending requests.
         """
-        return sum([len(x) for x in self.pending_reqs.values()])
+        return self.pending_count
 
     def getActive(self):
         """
         Return the number of active requests.
         """
-        return sum(self.active_reqs.values())
+        return self.active_count
     
     def getActiveRequestsByHost(self):
         """
@@ -104,6 +858,31 @@ class RequestQueuer(object):
         reqs = [(x[0], len(x[1])) for x in self.pending_reqs.items()]
         return dict(reqs)
 
+    def getCircuitBreakerStatesByHost(self):
+        """
+        Return a dictionary of circuit breaker states by host. States are 
+        ``"closed"``, ``"open"`` and ``"half-open"``.
+        """
+        return dict([(x, self._getCircuitState(x)) 
+            for x in self.circuit_states])
+
+    def getProxyStates(self):
+        """
+        Return a dictionary of dictionaries of active request counts, 
+        health scores and ejection states, by proxy.
+        """
+        if self.proxy_pool is None:
+            return {}
+        return self.proxy_pool.getProxyStates()
+
+    def closeConnections(self):
+        """
+        Close idle persistent connections. Returns a Deferred.
+        """
+        if self.persistent_client is None:
+            return succeed(None)
+        return self.persistent_client.closeConnections()
+
     def setHostMaxRequestsPerSecond(self, host, max_requests_per_second):
         """
         Set the maximum number of requests per second for a particular host.
@@ -116,11 +895,7 @@ class RequestQueuer(object):
            will not limit the request rate to the host.
         """        
         self.max_reqs_per_hosts_per_sec[host] = max_requests_per_second
-        if max_requests_per_second == 0:
-            self.min_req_interval_per_hosts[host] = 0
-        else:
-            min_req_interval = 1.0 / float(max_requests_per_second)
-            self.min_req_interval_per_hosts[host] = min_req_interval
+        self._configureRequestBucket(host)
 
     def getHostMaxRequestsPerSecond(self, host):
         """
@@ -134,6 +909,105 @@ class RequestQueuer(object):
         else:
             return self.max_reqs_per_host_per_sec
 
+    def setHostMaxRequestsBurst(self, host, max_requests_burst):
+        """
+        Set the number of back to back requests a particular host may 
+        receive after being idle.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+         * *max_requests_burst* -- Capacity of the host's token bucket. If 
+           set to 1, requests to the host are evenly spaced at its maximum 
+           number of requests per second.
+        """
+        self.max_reqs_bursts_per_hosts[host] = max(1, int(max_requests_burst))
+        self._configureRequestBucket(host)
+
+    def getHostMaxRequestsBurst(self, host):
+        """
+        Get the number of back to back requests a particular host may 
+        receive after being idle.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+        """
+        if host in self.max_reqs_bursts_per_hosts:
+            return self.max_reqs_bursts_per_hosts[host]
+        else:
+            return self.max_reqs_burst_per_host
+
+    def _configureRequestBucket(self, host):
+        if host in self.req_buckets:
+            rate = self.getHostMaxRequestsPerSecond(host)
+            if rate == 0:
+                del self.req_buckets[host]
+            else:
+                self.req_buckets[host].configure(
+                    rate, 
+                    self.getHostMaxRequestsBurst(host))
+
+    def _getRequestBucket(self, host):
+        """
+        Return the host's TokenBucket, or None if its rate is unlimited.
+        """
+        if host in self.req_buckets:
+            return self.req_buckets[host]
+        rate = self.getHostMaxRequestsPerSecond(host)
+        if rate == 0:
+            return None
+        bucket = TokenBucket(rate, self.getHostMaxRequestsBurst(host))
+        self.req_buckets[host] = bucket
+        return bucket
+
+    def setHostMaxBytesPerSecond(self, host, max_bytes_per_second):
+        """
+        Set the maximum number of response bytes per second read from a 
+        particular host.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+         * *max_bytes_per_second* -- Maximum number of bytes per second. If 
+           set to 0, RequestQueuer will not limit the host's bandwidth.
+        """
+        self.max_bytes_per_hosts_per_sec[host] = max_bytes_per_second
+        if host in self.bandwidth_buckets:
+            if max_bytes_per_second == 0:
+                del self.bandwidth_buckets[host]
+            else:
+                self.bandwidth_buckets[host].configure(
+                    max_bytes_per_second, 
+                    max_bytes_per_second)
+
+    def getHostMaxBytesPerSecond(self, host):
+        """
+        Get the maximum number of response bytes per second read from a 
+        particular host.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+        """
+        if host in self.max_bytes_per_hosts_per_sec:
+            return self.max_bytes_per_hosts_per_sec[host]
+        else:
+            return self.max_bytes_per_host_per_sec
+
+    def _getBandwidthThrottle(self, host):
+        """
+        Return a BandwidthThrottle for a request to the host, or None if 
+        its bandwidth is unlimited.
+        """
+        buckets = []
+        rate = self.getHostMaxBytesPerSecond(host)
+        if rate != 0:
+            if host not in self.bandwidth_buckets:
+                self.bandwidth_buckets[host] = TokenBucket(rate, rate)
+            buckets.append(self.bandwidth_buckets[host])
+        if self.bandwidth_bucket is not None:
+            buckets.append(self.bandwidth_bucket)
+        if len(buckets) == 0:
+            return None
+        return BandwidthThrottle(buckets)
+
     def setHostMaxSimultaneousRequests(self, host, max_simultaneous_requests):
         """
         Set the maximum number of simultaneous requests for a particular host.
@@ -162,6 +1036,83 @@ class RequestQueuer(object):
         else:
             return self.max_simul_reqs_per_host
         
+    def setHostAdaptiveConcurrency(self, host, adaptive_concurrency):
+        """
+        Turn adaptive concurrency on or off for a particular host.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+         * *adaptive_concurrency* -- Boolean. If True, the host's 
+           simultaneous request limit follows its latency and errors, up to
+           its maximum simultaneous requests.
+        """
+        self.adaptive_concurrency_hosts[host] = adaptive_concurrency
+        
+    def getHostAdaptiveConcurrency(self, host):
+        """
+        Return True if adaptive concurrency is on for a particular host.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+        """
+        if host in self.adaptive_concurrency_hosts:
+            return self.adaptive_concurrency_hosts[host]
+        else:
+            return self.adaptive_concurrency
+            
+    def getHostConcurrencyLimit(self, host):
+        """
+        Get the number of simultaneous requests currently allowed for a 
+        particular host. With adaptive concurrency this is the adapted 
+        limit, otherwise the host's maximum simultaneous requests.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"google.com"``)
+        """
+        maximum = self.getHostMaxSimultaneousRequests(host)
+        if not self.getHostAdaptiveConcurrency(host):
+            return maximum
+        limit = int(self.concurrency_limits.get(host, 1))
+        return max(1, min(limit, maximum))
+
+    def getHostGroup(self, host):
+        """
+        Get the name of the group a hostname's requests are queued and 
+        limited in, or ``None`` if it is not known yet. Per host settings 
+        apply to groups.
+        
+        **Arguments:**
+         * *host* -- Hostname. (Example, ``"www.google.com"``)
+        """
+        return self.host_grouping.getCachedHostGroup(host)
+
+    def setTenantWeight(self, tenant, weight):
+        """
+        Set the weight of a tenant. Queued requests to the same host, and 
+        to all hosts when every simultaneous request slot is in use, are 
+        dispatched to tenants in proportion to their weights.
+        
+        **Arguments:**
+         * *tenant* -- Tenant tag passed to ``getPage()``. (Example, 
+           ``"myplugin/myfunction"``)
+         * *weight* -- Positive number. A tenant with weight 2 is sent 
+           twice as many requests as a tenant with weight 1 while both 
+           have requests queued.
+        """
+        if weight <= 0:
+            raise ValueError("Tenant weight must be positive.")
+        self.tenant_weights[tenant] = float(weight)
+
+    def getTenantWeight(self, tenant):
+        """
+        Get the weight of a tenant. (Default 1)
+        
+        **Arguments:**
+         * *tenant* -- Tenant tag passed to ``getPage()``. (Example, 
+           ``"myplugin/myfunction"``)
+        """
+        return self.tenant_weights.get(tenant, 1.0)
+        
     def getPage(self, 
                 url, 
                 last_modified=None, 
@@ -173,7 +1124,15 @@ class RequestQueuer(object):
                 timeout=60, 
                 cookies=None, 
                 follow_redirect=True, 
-                prioritize=False
+                prioritize=False,
+                priority=None,
+                max_retries=0,
+                idempotent=None,
+                deadline=None,
+                connect_timeout=None,
+                first_byte_timeout=None,
+                hedge=False,
+                tenant=None
                 ):
         """
         Make an HTTP Request.
@@ -198,12 +1157,48 @@ class RequestQueuer(object):
            (Default ``None``).
          * *follow_redirect* -- Boolean switch to follow HTTP redirects. 
            (Default ``True``)
-         * *prioritize* -- Move this request to the front of the request 
-           queue. (Default ``False``)         
+         * *prioritize* -- Dispatch this request ahead of other requests
+           to the host. Equivalent to *priority* ``PRIORITY_PEER``. 
+           (Default ``False``)
+         * *priority* -- Priority level, from ``0`` (dispatched first) to
+           ``priority_levels - 1``. Requests at the same level are 
+           dispatched in order. (Default ``PRIORITY_BACKGROUND``, or the
+           lowest level if fewer levels are configured)
+         * *max_retries* -- Number of times to retry the request after a
+           timeout, connection failure, 408, 429 or 5xx response. Retries
+           are queued again after a backoff delay and count against the 
+           host's retry budget. (Default ``0``)
+         * *idempotent* -- Whether the request may safely be repeated. If 
+           ``None``, GET, HEAD, PUT, DELETE, OPTIONS and TRACE requests are
+           idempotent. Non-idempotent requests are not retried. (Default 
+           ``None``)
+         * *deadline* -- Seconds the caller will wait for a result, 
+           including time spent queued and retrying. A request still 
+           queued at its deadline is dropped and fails with 
+           ``TimeoutError``. A request that has been sent gets the lesser
+           of *timeout* and the time left. (Default ``None``)
+         * *connect_timeout* -- Seconds allowed to connect. (Default 
+           RequestQueuer's *connect_timeout*)
+         * *first_byte_timeout* -- Seconds allowed between connecting and 
+           the start of the response. (Default RequestQueuer's 
+           *first_byte_timeout*)
+         * *hedge* -- If the request is idempotent and has not finished 
+           after the host's 95th percentile latency, send a duplicate and
+           use whichever response arrives first. The other is aborted. 
+           Limited by *hedge_ratio*. (Default ``False``)
+         * *tenant* -- Tag of the caller, such as an exposed function's 
+           name. Queued requests are shared fairly between tenants 
+           according to their weights, see ``setTenantWeight()``. 
+           (Default ``None``)
+
+        Cancelling the returned Deferred removes the request from its 
+        queue or aborts it if it has been sent, unless identical requests
+        coalesced with it are still waiting.
 
         """
-        if headers is None:
-            headers={}
+        # Headers added to a copy of the caller's headers. The caller's
+        # headers are shared, not copied, when there are none.
+        extra_headers = {}
         if postdata is not None:
             if isinstance(postdata, dict):
                 for key in postdata:
@@ -212,112 +1207,963 @@ class RequestQueuer(object):
             else:
                 convertToUTF8(postdata)
         if method.lower() == "post":
-            headers["content-type"] = "application/x-www-form-urlencoded"
+            extra_headers["content-type"] = \
+                "application/x-www-form-urlencoded"
         if last_modified is not None:
             time_tuple = dateutil.parser.parse(last_modified).timetuple()
             time_string = time.strftime("%a, %d %b %Y %T %z", time_tuple)
-            headers['If-Modified-Since'] = time_string
+            extra_headers['If-Modified-Since'] = time_string
         if etag is not None:
-            headers["If-None-Match"] = etag
-        req = {
-            "url":convertToUTF8(url),
-            "method":method,
-            "postdata":postdata,
-            "headers":headers,
-            "agent":agent,
-            "timeout":timeout,
-            "cookies":cookies,
-            "follow_redirect":follow_redirect,
-            "deferred":Deferred()
-        }
-        host = _parse(req["url"])[1]
+            extra_headers["If-None-Match"] = etag
+        if headers is None:
+            headers = NO_HEADERS
+        if len(extra_headers) > 0:
+            headers = dict(headers)
+            headers.update(extra_headers)
+        if isinstance(agent, str):
+            agent = intern(agent)
+        url = convertToUTF8(url)
+        hostname = intern(_parse(url)[1])
+        if priority is None:
+            if prioritize:
+                priority = PRIORITY_PEER
+            else:
+                priority = PRIORITY_BACKGROUND
+        priority = min(max(0, int(priority)), self.priority_levels - 1)
+        coalescing_key = None
+        if self.coalesce_requests and postdata is None and \
+                method.upper() in ["GET", "HEAD"]:
+            coalescing_key = self._coalescingKey(url, method, headers, 
+                agent, cookies, follow_redirect)
+            if coalescing_key in self.coalesced_reqs:
+                d = Deferred(functools.partial(self._cancelCoalesced, 
+                    coalescing_key))
+                if deadline is not None:
+                    deadline_call = reactor.callLater(deadline, 
+                        self._coalescedDeadlineExpired, coalescing_key, d)
+                else:
+                    deadline_call = None
+                self.coalesced_reqs[coalescing_key].append(
+                    (d, cookies, deadline_call))
+                self._joinCoalesced(self.coalescing_reqs[coalescing_key],
+                    priority, max_retries, hedge)
+                return d
+            self.coalesced_reqs[coalescing_key] = []
+        if connect_timeout is None:
+            connect_timeout = self.connect_timeout
+        if first_byte_timeout is None:
+            first_byte_timeout = self.first_byte_timeout
+        req = QueuedRequest(url, method, postdata, headers, agent, timeout,
+            cookies, follow_redirect, coalescing_key, max_retries, 
+            idempotent, hostname, hedge, tenant, connect_timeout, 
+            first_byte_timeout, priority)
+        req.deferred = Deferred(functools.partial(self._cancelRequest, 
+            req))
+        if coalescing_key is not None:
+            self.coalescing_reqs[coalescing_key] = req
+        if deadline is not None:
+            req.deadline = time.time() + deadline
+            req.deadline_call = reactor.callLater(deadline, 
+                self._deadlineExpired, req)
+        self.pending_count += 1
+        # Waits, counted as pending, until its host group is known.
+        req.state = "waiting"
+        d = self.host_grouping.getHostGroup(hostname)
+        d.addCallbacks(self._hostGroupCallback, self._hostGroupErrback, 
+            callbackArgs=(req,), errbackArgs=(req,))
+        return req.deferred
+
+    def getPages(self, urls, callback, errback=None, max_in_flight=10, 
+                 **kwargs):
+        """
+        Make HTTP requests for many URLs, at most *max_in_flight* at a 
+        time. Returns a Deferred that fires with the number of URLs 
+        requested once every result has been handled. Cancelling it 
+        cancels the requests in flight. Other keyword arguments are 
+        passed to ``getPage()``.
+
+        **Arguments:**
+         * *urls* -- Iterable of URLs, or of ``(url, kwargs)`` tuples of a 
+           URL and keyword arguments for its request. It is read only as
+           requests finish, so it may be a generator.
+         * *callback* -- Called with each result and its URL as it 
+           arrives. If it returns a Deferred, the URL counts as in flight 
+           until it fires.
+
+        **Keyword arguments:**
+         * *errback* -- Called with each failure and its URL. If ``None``,
+           the first failure stops new requests and fails the returned 
+           Deferred. (Default ``None``)
+         * *max_in_flight* -- Maximum number of URLs in flight. 
+           (Default 10)
+        """
+        return BulkFetch(self.getPage, urls, callback, errback=errback, 
+            max_in_flight=max_in_flight, request_kwargs=kwargs).start()
+
+    def _joinCoalesced(self, req, priority, max_retries, hedge):
+        """
+        Have a request shared by coalesced callers serve the most 
+        demanding of them: the highest priority, most retries, and 
+        hedging if any asked for it.
+        """
+        req.max_retries = max(req.max_retries, max_retries)
+        req.hedge = req.hedge or hedge
+        if priority >= req.priority:
+            return
+        if req.state == "queued":
+            self._promoteRequest(req, priority)
+        elif req.state == "waiting":
+            # Queued at its new priority once its host group is known or
+            # its retry delay has passed.
+            req.priority = priority
+
+    def _promoteRequest(self, req, priority):
+        """
+        Move a queued request to a higher priority level.
+        """
+        host = req.host
+        self.pending_reqs[host].promote(req, priority)
+        if host in self.ready_keys:
+            # The request may now be first in line.
+            self._pushReadyHost(host)
+        elif host in self.proxy_blocked_hosts:
+            self.proxy_blocked_hosts.remove(host)
+            self._scheduleHost(host)
+
+    def _hostGroupCallback(self, host, req):
+        req.host = host
+        self._queueRequest(req, host)
+
+    def _hostGroupErrback(self, error, req):
+        if req.cancelled:
+            return
+        self.pending_count -= 1
+        self._failRequest(error, req)
+
+    def _queueRequest(self, req, host):
+        """
+        Add a request counted in ``pending_count`` to its host's queue.
+        """
+        if req.cancelled:
+            # Cancelled while waiting to be retried.
+            return
+        if self._getCircuitState(host) == CIRCUIT_OPEN:
+            self.pending_count -= 1
+            self._failRequest(self._circuitOpenFailure(host), req)
+            return
+        req.state = "queued"
+        self._tagRequest(req)
         if host not in self.pending_reqs:
-            self.pending_reqs[host] = []
-        if prioritize:
-            self.pending_reqs[host].insert(0, req)
-        else:
-            self.pending_reqs[host].append(req)
+            self.pending_reqs[host] = HostQueue(self.priority_levels)
+        self.pending_reqs[host].append(req, req.priority)
+        if host not in self.scheduled_hosts:
+            self._scheduleHost(host)
+        elif host in self.ready_keys:
+            # The new request may now be first in line.
+            self._pushReadyHost(host)
+        elif host in self.proxy_blocked_hosts:
+            # The new request may now be first in line, and not need a 
+            # proxy.
+            self.proxy_blocked_hosts.remove(host)
+            self._scheduleHost(host)
         self._checkActive()
-        return req["deferred"]
 
-    def _hostRequestCheck(self, host):
+    def _tagRequest(self, req):
+        """
+        Give a request virtual start and finish tags. A tenant's requests 
+        start no earlier than the current virtual time or the finish of 
+        its previous request, and each takes ``1 / weight`` of virtual 
+        time, so heavier tenants' tags advance more slowly.
+        """
+        tenant = req.tenant
+        start = max(self.virtual_time, 
+            self.tenant_finish_tags.get(tenant, 0.0))
+        req.virtual_start = start
+        req.virtual_finish = start + 1.0 / self.getTenantWeight(tenant)
+        self.tenant_finish_tags[tenant] = req.virtual_finish
+
+    def _coalescingKey(self, url, method, headers, agent, cookies, 
+                       follow_redirect):
+        """
+        Return a hashable key identifying requests that can share a 
+        response.
+        """
+        header_items = tuple(sorted([(str(x).lower(), str(headers[x])) 
+            for x in headers]))
+        if cookies:
+            cookie_items = tuple(sorted([(str(x), str(cookies[x])) 
+                for x in cookies]))
+        else:
+            cookie_items = ()
+        return (method.upper(), url, header_items, cookie_items, agent, 
+            follow_redirect)
+
+    def _hostWaitTime(self, host):
+        """
+        Return the number of seconds until the host's token bucket holds
+        a token for another request.
+        """
+        bucket = self._getRequestBucket(host)
+        if bucket is None:
+            return 0
+        return bucket.waitTime()
+
+    def _hostAtCapacity(self, host):
+        """
+        Return True if the host has used all of its simultaneous requests.
+        """
+        if self._getCircuitState(host) == CIRCUIT_HALF_OPEN:
+            # One probe request at a time.
+            return self.active_reqs.get(host, 0) >= 1
+        return self.active_reqs.get(host, 0) >= \
+            self.getHostConcurrencyLimit(host)
+
+    def _getCircuitState(self, host):
+        """
+        Return the host's circuit breaker state, moving it from open to 
+        half-open once the breaker's timeout has passed.
+        """
+        state = self.circuit_states.get(host, CIRCUIT_CLOSED)
+        if state == CIRCUIT_OPEN:
+            open_time = self.circuit_open_times[host]
+            if time.time() - open_time >= self.circuit_breaker_timeout:
+                state = CIRCUIT_HALF_OPEN
+                self.circuit_states[host] = state
+        return state
+
+    def _recordCircuitResult(self, host, error=None):
+        """
+        Close the host's circuit breaker after a response, or count a host
+        failure and open the breaker if the threshold is reached or a 
+        half-open probe failed.
+        """
+        if self.circuit_breaker_threshold == 0:
+            return
+        if error is None or not _isRetryableError(error):
+            self.circuit_failures[host] = 0
+            if self.circuit_states.get(host, CIRCUIT_CLOSED) != \
+                    CIRCUIT_CLOSED:
+                LOGGER.info("Closing circuit breaker for %s." % host)
+                self.circuit_states[host] = CIRCUIT_CLOSED
+            return
+        self.circuit_failures[host] = self.circuit_failures.get(host, 0) + 1
+        state = self.circuit_states.get(host, CIRCUIT_CLOSED)
+        if state == CIRCUIT_HALF_OPEN or (state == CIRCUIT_CLOSED and 
+                self.circuit_failures[host] >= self.circuit_breaker_threshold):
+            LOGGER.warning("Opening circuit breaker for %s after %s "
+                "failures." % (host, self.circuit_failures[host]))
+            self.circuit_states[host] = CIRCUIT_OPEN
+            self.circuit_open_times[host] = time.time()
+            self._failPendingRequests(host)
+
+    def _circuitOpenFailure(self, host):
+        return Failure(CircuitOpenException(
+            "Circuit breaker for %s is open." % host))
+
+    def _failPendingRequests(self, host):
+        """
+        Fail all of a host's queued requests while its breaker is open.
+        """
         if host not in self.pending_reqs:
-            return False
-        if host in self.last_req:
-            if host in self.min_req_interval_per_hosts:
-                if time.time() - self.last_req[host] < \
-                    self.min_req_interval_per_hosts[host]:
-                    return False
-            else:
-                if time.time() - self.last_req[host] < \
-                    self.min_req_interval_per_host:
-                    return False
-        if host in self.active_reqs:
-            if host in self.max_simul_reqs_per_hosts:
-                if self.active_reqs[host] > self.max_simul_reqs_per_hosts[host]:
-                    return False
-            else:
-                if self.active_reqs[host] > self.max_simul_reqs_per_host:
-                    return False
-        return True
+            return
+        queue = self.pending_reqs[host]
+        while len(queue) > 0:
+            req = queue.popleft()
+            self.pending_count -= 1
+            self._failRequest(self._circuitOpenFailure(host), req)
+
+    def _adaptConcurrency(self, host, req, error=None):
+        """
+        Additively increase or multiplicatively decrease the host's 
+        adaptive concurrency limit after a request finishes.
+        """
+        if not self.getHostAdaptiveConcurrency(host):
+            return
+        now = time.time()
+        limit = self.concurrency_limits.get(host, 1.0)
+        maximum = self.getHostMaxSimultaneousRequests(host)
+        if error is not None and _isOverloadError(error):
+            # Cut at most once per round trip, so a burst of failures from 
+            # requests sent at the old limit counts as one signal.
+            last_decrease = self.concurrency_decrease_times.get(host, 0)
+            if now - last_decrease > self.latency_averages.get(host, 0):
+                limit = max(1.0, limit * self.adaptive_decrease_factor)
+                self.concurrency_decrease_times[host] = now
+            self.concurrency_limits[host] = limit
+            return
+        if error is not None and not hasattr(error.value, "status"):
+            # No response, e.g. connection refused, says nothing about 
+            # how much concurrency the host can take.
+            return
+        # Any other response, including 304 and 404, counts as a success.
+        latency = now - req.dispatch_time
+        if host in self.latency_averages:
+            average = 0.8 * self.latency_averages[host] + 0.2 * latency
+        else:
+            average = latency
+        self.latency_averages[host] = average
+        baseline = self.latency_baselines.get(host, average)
+        # Let the baseline drift upward slowly so it can track a host 
+        # whose normal latency changes.
+        baseline = min(average, baseline * 1.01)
+        self.latency_baselines[host] = baseline
+        if average <= baseline * self.adaptive_latency_tolerance:
+            limit = min(float(maximum), limit + 1.0 / limit)
+        self.concurrency_limits[host] = limit
+
+    def _scheduleHost(self, host):
+        """
+        Place a host with pending requests on the ready queue, on the 
+        eligibility heap if it is rate limited, or in the blocked set if 
+        it has no free simultaneous request slots.
+        """
+        if host not in self.pending_reqs or len(self.pending_reqs[host]) == 0:
+            self.scheduled_hosts.discard(host)
+            if host in self.pending_reqs:
+                del self.pending_reqs[host]
+            return
+        self.scheduled_hosts.add(host)
+        if self._hostAtCapacity(host):
+            self.blocked_hosts.add(host)
+            self._prefetchHost(host)
+            return
+        wait_time = self._hostWaitTime(host)
+        if wait_time > 0:
+            eligible_time = time.time() + wait_time
+            heapq.heappush(self.eligible_heap, (eligible_time, host))
+            self._scheduleWakeUp()
+            self._prefetchHost(host)
+        else:
+            self._pushReadyHost(host)
+
+    def _pushReadyHost(self, host):
+        """
+        Add a host to the ready heap, or update its key if its first 
+        pending request has changed.
+        """
+        key = self.pending_reqs[host].peek()
+        if self.ready_keys.get(host) == key:
+            return
+        self.ready_keys[host] = key
+        self.ready_sequence += 1
+        heapq.heappush(self.ready_hosts, (key, self.ready_sequence, host))
+
+    def _popReadyHost(self):
+        """
+        Remove and return the ready host whose first pending request has
+        the highest priority and lowest virtual finish tag, or None.
+        """
+        while len(self.ready_hosts) > 0:
+            key, sequence, host = heapq.heappop(self.ready_hosts)
+            if self.ready_keys.get(host) != key:
+                continue
+            del self.ready_keys[host]
+            return host
+        return None
+
+    def _prefetchHost(self, host):
+        """
+        Resolve a waiting host's name ahead of its next dispatch.
+        """
+        if self.dns_cache is not None:
+            req = self.pending_reqs[host].first()
+            self.dns_cache.prefetch(req.hostname)
+
+    def _scheduleWakeUp(self):
+        """
+        Make sure a delayed call is set for the earliest eligible host.
+        """
+        if len(self.eligible_heap) == 0:
+            return
+        eligible_time = self.eligible_heap[0][0]
+        if self.wakeup_call is not None and self.wakeup_call.active():
+            if self.wakeup_time <= eligible_time:
+                return
+            self.wakeup_call.cancel()
+        self.wakeup_time = eligible_time
+        self.wakeup_call = reactor.callLater(
+            max(0, eligible_time - time.time()), 
+            self._wakeUp)
+
+    def _wakeUp(self):
+        self.wakeup_call = None
+        self.wakeup_time = None
+        now = time.time()
+        while len(self.eligible_heap) > 0 and self.eligible_heap[0][0] <= now:
+            host = heapq.heappop(self.eligible_heap)[1]
+            self._scheduleHost(host)
+        self._checkActive()
+        self._scheduleWakeUp()
 
     def _checkActive(self):
-        while self.getActive() < self.max_simul_reqs and self.getPending() > 0:     
-            hosts = self.pending_reqs.keys()
-            dispatched_requests = False
-            for host in hosts:
-                if len(self.pending_reqs[host]) == 0:
-                    del self.pending_reqs[host]
-                elif self._hostRequestCheck(host):
-                    dispatched_requests = True
-                    req = self.pending_reqs[host].pop(0)
-                    d = self._getPage(req)
-                    d.addCallback(self._requestComplete, req["deferred"], host)
-                    d.addErrback(self._requestError, req["deferred"], host)
-                    self.last_req[host] = time.time()
-                    self.active_reqs[host] = self.active_reqs.get(host, 0) + 1
-            if not dispatched_requests:
-                break
-        if self.getPending() > 0:
-            reactor.callLater(.1, self._checkActive)
-            
-    def _requestComplete(self, response, deferred, host):
+        while self.active_count < self.max_simul_reqs and \
+                len(self.ready_keys) > 0:
+            host = self._popReadyHost()
+            if host not in self.pending_reqs or \
+                    len(self.pending_reqs[host]) == 0 or \
+                    self._hostAtCapacity(host) or \
+                    self._hostWaitTime(host) > 0:
+                self._scheduleHost(host)
+                continue
+            if not self._proxyAvailable(self.pending_reqs[host].first()):
+                # Other hosts' requests may not need a proxy. The host is 
+                # scheduled again when a proxy is released.
+                self.proxy_blocked_hosts.add(host)
+                continue
+            req = self.pending_reqs[host].popleft()
+            self.pending_count -= 1
+            self.virtual_time = max(self.virtual_time, req.virtual_start)
+            req.state = "active"
+            req.dispatch_time = time.time()
+            self.last_req[host] = req.dispatch_time
+            bucket = self._getRequestBucket(host)
+            if bucket is not None:
+                bucket.consume()
+            if host not in self.active_reqs and \
+                    len(self.active_reqs) >= self.max_tracked_hosts:
+                self._pruneIdleHosts()
+            self.active_reqs[host] = self.active_reqs.get(host, 0) + 1
+            self.active_count += 1
+            self._scheduleHost(host)
+            d = self._getPage(req)
+            d.addCallback(self._requestComplete, req, host)
+            d.addErrback(self._requestError, req, host)
+            self._scheduleHedge(req, host)
+
+    def _releaseSlot(self, host):
         self.active_reqs[host] -= 1
+        self.active_count -= 1
+        if host in self.blocked_hosts:
+            self.blocked_hosts.remove(host)
+            self._scheduleHost(host)
         self._checkActive()
-        deferred.callback(response)
+
+    def _requestComplete(self, response, req, host):
+        self._stopWatchdog(req)
+        if req.cancelled:
+            self._releaseSlot(host)
+            return None
+        self._cancelHedge(req)
+        self._recordLatency(host, req)
+        self._adaptConcurrency(host, req)
+        self._recordCircuitResult(host)
+        self._releaseSlot(host)
+        self._deliverResponse(response, req)
         return None
 
-    def _requestError(self, error, deferred, host):     
-        self.active_reqs[host] -= 1
-        self._checkActive()
-        deferred.errback(error)
+    def _deliverResponse(self, response, req):
+        """
+        Callback a request and the identical requests coalesced with it.
+        """
+        self._finishRequest(req)
+        waiting = self._popCoalesced(req)
+        copies = [copy.deepcopy(response) for x in waiting]
+        if not req.deferred.called:
+            req.deferred.callback(response)
+        for i in range(0, len(waiting)):
+            waiting[i].callback(copies[i])
+
+    def _requestError(self, error, req, host):     
+        self._stopWatchdog(req)
+        if req.cancelled:
+            self._releaseSlot(host)
+            return None
+        self._cancelHedge(req)
+        if hasattr(error.value, "status"):
+            self._recordLatency(host, req)
+        self._adaptConcurrency(host, req, error=error)
+        self._recordCircuitResult(host, error=error)
+        self._releaseSlot(host)
+        if self._shouldRetry(error, req, host):
+            self._retryRequest(error, req, host)
+            return None
+        self._failRequest(error, req)
         return None
 
+    def _failRequest(self, error, req):
+        """
+        Errback a request and the identical requests coalesced with it.
+        """
+        self._finishRequest(req)
+        waiting = self._popCoalesced(req)
+        if not req.deferred.called:
+            req.deferred.errback(error)
+        for d in waiting:
+            d.errback(error)
+
+    def _recordLatency(self, host, attempt):
+        if host not in self.latency_samples:
+            if len(self.latency_samples) >= self.max_tracked_hosts:
+                self._pruneIdleHosts()
+            self.latency_samples[host] = deque(
+                maxlen=self.hedge_latency_samples)
+        self.latency_samples[host].append(
+            time.time() - attempt.dispatch_time)
+
+    def _getHostHedgeDelay(self, host):
+        """
+        Return the host's 95th percentile latency, or None if too few 
+        requests have been timed.
+        """
+        samples = self.latency_samples.get(host)
+        if samples is None or len(samples) < self.hedge_min_samples:
+            return None
+        samples = sorted(samples)
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def _pruneIdleHosts(self):
+        """
+        Forget the state of hosts with no pending or active requests: 
+        full token buckets, which limit nothing, and adaptive concurrency,
+        latency, hedging and closed circuit breaker state.
+        """
+        state = [self.last_req, self.active_reqs, self.concurrency_limits,
+            self.latency_averages, self.latency_baselines, 
+            self.concurrency_decrease_times, self.latency_samples, 
+            self.hedge_tokens]
+        buckets = [self.req_buckets, self.retry_buckets, 
+            self.bandwidth_buckets]
+        hosts = set()
+        for host_state in state + buckets:
+            hosts.update(host_state.keys())
+        hosts.update(self.circuit_failures.keys())
+        for host in hosts:
+            if self.active_reqs.get(host, 0) > 0 or \
+                    host in self.pending_reqs:
+                continue
+            for host_state in state:
+                host_state.pop(host, None)
+            for host_buckets in buckets:
+                if host in host_buckets and host_buckets[host].isFull():
+                    del host_buckets[host]
+            if self.circuit_states.get(host, CIRCUIT_CLOSED) == \
+                    CIRCUIT_CLOSED:
+                self.circuit_states.pop(host, None)
+                self.circuit_failures.pop(host, None)
+
+    def _scheduleHedge(self, req, host):
+        """
+        Add to the host's hedging budget and, for a hedged request, set a 
+        delayed call to send a duplicate.
+        """
+        if not req.hedge or not self._isIdempotent(req):
+            return
+        if host not in self.hedge_tokens and \
+                len(self.hedge_tokens) >= self.max_tracked_hosts:
+            self._pruneIdleHosts()
+        self.hedge_tokens[host] = min(self.hedge_burst, 
+            self.hedge_tokens.get(host, 0) + self.hedge_ratio)
+        delay = self._getHostHedgeDelay(host)
+        if delay is None:
+            return
+        req.hedge_attempt = None
+        req.hedge_call = reactor.callLater(delay, self._hedgeRequest, 
+            req, host)
+
+    def _hedgeRequest(self, req, host):
+        req.hedge_call = None
+        if req.state != "active" or req.cancelled:
+            return
+        if self.hedge_tokens.get(host, 0) < 1 or \
+                self.active_count >= self.max_simul_reqs:
+            return
+        # A duplicate is a request like any other, and may not exceed the 
+        # host's rate or simultaneous request limits, or its proxies'.
+        if self._hostAtCapacity(host) or self._hostWaitTime(host) > 0:
+            return
+        if not self._proxyAvailable(req):
+            return
+        bucket = self._getRequestBucket(host)
+        if bucket is not None:
+            bucket.consume()
+        self.hedge_tokens[host] -= 1
+        LOGGER.debug("Hedging request for %s." % req.url)
+        attempt = req.copy()
+        attempt.cancelled = False
+        attempt.dispatch_time = time.time()
+        req.hedge_attempt = attempt
+        self.active_reqs[host] = self.active_reqs.get(host, 0) + 1
+        self.active_count += 1
+        d = self._getPage(attempt)
+        d.addCallback(self._hedgeComplete, req, attempt, host)
+        d.addErrback(self._hedgeError, req, attempt, host)
+
+    def _hedgeComplete(self, response, req, attempt, host):
+        self._stopWatchdog(attempt)
+        self._releaseSlot(host)
+        if attempt.cancelled or req.state != "active" or \
+                req.cancelled:
+            return None
+        # The duplicate won. Abort the original request, whose callbacks 
+        # then only release its slot.
+        attempt.cancelled = True
+        req.cancelled = True
+        self._abortRequest(req)
+        self._recordLatency(host, attempt)
+        self._adaptConcurrency(host, attempt)
+        self._recordCircuitResult(host)
+        self._deliverResponse(response, req)
+        return None
+
+    def _hedgeError(self, error, req, attempt, host):
+        # The original request is still running, and reports its own 
+        # result.
+        self._stopWatchdog(attempt)
+        self._releaseSlot(host)
+        return None
+
+    def _cancelHedge(self, req):
+        """
+        Cancel a request's pending hedge, or abort its running duplicate.
+        """
+        if req.hedge_call is not None:
+            if req.hedge_call.active():
+                req.hedge_call.cancel()
+            req.hedge_call = None
+        attempt = req.hedge_attempt
+        if attempt is not None and not attempt.cancelled:
+            attempt.cancelled = True
+            self._abortRequest(attempt)
+
+    def _finishRequest(self, req):
+        req.state = "done"
+        if req.deadline_call is not None:
+            if req.deadline_call.active():
+                req.deadline_call.cancel()
+            req.deadline_call = None
+
+    def _cancelRequest(self, req, deferred):
+        """
+        Canceller of the Deferred returned by ``getPage()``.
+        """
+        self._abandonRequest(req)
+
+    def _deadlineExpired(self, req):
+        req.deadline_call = None
+        if req.state not in ["queued", "waiting"]:
+            # Sent requests are bounded by their timeout.
+            return
+        self._abandonRequest(req)
+        if not req.deferred.called:
+            req.deferred.errback(defer.TimeoutError(
+                "Deadline for %s passed while it was queued." % req.url))
+
+    def _abandonRequest(self, req):
+        """
+        Drop a queued request, or abort a sent one, once its caller has 
+        stopped waiting. Requests with coalesced callers still waiting 
+        are left alone.
+        """
+        if req.state == "done" or req.cancelled:
+            return
+        key = req.coalescing_key
+        if key is not None:
+            if len(self.coalesced_reqs.get(key, [])) > 0:
+                return
+            self.coalesced_reqs.pop(key, None)
+            self.coalescing_reqs.pop(key, None)
+        req.cancelled = True
+        state = req.state
+        self._finishRequest(req)
+        if state == "queued":
+            self.pending_reqs[req.host].discard()
+            self.pending_count -= 1
+        elif state == "waiting":
+            self.pending_count -= 1
+        elif state == "active":
+            self._cancelHedge(req)
+            self._abortRequest(req)
+
+    def _abortRequest(self, req):
+        """
+        Stop the transfer of a sent request. Its errback then releases the
+        request's slot.
+        """
+        if req.page_deferred is not None:
+            req.page_deferred.cancel()
+        elif req.factory is not None:
+            factory = req.factory
+            factory.cancelled = True
+            if getattr(factory, "connector", None) is not None:
+                factory.connector.disconnect()
+
+    def _cancelCoalesced(self, key, deferred):
+        """
+        Canceller of the Deferred of a request coalesced with an identical
+        request.
+        """
+        self._stopWaiting(key, deferred)
+
+    def _coalescedDeadlineExpired(self, key, deferred):
+        self._stopWaiting(key, deferred)
+        if not deferred.called:
+            deferred.errback(defer.TimeoutError(
+                "Deadline passed while waiting for an identical request."))
+
+    def _stopWaiting(self, key, deferred):
+        """
+        Remove the Deferred of a coalesced request from those waiting on a
+        shared request, and abandon the shared request if its own caller 
+        and every coalesced caller have stopped waiting.
+        """
+        waiting = self.coalesced_reqs.get(key, [])
+        for entry in waiting:
+            if entry[0] is deferred:
+                waiting.remove(entry)
+                if entry[2] is not None and entry[2].active():
+                    entry[2].cancel()
+                break
+        req = self.coalescing_reqs.get(key)
+        if len(waiting) == 0 and req is not None and req.deferred.called:
+            self._abandonRequest(req)
+
+    def _stopWatchdog(self, req):
+        if req.watchdog is not None:
+            req.watchdog.stop()
+            req.watchdog = None
+
+    def _getTransferWatchdog(self, req, throttle):
+        """
+        Return a TransferWatchdog for a request, or None if it has no first
+        byte timeout and throughput is not checked.
+        """
+        if not req.first_byte_timeout and not self.min_bytes_per_sec:
+            return None
+        return TransferWatchdog(
+            req.url,
+            first_byte_timeout=req.first_byte_timeout,
+            min_bytes_per_second=self.min_bytes_per_sec,
+            window=self.throughput_window,
+            throttle=throttle)
+
+    def _connectTimeout(self, req, timeout):
+        """
+        Return the connect timeout of a request, no longer than its total
+        timeout.
+        """
+        if not req.connect_timeout:
+            return timeout
+        if not timeout:
+            return req.connect_timeout
+        return min(req.connect_timeout, timeout)
+
+    def _requestTimeout(self, req):
+        """
+        Return the transfer timeout of a request, shortened to fit its 
+        deadline.
+        """
+        if req.deadline is None:
+            return req.timeout
+        remaining = max(0.001, req.deadline - time.time())
+        if not req.timeout:
+            return remaining
+        return min(req.timeout, remaining)
+
+    def _getRetryBucket(self, host):
+        """
+        Return the token bucket of the host's retry budget, or ``None`` 
+        if retries are not budgeted.
+        """
+        if self.max_retries_per_host_per_sec == 0:
+            return None
+        if host not in self.retry_buckets:
+            self.retry_buckets[host] = TokenBucket(
+                self.max_retries_per_host_per_sec,
+                self.max_retries_burst_per_host)
+        return self.retry_buckets[host]
+
+    def _isIdempotent(self, req):
+        if req.idempotent is None:
+            return req.method.upper() in IDEMPOTENT_METHODS
+        return req.idempotent
+
+    def _shouldRetry(self, error, req, host):
+        """
+        Return True if a failed request has retries left, is idempotent, 
+        failed in a way worth retrying and fits in the host's retry budget.
+        """
+        if req.retries >= req.max_retries:
+            return False
+        if req.deadline is not None and time.time() >= req.deadline:
+            return False
+        if self._getCircuitState(host) == CIRCUIT_OPEN:
+            return False
+        if not self._isIdempotent(req) or not _isRetryableError(error):
+            return False
+        bucket = self._getRetryBucket(host)
+        if bucket is not None:
+            if bucket.waitTime() > 0:
+                LOGGER.debug("Retry budget for %s exhausted." % host)
+                return False
+            bucket.consume()
+        return True
+
+    def _retryRequest(self, error, req, host):
+        """
+        Queue a failed request again after an exponential backoff delay 
+        with full jitter, or the delay its ``Retry-After`` header asks for.
+        """
+        backoff = min(self.max_retry_backoff, 
+            self.retry_backoff * 2 ** req.retries)
+        delay = random.uniform(0, backoff)
+        retry_after = _getRetryAfter(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        req.retries += 1
+        req.state = "waiting"
+        LOGGER.debug("Retrying %s in %.2f seconds (%s of %s): %s" % (
+            req.url, delay, req.retries, req.max_retries, 
+            error.getErrorMessage()))
+        # Still pending while it waits.
+        self.pending_count += 1
+        reactor.callLater(delay, self._queueRequest, req, host)
+
+    def _popCoalesced(self, req):
+        """
+        Stop coalescing on a finished request and return the Deferreds of 
+        the identical requests waiting on it. Cookies set by the response 
+        are copied to each waiting request's cookie dictionary.
+        """
+        if req.coalescing_key is None:
+            return []
+        self.coalescing_reqs.pop(req.coalescing_key, None)
+        waiting = self.coalesced_reqs.pop(req.coalescing_key, [])
+        deferreds = []
+        for d, cookies, deadline_call in waiting:
+            if deadline_call is not None and deadline_call.active():
+                deadline_call.cancel()
+            if cookies is not None and req.cookies is not None and \
+                    cookies is not req.cookies:
+                cookies.update(req.cookies)
+            deferreds.append(d)
+        return deferreds
+
+    def _proxyAvailable(self, req):
+        """
+        Return True if a request can be sent now, because it does not go 
+        through a proxy or a proxy can take another request.
+        """
+        if self.proxy_pool is None or len(self.proxy_pool) == 0:
+            return True
+        if _parse(req.url)[0] != "http":
+            return True
+        return self.proxy_pool.isAvailable()
+
+    def _acquireProxy(self, req, scheme):
+        """
+        Choose a proxy for a request. Returns the proxy's ``(host, port)``
+        tuple, or ``None`` to connect directly.
+        """
+        req.proxy = None
+        if self.proxy_pool is None or scheme != "http":
+            return None
+        req.proxy = self.proxy_pool.acquire()
+        if req.proxy is None:
+            return None
+        return self.proxy_pool.getAddress(req.proxy)
+
+    def _releaseProxy(self, result, req):
+        if req.proxy is None:
+            return result
+        if isinstance(result, Failure):
+            error = result
+        else:
+            error = None
+        self.proxy_pool.release(req.proxy, error, 
+            record_result=not req.cancelled)
+        proxy_blocked_hosts = self.proxy_blocked_hosts
+        self.proxy_blocked_hosts = set()
+        for host in proxy_blocked_hosts:
+            self._scheduleHost(host)
+        return result
+
     def _getPage(self, req): 
-        scheme, host, port = _parse(req['url'])[0:3]
-        factory = HTTPClientFactory(
-            req['url'],
-            method=req['method'],
-            postdata=req['postdata'],
-            headers=req['headers'],
-            agent=req['agent'],
-            timeout=req['timeout'],
-            cookies=req['cookies'],
-            followRedirect=req['follow_redirect']
-        )
+        scheme, host, port = _parse(req.url)[0:3]
+        throttle = self._getBandwidthThrottle(req.host)
+        timeout = self._requestTimeout(req)
+        connect_timeout = self._connectTimeout(req, timeout)
+        watchdog = self._getTransferWatchdog(req, throttle)
+        req.watchdog = watchdog
+        proxy = self._acquireProxy(req, scheme)
+        if self.persistent_client is not None:
+            req.page_deferred = self.persistent_client.getPage(
+                req.url,
+                method=req.method,
+                postdata=req.postdata,
+                headers=req.headers,
+                agent=req.agent,
+                timeout=timeout,
+                cookies=req.cookies,
+                follow_redirect=req.follow_redirect,
+                throttle=throttle,
+                watchdog=watchdog,
+                connect_timeout=connect_timeout,
+                proxy=proxy)
+            req.page_deferred.addBoth(self._releaseProxy, req)
+            return req.page_deferred
+        factory_kwargs = {
+            "method":req.method,
+            "postdata":req.postdata,
+            "headers":req.headers,
+            "agent":req.agent,
+            "timeout":timeout,
+            "cookies":req.cookies,
+            "followRedirect":req.follow_redirect
+        }
+        if proxy is not None:
+            factory = ProxyHTTPClientFactory(proxy, req.url, 
+                **factory_kwargs)
+            host, port = proxy
+        else:
+            factory = HTTPClientFactory(req.url, **factory_kwargs)
+        if throttle is not None or watchdog is not None:
+            factory.protocol = MonitoredHTTPPageGetter
+            factory.throttle = throttle
+            factory.watchdog = watchdog
+        if watchdog is not None:
+            watchdog.start(self._abortFactory, factory)
+        req.factory = factory
+        if self.dns_cache is not None:
+            d = self.dns_cache.getHostByName(host)
+            d.addCallback(self._connect, scheme, port, factory, 
+                connect_timeout)
+            d.addErrback(self._resolveError, factory)
+        else:
+            self._connect(host, scheme, port, factory, connect_timeout)
+        factory.deferred.addCallback(self._getPageComplete, factory)
+        factory.deferred.addErrback(self._getPageError, factory)
+        factory.deferred.addBoth(self._releaseProxy, req)
+        return factory.deferred
+
+    def _connect(self, address, scheme, port, factory, timeout):
+        if getattr(factory, "cancelled", False):
+            # Cancelled while resolving.
+            factory.clientConnectionFailed(None, Failure(
+                defer.CancelledError()))
+            return
         if scheme == 'https':
-            reactor.connectSSL(
-                                    host, 
+            factory.connector = reactor.connectSSL(
+                                    address, 
                                     port, 
                                     factory, 
                                     AllCipherSSLClientContextFactory(), 
-                                    timeout=req['timeout']
+                                    timeout=timeout
                                 )
         else:
-            reactor.connectTCP(host, port, factory, timeout=req['timeout'])
-        factory.deferred.addCallback(self._getPageComplete, factory)
-        factory.deferred.addErrback(self._getPageError, factory)
-        return factory.deferred
+            factory.connector = reactor.connectTCP(address, port, factory, 
+                timeout=timeout)
+
+    def _abortFactory(self, exception, factory):
+        """
+        Fail an HTTPClientFactory request with *exception* and drop its 
+        connection.
+        """
+        factory.noPage(Failure(exception))
+        if getattr(factory, "connector", None) is not None:
+            factory.connector.disconnect()
+
+    def _resolveError(self, error, factory):
+        factory.clientConnectionFailed(None, error)
 
     def _getPageComplete(self, response, factory):
         return {
@@ -43,6 +43,10 @@ class ExecutionResource(BaseResource):
                     kwargs["cache"] = int(request.args["cache"][0])
                 if "prioritize" in request.args: 
                     kwargs["prioritize"] = evaluateBoolean(request.args["prioritize"][0])
+                if "priority" in request.args: 
+                    kwargs["priority"] = int(request.args["priority"][0])
+                if "tenant" in request.args: 
+                    kwargs["tenant"] = request.args["tenant"][0]
                 d = self.executionserver.pg.getPage(request.args["url"][0], **kwargs)              
                 d.addCallback(self._getpageCallback, request)         
                 d.addErrback(self._errorResponse) 
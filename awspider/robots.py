@@ -0,0 +1,341 @@
+import re
+import time
+import urllib
+import functools
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.web.client import _parse
+from .exceptions import RobotsDisallowedException
+import logging
+
+
+LOGGER = logging.getLogger("main")
+
+
+def parseRobots(data, agent):
+    """
+    Parse a robots.txt file. Returns a tuple of a list of
+    ``(allow, pattern)`` rules and the crawl delay, in seconds or ``None``,
+    of the group that applies to *agent*.
+
+    **Arguments:**
+     * *data* -- Contents of the robots.txt file.
+     * *agent* -- Name of the crawler, matched against ``User-agent``
+       lines. (Example, ``"AWSpider"``)
+    """
+    agent = agent.split("/")[0].strip().lower()
+    # List of [user agents, rules, crawl delay] groups.
+    groups = []
+    group = None
+    for line in data.splitlines():
+        line = line.split("#")[0].strip()
+        if ":" not in line:
+            continue
+        field, value = line.split(":", 1)
+        field = field.strip().lower()
+        value = value.strip()
+        if field == "user-agent":
+            if group is None or len(group[1]) > 0 or group[2] is not None:
+                group = [[], [], None]
+                groups.append(group)
+            group[0].append(value.lower())
+        elif group is None:
+            continue
+        elif field in ["allow", "disallow"]:
+            if value != "":
+                group[1].append((field == "allow", value))
+        elif field == "crawl-delay":
+            try:
+                group[2] = float(value)
+            except ValueError:
+                pass
+    default = None
+    for user_agents, rules, crawl_delay in groups:
+        for user_agent in user_agents:
+            if user_agent == "":
+                continue
+            if user_agent == "*":
+                if default is None:
+                    default = (rules, crawl_delay)
+            elif user_agent in agent:
+                return (rules, crawl_delay)
+    if default is not None:
+        return default
+    return ([], None)
+
+
+def isAllowed(rules, path):
+    """
+    Return whether a path is allowed by robots.txt rules. The longest
+    matching pattern applies, and ``Allow`` wins ties.
+
+    **Arguments:**
+     * *rules* -- List of ``(allow, pattern)`` rules from
+       ``parseRobots()``.
+     * *path* -- URL path and query. (Example, ``"/search?q=awspider"``)
+    """
+    path = urllib.unquote(path)
+    match_length = -1
+    allowed = True
+    for allow, pattern in rules:
+        if len(pattern) < match_length:
+            continue
+        if len(pattern) == match_length and not allow:
+            continue
+        if _compilePattern(pattern).match(path):
+            match_length = len(pattern)
+            allowed = allow
+    return allowed
+
+
+# Dictionary of compiled regular expressions, by robots.txt pattern.
+_patterns = {}
+
+def _compilePattern(pattern):
+    if pattern not in _patterns:
+        if len(_patterns) >= 10000:
+            _patterns.clear()
+        expression = re.escape(urllib.unquote(pattern)).replace("\\*", ".*")
+        if expression.endswith("\\$"):
+            expression = expression[:-2] + "$"
+        _patterns[pattern] = re.compile(expression)
+    return _patterns[pattern]
+
+
+class RobotsCache(object):
+
+    """
+    Fetches and caches robots.txt files, applies their ``Crawl-delay`` as
+    host rate limits and rejects disallowed URLs before they are queued.
+    Has the ``getPage()`` method of the RequestQueuer it wraps, so it can
+    be used in its place.
+    """
+
+    def __init__(self,
+                 rq,
+                 agent="AWSpider",
+                 ttl=86400,
+                 error_ttl=300,
+                 timeout=30,
+                 max_crawl_delay=60,
+                 max_hosts=10000):
+        """
+        **Arguments:**
+         * *rq* -- RequestQueuer object used to fetch robots.txt files and
+           pages.
+
+        **Keyword arguments:**
+         * *agent* -- User agent robots.txt files are requested with and
+           matched against. (Default ``'AWSpider'``)
+         * *ttl* -- Seconds a robots.txt file is cached. (Default 86400)
+         * *error_ttl* -- Seconds a robots.txt file that could not be
+           fetched is cached. Missing files and other 4xx responses allow
+           every URL. 429 and 5xx responses and failed requests disallow
+           every URL until the file is requested again. (Default 300)
+         * *timeout* -- robots.txt request timeout, in seconds.
+           (Default 30)
+         * *max_crawl_delay* -- Longest ``Crawl-delay`` applied, in
+           seconds. A host's own rate limit applies if it is slower, and
+           is restored when the ``Crawl-delay`` expires. (Default 60)
+         * *max_hosts* -- Maximum number of robots.txt files cached.
+           (Default 10000)
+        """
+        self.rq = rq
+        self.agent = agent
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.max_crawl_delay = max_crawl_delay
+        self.max_hosts = max_hosts
+        # Dictionary of (rules, expiration timestamp), by robots.txt URL.
+        self.cache = {}
+        # Dictionary of lists of Deferreds waiting on a robots.txt
+        # request, by robots.txt URL.
+        self.pending_requests = {}
+        # Dictionary of (requests per second, burst, crawl delay rate) 
+        # tuples of the limits replaced by a Crawl-delay, by host group.
+        self.replaced_rates = {}
+
+    def getPage(self, url, *args, **kwargs):
+        """
+        Make an HTTP request with the wrapped RequestQueuer if robots.txt
+        allows it, otherwise fail with ``RobotsDisallowedException``.
+        Takes the arguments of ``RequestQueuer.getPage()``.
+
+        **Arguments:**
+         * *url* -- URL for the request.
+        """
+        robots_url, path = self._splitURL(url)
+        rules = self._getCachedRules(robots_url)
+        if rules is not None:
+            if not isAllowed(rules, path):
+                return fail(self._disallowed(url))
+            return self.rq.getPage(url, *args, **kwargs)
+        # Dictionary holding the page request once robots.txt allows it.
+        state = {"request":None}
+        d = Deferred(functools.partial(self._cancelPage, state))
+        rules_deferred = self._getRules(robots_url)
+        rules_deferred.addCallback(self._getPageCallback, d, state, url, 
+            path, args, kwargs)
+        return d
+
+    def _getPageCallback(self, rules, d, state, url, path, args, kwargs):
+        if d.called:
+            # Cancelled while robots.txt was requested.
+            return
+        if not isAllowed(rules, path):
+            d.errback(self._disallowed(url))
+            return
+        state["request"] = self.rq.getPage(url, *args, **kwargs)
+        state["request"].chainDeferred(d)
+
+    def _cancelPage(self, state, d):
+        if state["request"] is not None:
+            state["request"].cancel()
+
+    def isAllowed(self, url):
+        """
+        Return a Deferred that fires with whether robots.txt allows a URL.
+
+        **Arguments:**
+         * *url* -- URL. (Example, ``"http://www.google.com/search"``)
+        """
+        robots_url, path = self._splitURL(url)
+        d = self._getRules(robots_url)
+        d.addCallback(isAllowed, path)
+        return d
+
+    def _disallowed(self, url):
+        return RobotsDisallowedException(
+            "robots.txt disallows %s for %s." % (url, self.agent))
+
+    def _splitURL(self, url):
+        scheme, host, port, path = _parse(url)[0:4]
+        if (scheme, port) in [("http", 80), ("https", 443)]:
+            robots_url = "%s://%s/robots.txt" % (scheme, host)
+        else:
+            robots_url = "%s://%s:%s/robots.txt" % (scheme, host, port)
+        return robots_url, path
+
+    def _getCachedRules(self, robots_url):
+        if robots_url in self.cache:
+            rules, expires = self.cache[robots_url]
+            if expires > time.time():
+                return rules
+            self._removeRules(robots_url)
+        return None
+
+    def _removeRules(self, robots_url):
+        del self.cache[robots_url]
+        self._restoreRate(robots_url)
+
+    def _getRules(self, robots_url):
+        rules = self._getCachedRules(robots_url)
+        if rules is not None:
+            return succeed(rules)
+        d = Deferred()
+        if robots_url in self.pending_requests:
+            self.pending_requests[robots_url].append(d)
+            return d
+        self.pending_requests[robots_url] = [d]
+        request = self.rq.getPage(
+            robots_url,
+            agent=self.agent,
+            timeout=self.timeout)
+        request.addCallback(self._getRulesCallback, robots_url)
+        request.addErrback(self._getRulesErrback, robots_url)
+        return d
+
+    def _getRulesCallback(self, data, robots_url):
+        rules, crawl_delay = parseRobots(data["response"], self.agent)
+        if crawl_delay is not None:
+            self._setCrawlDelay(robots_url, crawl_delay)
+        else:
+            self._restoreRate(robots_url)
+        self._cacheRules(robots_url, rules, self.ttl)
+
+    def _getRulesErrback(self, error, robots_url):
+        self._restoreRate(robots_url)
+        status = getattr(error.value, "status", None)
+        try:
+            status = int(status)
+        except (TypeError, ValueError):
+            status = None
+        if status is not None and 400 <= status < 500 and status != 429:
+            LOGGER.debug("Could not get %s, allowing all URLs: %s" % (
+                robots_url,
+                error.getErrorMessage()))
+            self._cacheRules(robots_url, [], self.error_ttl)
+            return
+        # The server may be down or overloaded, so wait until the file can 
+        # be read.
+        LOGGER.debug("Could not get %s, disallowing all URLs: %s" % (
+            robots_url,
+            error.getErrorMessage()))
+        self._cacheRules(robots_url, [(False, "/")], self.error_ttl)
+
+    def _getHostGroup(self, robots_url):
+        host = _parse(robots_url)[1]
+        group = self.rq.getHostGroup(host)
+        if group is None:
+            group = host
+        return group
+
+    def _getReplacedRate(self, group):
+        """
+        Return the ``(requests per second, burst)`` limits of a host group
+        without its Crawl-delay. Limits changed since the Crawl-delay was 
+        applied replace those it replaced.
+        """
+        rate = self.rq.getHostMaxRequestsPerSecond(group)
+        burst = self.rq.getHostMaxRequestsBurst(group)
+        if group in self.replaced_rates:
+            replaced_rate, replaced_burst, crawl_rate = \
+                self.replaced_rates[group]
+            if rate == crawl_rate and burst == 1:
+                return replaced_rate, replaced_burst
+        return rate, burst
+
+    def _setCrawlDelay(self, robots_url, crawl_delay):
+        group = self._getHostGroup(robots_url)
+        crawl_delay = min(crawl_delay, self.max_crawl_delay)
+        if crawl_delay <= 0:
+            self._restoreRate(robots_url)
+            return
+        rate, burst = self._getReplacedRate(group)
+        crawl_rate = 1.0 / crawl_delay
+        if rate != 0 and rate <= crawl_rate:
+            # The host's own limit is slower.
+            self._restoreRate(robots_url)
+            return
+        LOGGER.debug("Setting crawl delay of %s to %s seconds." % (
+            group,
+            crawl_delay))
+        self.replaced_rates[group] = (rate, burst, crawl_rate)
+        self.rq.setHostMaxRequestsPerSecond(group, crawl_rate)
+        self.rq.setHostMaxRequestsBurst(group, 1)
+
+    def _restoreRate(self, robots_url):
+        """
+        Restore the limits a host group's Crawl-delay replaced.
+        """
+        group = self._getHostGroup(robots_url)
+        if group not in self.replaced_rates:
+            return
+        rate, burst = self._getReplacedRate(group)
+        del self.replaced_rates[group]
+        LOGGER.debug("Removing crawl delay of %s." % group)
+        self.rq.setHostMaxRequestsPerSecond(group, rate)
+        self.rq.setHostMaxRequestsBurst(group, burst)
+
+    def _cacheRules(self, robots_url, rules, ttl):
+        now = time.time()
+        if len(self.cache) >= self.max_hosts:
+            for key in self.cache.keys():
+                if self.cache[key][1] <= now:
+                    self._removeRules(key)
+            if len(self.cache) >= self.max_hosts:
+                for key in self.cache.keys():
+                    self._removeRules(key)
+        self.cache[robots_url] = (rules, now + ttl)
+        for d in self.pending_requests.pop(robots_url):
+            d.callback(rules)
@@ -16,7 +16,26 @@ class DataServer(BaseServer):
                  log_directory=None,
                  log_level="debug",
                  name=None,
-                 max_simultaneous_requests=50): 
+                 max_simultaneous_requests=50,
+                 max_simultaneous_aws_requests=50,
+                 persistent_connections=False,
+                 coalesce_requests=False,
+                 aws_max_retries=0,
+                 aws_hedge_requests=False,
+                 circuit_breaker_threshold=0,
+                 max_bytes_per_second=0,
+                 min_bytes_per_second=0,
+                 host_grouping=None,
+                 obey_robots_txt=False,
+                 proxies=None,
+                 local_cache_memory_size=0,
+                 local_cache_directory=None,
+                 local_cache_disk_size=1024 * 1024 * 1024,
+                 http_cache_backend=None,
+                 metadata_index_file=None,
+                 http_cache_compression=None,
+                 http_cache_compression_level=6,
+                 http_cache_deduplication=False): 
         if name == None:
             name = "AWSpider Data Server UUID: %s" % self.uuid
         resource = DataResource(self)
@@ -32,7 +51,26 @@ class DataServer(BaseServer):
             log_level=log_level,
             name=name,
             max_simultaneous_requests=max_simultaneous_requests,
-            port=port)
+            port=port,
+            max_simultaneous_aws_requests=max_simultaneous_aws_requests,
+            persistent_connections=persistent_connections,
+            coalesce_requests=coalesce_requests,
+            aws_max_retries=aws_max_retries,
+            aws_hedge_requests=aws_hedge_requests,
+            circuit_breaker_threshold=circuit_breaker_threshold,
+            max_bytes_per_second=max_bytes_per_second,
+            min_bytes_per_second=min_bytes_per_second,
+            host_grouping=host_grouping,
+            obey_robots_txt=obey_robots_txt,
+            proxies=proxies,
+            local_cache_memory_size=local_cache_memory_size,
+            local_cache_directory=local_cache_directory,
+            local_cache_disk_size=local_cache_disk_size,
+            http_cache_backend=http_cache_backend,
+            metadata_index_file=metadata_index_file,
+            http_cache_compression=http_cache_compression,
+            http_cache_compression_level=http_cache_compression_level,
+            http_cache_deduplication=http_cache_deduplication)
                 
     def clearStorage(self):
         return self.s3.emptyBucket(self.aws_s3_storage_bucket)
@@ -10,8 +10,10 @@ from twisted.internet import reactor
 from twisted.web import server
 from .base import BaseServer, LOGGER
 from ..aws import sdb_now, sdb_now_add
+from ..bulkfetch import BulkFetch
 from ..resources import ExecutionResource
 from ..networkaddress import getNetworkAddress
+from ..requestqueuer import PRIORITY_PEER
 
 PRETTYPRINTER = pprint.PrettyPrinter(indent=4)
 
@@ -55,7 +57,26 @@ class ExecutionServer(BaseServer):
             time_offset=None,
             peer_check_interval=60,
             reservation_check_interval=60,
-            hammer_prevention=False):
+            hammer_prevention=False,
+            max_simultaneous_aws_requests=50,
+            persistent_connections=False,
+            coalesce_requests=False,
+            aws_max_retries=0,
+            aws_hedge_requests=False,
+            circuit_breaker_threshold=0,
+            max_bytes_per_second=0,
+            min_bytes_per_second=0,
+            host_grouping=None,
+            obey_robots_txt=False,
+            proxies=None,
+            local_cache_memory_size=0,
+            local_cache_directory=None,
+            local_cache_disk_size=1024 * 1024 * 1024,
+            http_cache_backend=None,
+            metadata_index_file=None,
+            http_cache_compression=None,
+            http_cache_compression_level=6,
+            http_cache_deduplication=False):
         if name == None:
             name = "AWSpider Execution Server UUID: %s" % self.uuid
         self.network_information["port"] = port
@@ -81,7 +102,26 @@ class ExecutionServer(BaseServer):
             log_level=log_level,
             name=name,
             time_offset=time_offset,
-            port=port)
+            port=port,
+            max_simultaneous_aws_requests=max_simultaneous_aws_requests,
+            persistent_connections=persistent_connections,
+            coalesce_requests=coalesce_requests,
+            aws_max_retries=aws_max_retries,
+            aws_hedge_requests=aws_hedge_requests,
+            circuit_breaker_threshold=circuit_breaker_threshold,
+            max_bytes_per_second=max_bytes_per_second,
+            min_bytes_per_second=min_bytes_per_second,
+            host_grouping=host_grouping,
+            obey_robots_txt=obey_robots_txt,
+            proxies=proxies,
+            local_cache_memory_size=local_cache_memory_size,
+            local_cache_directory=local_cache_directory,
+            local_cache_disk_size=local_cache_disk_size,
+            http_cache_backend=http_cache_backend,
+            metadata_index_file=metadata_index_file,
+            http_cache_compression=http_cache_compression,
+            http_cache_compression_level=http_cache_compression_level,
+            http_cache_deduplication=http_cache_deduplication)
 
     def start(self):
         reactor.callWhenRunning(self._start)
@@ -175,7 +215,7 @@ class ExecutionServer(BaseServer):
                 LOGGER.debug("Signaling %s to check peers." % self.peers[uuid]["uri"])
                 d = self.rq.getPage(
                     self.peers[uuid]["uri"] + "/coordinate", 
-                    prioritize=True)
+                    priority=PRIORITY_PEER)
                 d.addCallback(
                     self._peerCheckRequestCallback, 
                     self.peers[uuid]["uri"])
@@ -365,13 +405,13 @@ class ExecutionServer(BaseServer):
         if "local_ip" in peer:
             local_ip = peer["local_ip"][0]
             local_url = "http://%s:%s/server" % (local_ip, port)
-            d = self.rq.getPage(local_url, timeout=5, prioritize=True)
+            d = self.rq.getPage(local_url, timeout=5, priority=PRIORITY_PEER)
             d.addCallback(self._verifyPeerLocalIPCallback, uuid, local_ip, port)
             deferreds.append(d)
         if "public_ip" in peer:
             public_ip = peer["public_ip"][0]
             public_url = "http://%s:%s/server" % (public_ip, port)
-            d = self.rq.getPage(public_url, timeout=5, prioritize=True)
+            d = self.rq.getPage(public_url, timeout=5, priority=PRIORITY_PEER)
             d.addCallback(self._verifyPeerPublicIPCallback, uuid, public_ip, port)
             deferreds.append(d)
         if len(deferreds) > 0:
@@ -389,6 +429,7 @@ class ExecutionServer(BaseServer):
         self.peers[uuid]["public_ip"] = public_ip
 
     def getPage(self, *args, **kwargs):
+        self._setTenant(kwargs)
         if not self.hammer_prevention or len(self.peer_uuids) == 0:
             return self.pg.getPage(*args, **kwargs)
         else:
@@ -420,14 +461,28 @@ class ExecutionServer(BaseServer):
                     parameters["cache"] = kwargs["cache"]
                 if "prioritize" in kwargs: 
                     parameters["prioritize"] = kwargs["prioritize"]
+                if "priority" in kwargs: 
+                    parameters["priority"] = kwargs["priority"]
+                if "tenant" in kwargs: 
+                    parameters["tenant"] = kwargs["tenant"]
                 url = "%s/getpage?%s" % (
                     self.peers[peer_uuid]["uri"], 
                     urllib.urlencode(parameters))
                 LOGGER.debug("Rerouting request for %s to %s" % (args[0], url))
-                d = self.rq.getPage(url, prioritize=True)
+                d = self.rq.getPage(url, priority=PRIORITY_PEER)
                 d.addErrback(self._getPageErrback, args, kwargs) 
                 return d
 
+    def getPages(self, urls, callback, errback=None, max_in_flight=10, 
+                 **kwargs):
+        if not self.hammer_prevention or len(self.peer_uuids) == 0:
+            return BaseServer.getPages(self, urls, callback, 
+                errback=errback, max_in_flight=max_in_flight, **kwargs)
+        # Each URL may be rerouted to the peer responsible for its host.
+        self._setTenant(kwargs)
+        return BulkFetch(self.getPage, urls, callback, errback=errback, 
+            max_in_flight=max_in_flight, request_kwargs=kwargs).start()
+
     def _getPageErrback(self, error, args, kwargs):
         LOGGER.error(args[0] + ":" + str(error))
         return self.pg.getPage(*args, **kwargs)
@@ -14,6 +14,9 @@ from ..aws import AmazonS3
 from ..exceptions import DeleteReservationException
 from ..pagegetter import PageGetter
 from ..requestqueuer import RequestQueuer
+from ..robots import RobotsCache
+from ..localcache import LocalCache
+from ..metadataindex import MetadataIndex
 import pprint
 from boto.ec2.connection import EC2Connection
 
@@ -40,6 +43,9 @@ class BaseServer(object):
         "reservation_error"]
     functions = {}
     reservation_fast_caches = {}
+    # Name of the exposed function being called, which pages it requests
+    # are tagged with as their RequestQueuer tenant.
+    current_tenant = None
     
     def __init__(self,
                  aws_access_key_id=None, 
@@ -50,6 +56,25 @@ class BaseServer(object):
                  max_simultaneous_requests=100,
                  max_requests_per_host_per_second=0,
                  max_simultaneous_requests_per_host=0,
+                 max_simultaneous_aws_requests=50,
+                 persistent_connections=False,
+                 coalesce_requests=False,
+                 aws_max_retries=0,
+                 aws_hedge_requests=False,
+                 circuit_breaker_threshold=0,
+                 max_bytes_per_second=0,
+                 min_bytes_per_second=0,
+                 host_grouping=None,
+                 obey_robots_txt=False,
+                 proxies=None,
+                 local_cache_memory_size=0,
+                 local_cache_directory=None,
+                 local_cache_disk_size=1024 * 1024 * 1024,
+                 http_cache_backend=None,
+                 metadata_index_file=None,
+                 http_cache_compression=None,
+                 http_cache_compression_level=6,
+                 http_cache_deduplication=False,
                  log_file=None,
                  log_directory=None,
                  log_level="debug",
@@ -58,9 +83,23 @@ class BaseServer(object):
         self.rq = RequestQueuer( 
             max_simultaneous_requests=int(max_simultaneous_requests), 
             max_requests_per_host_per_second=int(max_requests_per_host_per_second), 
-            max_simultaneous_requests_per_host=int(max_simultaneous_requests_per_host))
+            max_simultaneous_requests_per_host=int(max_simultaneous_requests_per_host),
+            persistent_connections=persistent_connections,
+            coalesce_requests=coalesce_requests,
+            circuit_breaker_threshold=circuit_breaker_threshold,
+            max_bytes_per_second=int(max_bytes_per_second),
+            min_bytes_per_second=int(min_bytes_per_second),
+            host_grouping=host_grouping,
+            proxies=proxies)
         self.rq.setHostMaxRequestsPerSecond("127.0.0.1", 0)
         self.rq.setHostMaxSimultaneousRequests("127.0.0.1", 0)
+        # AWS control-plane traffic (S3, SDB) gets its own queuer and 
+        # concurrency budget so a crawl backlog can't starve it.
+        self.aws_rq = RequestQueuer(
+            max_simultaneous_requests=int(max_simultaneous_aws_requests),
+            max_requests_per_host_per_second=0,
+            max_simultaneous_requests_per_host=0,
+            persistent_connections=persistent_connections)
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.aws_s3_http_cache_bucket = aws_s3_http_cache_bucket
@@ -68,12 +107,42 @@ class BaseServer(object):
         self.s3 = AmazonS3(
             self.aws_access_key_id, 
             self.aws_secret_access_key, 
-            rq=self.rq)
+            rq=self.aws_rq,
+            max_retries=aws_max_retries,
+            hedge=aws_hedge_requests)
         self.scheduler_server_group=scheduler_server_group
+        if obey_robots_txt:
+            # Pages are requested through robots.txt checks, which set 
+            # per host rates from Crawl-delay.
+            self.robots = RobotsCache(self.rq)
+            page_rq = self.robots
+        else:
+            self.robots = None
+            page_rq = self.rq
+        if local_cache_memory_size > 0 or local_cache_directory is not None:
+            # Hot pages are served from this node before going to S3.
+            self.local_cache = LocalCache(
+                max_memory_size=int(local_cache_memory_size),
+                directory=local_cache_directory,
+                max_disk_size=int(local_cache_disk_size))
+        else:
+            self.local_cache = None
+        if metadata_index_file is not None:
+            # Cache headers are read from this node's index rather than 
+            # with a HEAD request to the cache backend.
+            self.metadata_index = MetadataIndex(metadata_index_file)
+        else:
+            self.metadata_index = None
         self.pg = PageGetter(
             self.s3, 
             self.aws_s3_http_cache_bucket, 
-            rq=self.rq)
+            rq=page_rq,
+            local_cache=self.local_cache,
+            cache_backend=http_cache_backend,
+            metadata_index=self.metadata_index,
+            compression=http_cache_compression,
+            compression_level=http_cache_compression_level,
+            deduplicate=http_cache_deduplication)
         self._setupLogging(log_file, log_directory, log_level)
 
     def _setupLogging(self, log_file, log_directory, log_level):
@@ -155,11 +224,21 @@ class BaseServer(object):
         return d
 
     def _waitForShutdown(self, shutdown_deferred):          
-        if self.rq.getPending() > 0 or self.rq.getActive() > 0:
+        if self.rq.getPending() > 0 or self.rq.getActive() > 0 or \
+                self.aws_rq.getPending() > 0 or self.aws_rq.getActive() > 0:
             LOGGER.debug("Waiting for shutdown.")
             reactor.callLater(1, self._waitForShutdown, shutdown_deferred)
             return
         self.shutdown_trigger_id = None
+        deferreds = [
+            self.rq.closeConnections(), 
+            self.aws_rq.closeConnections()]
+        if self.metadata_index is not None:
+            deferreds.append(self.metadata_index.flush())
+        d = DeferredList(deferreds)
+        d.addCallback(self._waitForShutdownCallback, shutdown_deferred)
+
+    def _waitForShutdownCallback(self, data, shutdown_deferred):
         LOGGER.debug("Shut down.")
         LOGGER.removeHandler(self.logging_handler)
         shutdown_deferred.callback(True)
@@ -174,10 +253,20 @@ class BaseServer(object):
             kwargs["reservation_fast_cache"] = reservation_fast_cache
         elif self.functions[function_name]["check_reservation_fast_cache"]:
             kwargs["reservation_fast_cache"] = None
-        d = maybeDeferred(func, **kwargs)
+        d = self._callFunction(func, kwargs, function_name)
         d.addCallback(self._callExposedFunctionCallback, function_name, uuid)
         d.addErrback(self._callExposedFunctionErrback, function_name, uuid)
         return d
+
+    def _callFunction(self, func, kwargs, function_name):
+        # Deferred callbacks carry no context, so only pages requested
+        # before the function returns are tagged with its name.
+        previous_tenant = self.current_tenant
+        self.current_tenant = function_name
+        try:
+            return maybeDeferred(func, **kwargs)
+        finally:
+            self.current_tenant = previous_tenant
         
     def _callExposedFunctionErrback(self, error, function_name, uuid):
         if uuid is not None and uuid in self.active_jobs:
@@ -329,14 +418,40 @@ class BaseServer(object):
         return function_name
 
     def getPage(self, *args, **kwargs):
+        self._setTenant(kwargs)
         return self.pg.getPage(*args, **kwargs)
+
+    def _setTenant(self, kwargs):
+        if "tenant" not in kwargs and self.current_tenant is not None:
+            kwargs["tenant"] = self.current_tenant
+
+    def getPages(self, urls, callback, errback=None, max_in_flight=10, 
+                 **kwargs):
+        self._setTenant(kwargs)
+        return self.pg.getPages(urls, callback, errback=errback, 
+            max_in_flight=max_in_flight, **kwargs)
         
     def setHostMaxRequestsPerSecond(self, *args, **kwargs):
         return self.rq.setHostMaxRequestsPerSecond(*args, **kwargs)
 
+    def setHostMaxRequestsBurst(self, *args, **kwargs):
+        return self.rq.setHostMaxRequestsBurst(*args, **kwargs)
+
     def setHostMaxSimultaneousRequests(self, *args, **kwargs):
         return self.rq.setHostMaxSimultaneousRequests(*args, **kwargs)
 
+    def setHostAdaptiveConcurrency(self, *args, **kwargs):
+        return self.rq.setHostAdaptiveConcurrency(*args, **kwargs)
+
+    def setHostMaxBytesPerSecond(self, *args, **kwargs):
+        return self.rq.setHostMaxBytesPerSecond(*args, **kwargs)
+
+    def setTenantWeight(self, *args, **kwargs):
+        return self.rq.setTenantWeight(*args, **kwargs)
+
+    def getProxyStates(self):
+        return self.rq.getProxyStates()
+
     def deleteReservation(self, uuid, function_name="Unknown"):
         LOGGER.info("Deleting reservation %s, %s." % (function_name, uuid))
         parameters = {'uuid': uuid}
@@ -389,14 +504,21 @@ class BaseServer(object):
         running_time = time.time() - self.start_time
         active_requests_by_host = self.rq.getActiveRequestsByHost()
         pending_requests_by_host = self.rq.getPendingRequestsByHost()
+        circuit_breakers_by_host = self.rq.getCircuitBreakerStatesByHost()
         data = {
             "load_avg":[str(Decimal(str(x), 2)) for x in os.getloadavg()],
             "running_time":running_time,
             "active_requests_by_host":active_requests_by_host,
             "pending_requests_by_host":pending_requests_by_host,
+            "circuit_breakers_by_host":circuit_breakers_by_host,
+            "proxies":self.rq.getProxyStates(),
             "active_requests":self.rq.getActive(),
-            "pending_requests":self.rq.getPending()
+            "pending_requests":self.rq.getPending(),
+            "aws_active_requests":self.aws_rq.getActive(),
+            "aws_pending_requests":self.aws_rq.getPending()
         }
+        if self.local_cache is not None:
+            data["local_cache"] = self.local_cache.getStats()
         LOGGER.debug("Got server data:\n%s" % PRETTYPRINTER.pformat(data))
         return data
 
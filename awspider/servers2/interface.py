@@ -7,6 +7,7 @@ from twisted.web.resource import Resource
 from twisted.internet import reactor
 from twisted.web import server
 from .base import BaseServer, LOGGER
+from ..requestqueuer import PRIORITY_INTERACTIVE
 from ..resources import InterfaceResource, ExposedResource
 from ..aws import sdb_now
 from ..evaluateboolean import evaluateBoolean
@@ -32,7 +33,26 @@ class InterfaceServer(BaseServer):
             port=5000, 
             log_file='interfaceserver.log',
             log_directory=None,
-            log_level="debug"):
+            log_level="debug",
+            max_simultaneous_aws_requests=50,
+            persistent_connections=False,
+            coalesce_requests=False,
+            aws_max_retries=0,
+            aws_hedge_requests=False,
+            circuit_breaker_threshold=0,
+            max_bytes_per_second=0,
+            min_bytes_per_second=0,
+            host_grouping=None,
+            obey_robots_txt=False,
+            proxies=None,
+            local_cache_memory_size=0,
+            local_cache_directory=None,
+            local_cache_disk_size=1024 * 1024 * 1024,
+            http_cache_backend=None,
+            metadata_index_file=None,
+            http_cache_compression=None,
+            http_cache_compression_level=6,
+            http_cache_deduplication=False):
         self.aws_access_key_id=aws_access_key_id
         self.aws_secret_access_key=aws_secret_access_key
         self.scheduler_server_group=scheduler_server_group
@@ -57,7 +77,26 @@ class InterfaceServer(BaseServer):
             log_file=log_file,
             log_directory=log_directory,
             log_level=log_level,
-            port=port)
+            port=port,
+            max_simultaneous_aws_requests=max_simultaneous_aws_requests,
+            persistent_connections=persistent_connections,
+            coalesce_requests=coalesce_requests,
+            aws_max_retries=aws_max_retries,
+            aws_hedge_requests=aws_hedge_requests,
+            circuit_breaker_threshold=circuit_breaker_threshold,
+            max_bytes_per_second=max_bytes_per_second,
+            min_bytes_per_second=min_bytes_per_second,
+            host_grouping=host_grouping,
+            obey_robots_txt=obey_robots_txt,
+            proxies=proxies,
+            local_cache_memory_size=local_cache_memory_size,
+            local_cache_directory=local_cache_directory,
+            local_cache_disk_size=local_cache_disk_size,
+            http_cache_backend=http_cache_backend,
+            metadata_index_file=metadata_index_file,
+            http_cache_compression=http_cache_compression,
+            http_cache_compression_level=http_cache_compression_level,
+            http_cache_deduplication=http_cache_deduplication)
         
     def start(self):
         reactor.callWhenRunning(self._start)
@@ -115,6 +154,20 @@ class InterfaceServer(BaseServer):
                 self.function_resource.putChild(function_name_parts[0], er)
             LOGGER.info("Function %s is now available via the HTTP interface." % function_name)
             
+    def getPage(self, *args, **kwargs):
+        self._setPriority(kwargs)
+        return BaseServer.getPage(self, *args, **kwargs)
+
+    def getPages(self, *args, **kwargs):
+        self._setPriority(kwargs)
+        return BaseServer.getPages(self, *args, **kwargs)
+
+    def _setPriority(self, kwargs):
+        # Interface server requests are made on behalf of a waiting HTTP 
+        # client, so they go ahead of background crawling.
+        if "priority" not in kwargs and not kwargs.get("prioritize"):
+            kwargs["priority"] = PRIORITY_INTERACTIVE
+
     def createReservation(self, function_name, **kwargs):
         uuid = None
         if not isinstance(function_name, str):
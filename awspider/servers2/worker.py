@@ -3,6 +3,7 @@ from ..resources2 import WorkerResource
 from ..networkaddress import getNetworkAddress
 from ..amqp import amqp as AMQP
 from ..resources import InterfaceResource, ExposedResource
+from ..cachebackends import MemcachedCacheBackend
 from MySQLdb.cursors import DictCursor
 from twisted.internet import reactor, protocol, task
 from twisted.enterprise import adbapi
@@ -52,13 +53,32 @@ class WorkerServer(BaseServer):
             amqp_prefetch_count=200,
             mysql_port=3306,
             memcached_port=11211,
+            memcached_http_cache=False,
             max_simultaneous_requests=100,
             max_requests_per_host_per_second=0,
             max_simultaneous_requests_per_host=0,
             port=5005,
             log_file='workerserver.log',
             log_directory=None,
-            log_level="debug"):
+            log_level="debug",
+            max_simultaneous_aws_requests=50,
+            persistent_connections=False,
+            coalesce_requests=False,
+            aws_max_retries=0,
+            aws_hedge_requests=False,
+            circuit_breaker_threshold=0,
+            max_bytes_per_second=0,
+            min_bytes_per_second=0,
+            host_grouping=None,
+            obey_robots_txt=False,
+            proxies=None,
+            local_cache_memory_size=0,
+            local_cache_directory=None,
+            local_cache_disk_size=1024 * 1024 * 1024,
+            metadata_index_file=None,
+            http_cache_compression=None,
+            http_cache_compression_level=6,
+            http_cache_deduplication=False):
         self.network_information["port"] = port
         # Create MySQL connection.
         self.mysql = adbapi.ConnectionPool(
@@ -75,6 +95,13 @@ class WorkerServer(BaseServer):
         self.memcached_port = memcached_port
         self.memc_ClientCreator = protocol.ClientCreator(
             reactor, MemCacheProtocol)
+        if memcached_http_cache:
+            # Pages are cached in memcached rather than S3.
+            http_cache_backend = MemcachedCacheBackend(
+                host=memcached_host,
+                port=memcached_port)
+        else:
+            http_cache_backend = None
         #Schedule Server
         self.scheduler_server_group=scheduler_server_group
         self.schedulerserver_port=schedulerserver_port
@@ -104,9 +131,28 @@ class WorkerServer(BaseServer):
             max_simultaneous_requests=max_simultaneous_requests,
             max_requests_per_host_per_second=max_requests_per_host_per_second,
             max_simultaneous_requests_per_host=max_simultaneous_requests_per_host,
+            http_cache_backend=http_cache_backend,
             log_file=log_file,
             log_directory=log_directory,
-            log_level=log_level)
+            log_level=log_level,
+            max_simultaneous_aws_requests=max_simultaneous_aws_requests,
+            persistent_connections=persistent_connections,
+            coalesce_requests=coalesce_requests,
+            aws_max_retries=aws_max_retries,
+            aws_hedge_requests=aws_hedge_requests,
+            circuit_breaker_threshold=circuit_breaker_threshold,
+            max_bytes_per_second=max_bytes_per_second,
+            min_bytes_per_second=min_bytes_per_second,
+            host_grouping=host_grouping,
+            obey_robots_txt=obey_robots_txt,
+            proxies=proxies,
+            local_cache_memory_size=local_cache_memory_size,
+            local_cache_directory=local_cache_directory,
+            local_cache_disk_size=local_cache_disk_size,
+            metadata_index_file=metadata_index_file,
+            http_cache_compression=http_cache_compression,
+            http_cache_compression_level=http_cache_compression_level,
+            http_cache_deduplication=http_cache_deduplication)
     
     def start(self):
         reactor.callWhenRunning(self._start)
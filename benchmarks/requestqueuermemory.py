@@ -0,0 +1,62 @@
+"""
+Measure the memory held by each pending RequestQueuer request.
+
+Queues requests for distinct URLs on one host without running the 
+reactor, so all but the first stay pending, and reports the growth of
+the process's resident memory per request.
+
+Usage: python requestqueuermemory.py [number of requests]
+"""
+import gc
+import os
+import resource
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from awspider.requestqueuer import RequestQueuer, QueuedRequest
+
+
+def getResidentMemory():
+    """
+    Return the resident memory of the process, in bytes.
+    """
+    try:
+        statm = open("/proc/self/statm").read().split()
+        return int(statm[1]) * resource.getpagesize()
+    except IOError:
+        # Peak, in kilobytes, where /proc is not available.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def queueRequests(count):
+    rq = RequestQueuer(max_simultaneous_requests_per_host=1)
+    urls = ["http://127.0.0.1:9/page/%s" % i for i in xrange(count)]
+    gc.collect()
+    before = getResidentMemory()
+    start = time.time()
+    deferreds = [rq.getPage(url) for url in urls]
+    elapsed = time.time() - start
+    gc.collect()
+    after = getResidentMemory()
+    return rq, deferreds, after - before, elapsed
+
+
+def main():
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 100000
+    rq, deferreds, memory, elapsed = queueRequests(count)
+    print "Pending requests:        %s" % rq.getPending()
+    print "Bytes per request:       %.0f" % (float(memory) / count)
+    print "Microseconds per getPage: %.1f" % (elapsed * 1000000 / count)
+    print "Request record size:     %s bytes (%s slots)" % (
+        sys.getsizeof(rq.pending_reqs["127.0.0.1"].first()),
+        len(QueuedRequest.__slots__))
+    print "Equivalent dict size:    %s bytes" % sys.getsizeof(
+        dict.fromkeys(QueuedRequest.__slots__))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ setup(
 
     packages = find_packages(),
 
-    install_requires = ['twisted>=8.1', 'genshi>=0.5.1', 'python-dateutil>=1.4', 'simplejson>=2.0.9', 'boto'],
+    install_requires = ['twisted>=12.1', 'genshi>=0.5.1', 'python-dateutil>=1.4', 'simplejson>=2.0.9', 'boto'],
     include_package_data = True,
     
     # metadata for upload to PyPI
@@ -1,12 +1,21 @@
 from amazons3test import AmazonS3TestCase
 from amazonsdbtest import AmazonSDBTestCase
 from amazonsqstest import AmazonSQSTestCase
+from cachebackendstest import CacheBackendsTestCase
+from compressiontest import CompressionTestCase
 from dataservertest import DataServerStartTestCase, DataServerTestCase
+from deduplicationtest import DeduplicationTestCase
+from dnscachetest import DNSCacheTestCase
 #from encodingtest import EncodingTestCase
 from evaluatebooleantest import EvaluateBooleanTestCase
 from executionservertest import ExecutionServerStartTestCase, ExecutionTestCase
+from hostgroupstest import HostGroupsTestCase
 from interfaceservertest import InterfaceTestCase, InterfaceServerStartTestCase
+from localcachetest import LocalCacheTestCase
+from metadataindextest import MetadataIndexTestCase
 from networkaddresstest import NetworkAddressTestCase
 from pagegettertest import PageGetterTestCase
+from plugintest import PluginTestCase
 from requestqueuertest import RequestQueuerTestCase
+from robotstest import RobotsTestCase
 from timeoffsettest import TimeOffsetTestCase
\ No newline at end of file
@@ -0,0 +1,178 @@
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, succeed
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.cachebackends import MemoryCacheBackend, \
+    FilesystemCacheBackend, MemcachedCacheBackend
+from awspider.exceptions import CacheMissException
+from awspider.pagegetter import PageGetter
+
+class FakeMemCacheProtocol(object):
+
+    """
+    In memory stand in for a connected MemCacheProtocol.
+    """
+
+    _disconnected = False
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return succeed((0, self.values.get(key)))
+
+    def set(self, key, value, flags=0, expireTime=0):
+        self.values[key] = value
+        return succeed(True)
+
+    def add(self, key, value, flags=0, expireTime=0):
+        if key in self.values:
+            return succeed(False)
+        self.values[key] = value
+        return succeed(True)
+
+    def increment(self, key, val=1):
+        if key not in self.values:
+            return succeed(False)
+        self.values[key] = str(int(self.values[key]) + val)
+        return succeed(int(self.values[key]))
+
+    def delete(self, key):
+        return succeed(self.values.pop(key, None) is not None)
+
+class FakeClientCreator(object):
+
+    def __init__(self):
+        self.connections = []
+
+    def connectTCP(self, host, port):
+        d = Deferred()
+        self.connections.append(d)
+        return d
+
+class CacheBackendsTestCase(unittest.TestCase):
+
+    def testMemoryCacheBackend(self):
+        return self._testCacheBackend(MemoryCacheBackend())
+
+    def testFilesystemCacheBackend(self):
+        return self._testCacheBackend(FilesystemCacheBackend(self.mktemp()))
+
+    def testMemcachedCacheBackend(self):
+        backend = MemcachedCacheBackend()
+        backend.memc = FakeMemCacheProtocol()
+        d = self._testCacheBackend(backend)
+        d.addCallback(self._testMemcachedCacheBackendCallback, backend)
+        return d
+
+    def _testMemcachedCacheBackendCallback(self, ignored, backend):
+        self.failUnlessEqual(backend.memc.values.keys(), 
+            ["awspider_generation"])
+        d = backend.put("abc", "body")
+        d.addCallback(self._testMemcachedCacheBackendCallback2, backend)
+        return d
+
+    def _testMemcachedCacheBackendCallback2(self, ignored, backend):
+        self.generation = backend.generation
+        self.failUnless("awspider_%s_abc" % self.generation in 
+            backend.memc.values)
+        d = backend.clear()
+        d.addCallback(self._testMemcachedCacheBackendCallback3, backend)
+        return d
+
+    def _testMemcachedCacheBackendCallback3(self, ignored, backend):
+        self.failUnlessEqual(int(backend.generation), 
+            int(self.generation) + 1)
+        d = backend.get("abc")
+        return self.assertFailure(d, CacheMissException)
+
+    def testMemcachedConnection(self):
+        backend = MemcachedCacheBackend()
+        backend.memc_ClientCreator = FakeClientCreator()
+        d = backend.get("abc")
+        d = self.assertFailure(d, CacheMissException)
+        deferreds = [d, backend.put("abc", "body")]
+        # Requests made while connecting share the connection.
+        self.failUnlessEqual(len(backend.memc_ClientCreator.connections), 1)
+        backend.memc_ClientCreator.connections[0].callback(
+            FakeMemCacheProtocol())
+        self.failUnlessEqual(backend.pending_connection, None)
+        return deferreds[1]
+
+    def _testCacheBackend(self, backend):
+        d = backend.getMetadata("abc")
+        d = self.assertFailure(d, CacheMissException)
+        d.addCallback(self._testCacheBackendCallback, backend)
+        return d
+
+    def _testCacheBackendCallback(self, ignored, backend):
+        d = backend.put(
+            "abc",
+            "body",
+            content_type="text/plain",
+            headers={"content-sha1":"123"})
+        d.addCallback(self._testCacheBackendCallback2, backend)
+        return d
+
+    def _testCacheBackendCallback2(self, ignored, backend):
+        d = backend.getMetadata("abc")
+        d.addCallback(self._testCacheBackendCallback3, backend)
+        return d
+
+    def _testCacheBackendCallback3(self, data, backend):
+        self.failUnlessEqual(data["response"], "")
+        self.failUnlessEqual(data["headers"], {
+            "content-sha1":["123"],
+            "content-type":["text/plain"]})
+        d = backend.get("abc")
+        d.addCallback(self._testCacheBackendCallback4, backend)
+        return d
+
+    def _testCacheBackendCallback4(self, data, backend):
+        self.failUnlessEqual(data["response"], "body")
+        self.failUnlessEqual(data["headers"]["content-sha1"], ["123"])
+        d = backend.delete("abc")
+        d.addCallback(self._testCacheBackendCallback5, backend)
+        return d
+
+    def _testCacheBackendCallback5(self, ignored, backend):
+        d = backend.get("abc")
+        return self.assertFailure(d, CacheMissException)
+
+    def testPageGetter(self):
+        self.mini_web_server = MiniWebServer()
+        self.pg = PageGetter(None, None, cache_backend=MemoryCacheBackend())
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/helloworld",
+            cache=1,
+            confirm_cache_write=True)
+        d.addCallback(self._testPageGetterCallback)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def _testPageGetterCallback(self, data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], False)
+        d = self.pg.getPage("http://127.0.0.1:8080/helloworld", cache=1)
+        d.addCallback(self._testPageGetterCallback2, data)
+        return d
+
+    def _testPageGetterCallback2(self, data, fresh_data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], True)
+        self.failUnlessEqual(data["response"], fresh_data["response"])
+        return self.pg.clearCache()
+
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
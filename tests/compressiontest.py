@@ -0,0 +1,74 @@
+from twisted.trial import unittest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.cachebackends import MemoryCacheBackend
+from awspider.compression import CODECS, isCompressible, compress, \
+    decompress
+from awspider.pagegetter import PageGetter
+
+class CompressionTestCase(unittest.TestCase):
+
+    def testIsCompressible(self):
+        self.failUnless(isCompressible("text/html; charset=UTF-8"))
+        self.failUnless(isCompressible("Application/JSON"))
+        self.failUnless(isCompressible("application/rss+xml"))
+        self.failIf(isCompressible("image/jpeg"))
+        self.failIf(isCompressible("application/zip"))
+        self.failIf(isCompressible(None))
+
+    def testCodecs(self):
+        data = "<html>%s</html>" % ("awspider " * 1000)
+        for codec in CODECS:
+            compressed_data = compress(codec, data, 9)
+            self.failUnless(len(compressed_data) < len(data))
+            self.failUnlessEqual(decompress(codec, compressed_data), data)
+
+    def testUnknownCodec(self):
+        self.failUnlessRaises(ValueError, PageGetter, None, None,
+            compression="unknown")
+
+    def testPageGetter(self):
+        self.mini_web_server = MiniWebServer()
+        self.cache_backend = MemoryCacheBackend()
+        self.pg = PageGetter(
+            None,
+            None,
+            cache_backend=self.cache_backend,
+            compression="zlib")
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/large",
+            cache=1,
+            confirm_cache_write=True)
+        d.addCallback(self._testPageGetterCallback)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def _testPageGetterCallback(self, data):
+        request_hash = self.cache_backend.cache.memory.keys()[0]
+        headers, response = self.cache_backend.cache.memory[request_hash]
+        self.failUnlessEqual(headers["cache-content-encoding"], ["zlib"])
+        self.failUnless(len(response) < len(data["response"]))
+        d = self.pg.getPage("http://127.0.0.1:8080/large", cache=1)
+        d.addCallback(self._testPageGetterCallback2, data)
+        return d
+
+    def _testPageGetterCallback2(self, data, fresh_data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], True)
+        self.failUnlessEqual(data["response"], fresh_data["response"])
+        self.failIf("cache-content-encoding" in data["headers"])
+
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
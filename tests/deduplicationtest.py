@@ -0,0 +1,79 @@
+from twisted.trial import unittest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+from fakes3 import FakeS3
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+import hashlib
+
+from awspider.pagegetter import PageGetter
+
+class DeduplicationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.mini_web_server = MiniWebServer()
+        self.s3 = FakeS3()
+        self.pg = PageGetter(self.s3, "bucket", deduplicate=True)
+
+    def tearDown(self):
+        return self.mini_web_server.shutdown()
+
+    def testDeduplication(self):
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/large",
+            hash_url="a",
+            cache=1,
+            confirm_cache_write=True)
+        d.addCallback(self._testDeduplicationCallback)
+        return d
+
+    def _testDeduplicationCallback(self, data):
+        self.body_key = "%s.body" % hashlib.sha1(data["response"]).hexdigest()
+        self.failUnlessEqual(self.s3.objects[self.body_key][0],
+            data["response"])
+        self.failUnlessEqual(self.s3.calls,
+            ["getObject", "headObject", "putObject", "putObject"])
+        self.s3.calls = []
+        # Same body, different request hash.
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/large",
+            hash_url="b",
+            cache=1,
+            confirm_cache_write=True)
+        d.addCallback(self._testDeduplicationCallback2)
+        return d
+
+    def _testDeduplicationCallback2(self, data):
+        # Only the pointer is written.
+        self.failUnlessEqual(self.s3.calls, ["getObject", "putObject"])
+        self.failUnlessEqual(len(self.s3.objects), 3)
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/large",
+            hash_url="b",
+            cache=1)
+        d.addCallback(self._testDeduplicationCallback3, data)
+        return d
+
+    def _testDeduplicationCallback3(self, data, fresh_data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], True)
+        self.failUnlessEqual(data["response"], fresh_data["response"])
+        self.failIf("cache-content-location" in data["headers"])
+        # A missing body is a cache miss, and is written again.
+        del self.s3.objects[self.body_key]
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/large",
+            hash_url="b",
+            cache=1,
+            confirm_cache_write=True)
+        d.addCallback(self._testDeduplicationCallback4)
+        return d
+
+    def _testDeduplicationCallback4(self, data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], False)
+        self.failUnless(self.body_key in self.s3.objects)
@@ -0,0 +1,150 @@
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.internet.error import DNSLookupError
+from twisted.names import dns
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.dnscache import DNSCache
+from awspider.requestqueuer import RequestQueuer
+
+class FakeResolver(object):
+    
+    def __init__(self, addresses, ttl=60):
+        self.addresses = addresses
+        self.ttl = ttl
+        self.lookups = []
+        
+    def lookupAddress(self, name):
+        self.lookups.append(name)
+        if name not in self.addresses:
+            return fail(dns.DomainError(name))
+        record = dns.RRHeader(
+            name=name, 
+            type=dns.A, 
+            ttl=self.ttl,
+            payload=dns.Record_A(self.addresses[name], self.ttl))
+        return succeed(([record], [], []))
+
+class DNSCacheTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.resolver = FakeResolver({"awspider.test":"127.0.0.1"})
+        self.dns_cache = DNSCache(resolver=self.resolver)
+        
+    def testGetHostByName(self):
+        d = self.dns_cache.getHostByName("awspider.test")
+        d.addCallback(self._testGetHostByNameCallback)
+        return d
+    
+    def _testGetHostByNameCallback(self, address):
+        self.failUnlessEqual(address, "127.0.0.1")
+        self.failUnlessEqual(
+            self.dns_cache.getCachedHostByName("awspider.test"), 
+            "127.0.0.1")
+        d = self.dns_cache.getHostByName("awspider.test")
+        d.addCallback(self._testGetHostByNameCallback2)
+        return d
+        
+    def _testGetHostByNameCallback2(self, address):
+        self.failUnlessEqual(address, "127.0.0.1")
+        self.failUnlessEqual(self.resolver.lookups, ["awspider.test"])
+
+    def testExpiredRecord(self):
+        self.resolver.ttl = 0
+        d = self.dns_cache.getHostByName("awspider.test")
+        d.addCallback(self._testExpiredRecordCallback)
+        return d
+        
+    def _testExpiredRecordCallback(self, address):
+        self.failUnlessEqual(
+            self.dns_cache.getCachedHostByName("awspider.test"), None)
+        d = self.dns_cache.getHostByName("awspider.test")
+        d.addCallback(self._testExpiredRecordCallback2)
+        return d
+
+    def _testExpiredRecordCallback2(self, address):
+        self.failUnlessEqual(len(self.resolver.lookups), 2)
+
+    def testNegativeCache(self):
+        d = self.dns_cache.getHostByName("missing.test")
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testNegativeCacheErrback)
+        return d
+        
+    def _testNegativeCacheErrback(self, error):
+        error.trap(DNSLookupError)
+        d = self.dns_cache.getHostByName("missing.test")
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testNegativeCacheErrback2)
+        return d
+
+    def _testNegativeCacheErrback2(self, error):
+        error.trap(DNSLookupError)
+        self.failUnlessEqual(self.resolver.lookups, ["missing.test"])
+
+    def testIPAddress(self):
+        d = self.dns_cache.getHostByName("10.0.0.1")
+        d.addCallback(self._testIPAddressCallback)
+        return d
+        
+    def _testIPAddressCallback(self, address):
+        self.failUnlessEqual(address, "10.0.0.1")
+        self.failUnlessEqual(self.resolver.lookups, [])
+
+    def testPrefetch(self):
+        self.dns_cache.prefetch("awspider.test")
+        self.dns_cache.prefetch("awspider.test")
+        self.dns_cache.prefetch("missing.test")
+        self.failUnlessEqual(
+            self.dns_cache.getCachedHostByName("awspider.test"), 
+            "127.0.0.1")
+        self.failUnlessEqual(
+            self.resolver.lookups, 
+            ["awspider.test", "missing.test"])
+
+    def testMaxEntries(self):
+        self.resolver.addresses["expired.test"] = "127.0.0.2"
+        self.resolver.addresses["other.test"] = "127.0.0.3"
+        self.dns_cache.max_entries = 2
+        self.resolver.ttl = 0
+        self.dns_cache.prefetch("expired.test")
+        self.resolver.ttl = 60
+        self.dns_cache.prefetch("awspider.test")
+        # Expired entries are pruned first.
+        self.dns_cache.prefetch("other.test")
+        self.failUnlessEqual(sorted(self.dns_cache.cache.keys()), 
+            ["awspider.test", "other.test"])
+        # The cache is cleared if it is still full.
+        self.dns_cache.prefetch("missing.test")
+        self.failUnlessEqual(self.dns_cache.cache.keys(), ["missing.test"])
+
+    def testRequestQueuer(self):
+        self.mini_web_server = MiniWebServer()
+        rq = RequestQueuer(dns_cache=self.dns_cache)
+        d = rq.getPage("http://awspider.test:8080/helloworld", timeout=5)
+        d.addCallback(self._testRequestQueuerCallback)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def _testRequestQueuerCallback(self, data):
+        self.failUnlessEqual(data["response"], "Hello World!")
+        self.failUnlessEqual(self.resolver.lookups, ["awspider.test"])
+        
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
+
+    def _unexpectedCallback(self, data):
+        self.fail("Expected an errback.")
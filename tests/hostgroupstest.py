@@ -0,0 +1,122 @@
+from twisted.trial import unittest
+from twisted.internet.defer import DeferredList
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+from dnscachetest import FakeResolver
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.dnscache import DNSCache
+from awspider.hostgroups import ExactHostGrouping, \
+    RegisteredDomainGrouping, ResolvedAddressGrouping
+from awspider.requestqueuer import RequestQueuer
+
+class HostGroupsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = FakeResolver({
+            "a.awspider.test":"127.0.0.1",
+            "b.awspider.test":"127.0.0.1"})
+        self.dns_cache = DNSCache(resolver=self.resolver)
+
+    def testExactHostGrouping(self):
+        grouping = ExactHostGrouping()
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("www.example.com"),
+            "www.example.com")
+
+    def testRegisteredDomainGrouping(self):
+        grouping = RegisteredDomainGrouping()
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("a.b.example.com"),
+            "example.com")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("example.com"),
+            "example.com")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("news.bbc.co.uk"),
+            "bbc.co.uk")
+        self.failUnlessEqual(grouping.getCachedHostGroup("co.uk"), "co.uk")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("127.0.0.1"),
+            "127.0.0.1")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("localhost"),
+            "localhost")
+
+    def testRegisteredDomainCache(self):
+        grouping = RegisteredDomainGrouping(max_entries=2)
+        grouping.getCachedHostGroup("a.example.com")
+        grouping.getCachedHostGroup("b.example.com")
+        grouping.getCachedHostGroup("a.example.com")
+        grouping.getCachedHostGroup("c.example.com")
+        # The least recently used hostname is evicted.
+        self.failUnlessEqual(grouping.cache.keys(), 
+            ["a.example.com", "c.example.com"])
+
+    def testPublicSuffixList(self):
+        filename = self.mktemp()
+        f = open(filename, "w")
+        f.write("// Comment\n\ncom\n*.kawasaki.jp\n!city.kawasaki.jp\n")
+        f.close()
+        grouping = RegisteredDomainGrouping(public_suffix_list=filename)
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("www.example.com"),
+            "example.com")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("a.b.kawasaki.jp"),
+            "a.b.kawasaki.jp")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("www.city.kawasaki.jp"),
+            "city.kawasaki.jp")
+
+    def testResolvedAddressGrouping(self):
+        grouping = ResolvedAddressGrouping(self.dns_cache)
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("a.awspider.test"),
+            None)
+        d = grouping.getHostGroup("a.awspider.test")
+        d.addCallback(self._testResolvedAddressGroupingCallback, grouping)
+        return d
+
+    def _testResolvedAddressGroupingCallback(self, group, grouping):
+        self.failUnlessEqual(group, "127.0.0.1")
+        self.failUnlessEqual(
+            grouping.getCachedHostGroup("a.awspider.test"),
+            "127.0.0.1")
+
+    def testRequestQueuer(self):
+        self.mini_web_server = MiniWebServer()
+        rq = RequestQueuer(
+            max_requests_per_host_per_second=0,
+            max_simultaneous_requests_per_host=1,
+            dns_cache=self.dns_cache,
+            host_grouping="address")
+        deferreds = []
+        deferreds.append(rq.getPage("http://a.awspider.test:8080/helloworld",
+            timeout=5))
+        deferreds.append(rq.getPage("http://b.awspider.test:8080/helloworld",
+            timeout=5))
+        self.failUnlessEqual(rq.getActiveRequestsByHost(), {"127.0.0.1":1})
+        self.failUnlessEqual(rq.getPendingRequestsByHost(), {"127.0.0.1":1})
+        self.failUnlessEqual(rq.getHostGroup("b.awspider.test"), "127.0.0.1")
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def testUnknownHostGrouping(self):
+        self.failUnlessRaises(ValueError, RequestQueuer,
+            host_grouping="unknown")
+
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
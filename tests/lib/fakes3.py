@@ -0,0 +1,42 @@
+from twisted.internet.defer import succeed, fail
+
+class FakeS3(object):
+
+    """
+    In memory stand in for the parts of AmazonS3 used by PageGetter,
+    recording the methods called.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def headObject(self, bucket, key):
+        self.calls.append("headObject")
+        if key not in self.objects:
+            return fail(Exception("Not found."))
+        return succeed({
+            "headers":dict([(x, [y]) for x, y in self.objects[key][1].items()]),
+            "response":"",
+            "status":"200"})
+
+    def getObject(self, bucket, key):
+        self.calls.append("getObject")
+        if key not in self.objects:
+            return fail(Exception("Not found."))
+        return succeed({
+            "headers":dict([(x, [y]) for x, y in self.objects[key][1].items()]),
+            "response":self.objects[key][0],
+            "status":"200"})
+
+    def putObject(self, bucket, key, data, content_type="text/html",
+            headers=None, priority=None, **kwargs):
+        self.calls.append("putObject")
+        headers = dict(headers)
+        headers["content-type"] = content_type
+        self.objects[key] = (data, headers)
+        return succeed(True)
+
+    def emptyBucket(self, bucket):
+        self.objects.clear()
+        return succeed(True)
@@ -0,0 +1,25 @@
+from twisted.web import http, proxy
+from twisted.internet import reactor
+
+class CountingProxyRequest(proxy.ProxyRequest):
+    
+    def process(self):
+        self.channel.factory.requests.append(self.uri)
+        proxy.ProxyRequest.process(self)
+
+class CountingProxy(proxy.Proxy):
+    
+    requestFactory = CountingProxyRequest
+
+class MiniProxyServer:
+    def __init__(self, port=8081):
+        self.factory = http.HTTPFactory()
+        self.factory.protocol = CountingProxy
+        self.factory.requests = []
+        self.port = reactor.listenTCP(port, self.factory)
+    
+    def getRequests(self):
+        return self.factory.requests
+        
+    def shutdown(self):
+        return self.port.stopListening()
@@ -1,5 +1,6 @@
 from twisted.web.resource import Resource
 from twisted.web import server
+from twisted.web.server import NOT_DONE_YET
 from twisted.internet import reactor
 import uuid
 
@@ -9,6 +10,11 @@ class MiniWebServer:
         self.resource.putChild('helloworld', TrueResource())
         self.resource.putChild('expires', ExpiresResource())
         self.resource.putChild('random', RandomResource())
+        self.resource.putChild('large', LargeResource())
+        self.resource.putChild('slow', SlowResource())
+        self.resource.putChild('stall', StallResource())
+        self.resource.putChild('alternate', AlternateResource())
+        self.resource.putChild('robots.txt', RobotsResource())
         self.site = server.Site(self.resource)
         self.port = reactor.listenTCP(8080, self.site)
         
@@ -23,6 +29,67 @@ class RandomResource:
         request.setHeader('Content-type', 'text/javascript; charset=UTF-8')
         return uuid.uuid4().hex
 
+class LargeResource:
+    
+    isLeaf = True
+    
+    def render(self, request):
+        request.setHeader('Content-type', 'text/plain')
+        return "x" * 300000
+
+class SlowResource:
+    
+    isLeaf = True
+    
+    def render(self, request):
+        request.setHeader('Content-type', 'text/plain')
+        request.write("x")
+        call = reactor.callLater(0.1, self._write, request)
+        request.notifyFinish().addErrback(self._cancel, call)
+        return NOT_DONE_YET
+    
+    def _write(self, request):
+        request.write("x")
+        call = reactor.callLater(0.1, self._write, request)
+        request.notifyFinish().addErrback(self._cancel, call)
+        
+    def _cancel(self, error, call):
+        if call.active():
+            call.cancel()
+
+class StallResource:
+    
+    isLeaf = True
+    
+    def render(self, request):
+        return NOT_DONE_YET
+
+class AlternateResource:
+    
+    isLeaf = True
+    
+    def __init__(self):
+        self.count = 0
+    
+    def render(self, request):
+        self.count += 1
+        if self.count % 2 == 1:
+            return NOT_DONE_YET
+        request.setHeader('Content-type', 'text/plain')
+        return "Hello World!"
+
+class RobotsResource:
+    
+    isLeaf = True
+    
+    def render(self, request):
+        request.setHeader('Content-type', 'text/plain')
+        return "\n".join([
+            "User-agent: *",
+            "Disallow: /private",
+            "Allow: /private/public",
+            "Crawl-delay: 0.5"])
+
 class ExpiresResource(object):
     
     isLeaf = True
@@ -0,0 +1,189 @@
+from twisted.trial import unittest
+from twisted.internet.defer import DeferredList
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+from fakes3 import FakeS3
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.localcache import LocalCache, TEMPORARY_FILE_PREFIX
+from awspider.pagegetter import PageGetter
+
+class LocalCacheTestCase(unittest.TestCase):
+
+    def testMemoryEviction(self):
+        cache = LocalCache(max_memory_size=100)
+        cache.put("a", {}, "x" * 40)
+        cache.put("b", {}, "x" * 40)
+        cache.get("a")
+        cache.put("c", {}, "x" * 40)
+        # The least recently used entry is evicted.
+        self.failUnlessEqual(cache.memory.keys(), ["a", "c"])
+        cache.put("d", {}, "x" * 101)
+        self.failIf("d" in cache.memory)
+        self.failUnlessEqual(cache.getStats()["memory_size"], 80)
+        d = cache.get("b")
+        d.addCallback(self.failUnlessEqual, None)
+        return d
+
+    def testHeadersAreCopied(self):
+        cache = LocalCache()
+        headers = {"content-sha1":["abc"]}
+        cache.put("a", headers, "body")
+        headers["content-sha1"].append("def")
+        d = cache.getHeaders("a")
+        d.addCallback(self._testHeadersAreCopiedCallback, cache)
+        return d
+
+    def _testHeadersAreCopiedCallback(self, headers, cache):
+        self.failUnlessEqual(headers, {"content-sha1":["abc"]})
+        headers["content-sha1"].append("def")
+        self.failUnlessEqual(cache.memory["a"][0], {"content-sha1":["abc"]})
+
+    def testDisk(self):
+        self.directory = self.mktemp()
+        cache = LocalCache(max_memory_size=0, directory=self.directory)
+        d = cache.waitForLoad()
+        d.addCallback(self._testDiskCallback, cache)
+        return d
+
+    def _testDiskCallback(self, data, cache):
+        d = cache.put("0123", {"content-type":["text/plain"]}, "body")
+        d.addCallback(self._testDiskCallback2, cache)
+        return d
+
+    def _testDiskCallback2(self, data, cache):
+        self.failUnlessEqual(cache.getStats()["memory_entries"], 0)
+        # Entries are loaded by a new cache in the same directory.
+        cache = LocalCache(directory=self.directory)
+        d = cache.waitForLoad()
+        d.addCallback(self._testDiskCallback3, cache)
+        return d
+
+    def _testDiskCallback3(self, data, cache):
+        d = cache.getHeaders("0123")
+        d.addCallback(self.failUnlessEqual, {"content-type":["text/plain"]})
+        d.addCallback(self._testDiskCallback4, cache)
+        return d
+
+    def _testDiskCallback4(self, data, cache):
+        d = cache.get("0123")
+        d.addCallback(self.failUnlessEqual, 
+            ({"content-type":["text/plain"]}, "body"))
+        d.addCallback(self._testDiskCallback5, cache)
+        return d
+
+    def _testDiskCallback5(self, data, cache):
+        cache.delete("0123")
+        self.failUnlessEqual(cache.getStats()["disk_size"], 0)
+        d = cache.get("0123")
+        d.addCallback(self.failUnlessEqual, None)
+        return d
+
+    def testDiskEviction(self):
+        self.directory = self.mktemp()
+        cache = LocalCache(
+            max_memory_size=0,
+            directory=self.directory,
+            max_disk_size=1000)
+        d = cache.waitForLoad()
+        for key in ["a1", "b1", "c1"]:
+            d.addCallback(self._testDiskEvictionCallback, cache, key)
+        d.addCallback(self._testDiskEvictionCallback2, cache)
+        return d
+
+    def _testDiskEvictionCallback(self, data, cache, key):
+        return cache.put(key, {}, "x" * 400)
+
+    def _testDiskEvictionCallback2(self, data, cache):
+        self.failUnlessEqual(cache.disk.keys(), ["b1", "c1"])
+        self.failUnless(cache.getStats()["disk_size"] <= 1000)
+        d = cache.get("b1")
+        d.addCallback(self.failUnlessEqual, ({}, "x" * 400))
+        return d
+
+    def testConcurrentPuts(self):
+        self.directory = self.mktemp()
+        cache = LocalCache(max_memory_size=0, directory=self.directory)
+        d = cache.waitForLoad()
+        d.addCallback(self._testConcurrentPutsCallback, cache)
+        return d
+
+    def _testConcurrentPutsCallback(self, data, cache):
+        self.bodies = ["a" * 1024 * 1024, "b" * 512 * 1024]
+        deferreds = []
+        for i in range(0, 10):
+            for body in self.bodies:
+                deferreds.append(cache.put("0123", {}, body))
+        d = DeferredList(deferreds)
+        d.addCallback(self._testConcurrentPutsCallback2)
+        return d
+
+    def _testConcurrentPutsCallback2(self, data):
+        directory = os.path.join(self.directory, "01")
+        self.failUnlessEqual(os.listdir(directory), ["0123"])
+        # A leftover temporary file is removed when the cache loads.
+        open(os.path.join(directory, TEMPORARY_FILE_PREFIX + "abc"), 
+            "wb").close()
+        cache = LocalCache(max_memory_size=0, directory=self.directory)
+        d = cache.waitForLoad()
+        d.addCallback(self._testConcurrentPutsCallback3, cache)
+        return d
+
+    def _testConcurrentPutsCallback3(self, data, cache):
+        self.failUnlessEqual(
+            os.listdir(os.path.join(self.directory, "01")), 
+            ["0123"])
+        d = cache.get("0123")
+        d.addCallback(self._testConcurrentPutsCallback4)
+        return d
+
+    def _testConcurrentPutsCallback4(self, entry):
+        # One of the bodies, intact.
+        self.failUnless(entry[1] in self.bodies)
+
+    def testPageGetter(self):
+        self.mini_web_server = MiniWebServer()
+        self.s3 = FakeS3()
+        self.pg = PageGetter(self.s3, "bucket", local_cache=LocalCache())
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/helloworld",
+            cache=1,
+            confirm_cache_write=True)
+        d.addCallback(self._testPageGetterCallback)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def _testPageGetterCallback(self, data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], False)
+        self.failUnlessEqual(self.s3.calls, ["getObject", "putObject"])
+        self.s3.calls = []
+        d = self.pg.getPage("http://127.0.0.1:8080/helloworld", cache=1)
+        d.addCallback(self._testPageGetterCallback2, data)
+        return d
+
+    def _testPageGetterCallback2(self, data, fresh_data):
+        self.failUnlessEqual(data["pagegetter-cache-hit"], True)
+        self.failUnlessEqual(data["response"], fresh_data["response"])
+        self.failUnlessEqual(data["content-sha1"], fresh_data["content-sha1"])
+        # Served without S3.
+        self.failUnlessEqual(self.s3.calls, [])
+        d = self.pg.getPage("http://127.0.0.1:8080/helloworld", cache=0)
+        d.addCallback(self._testPageGetterCallback3)
+        return d
+
+    def _testPageGetterCallback3(self, data):
+        self.failIf("headObject" in self.s3.calls)
+
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
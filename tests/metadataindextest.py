@@ -0,0 +1,112 @@
+from twisted.trial import unittest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+from fakes3 import FakeS3
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.metadataindex import MetadataIndex
+from awspider.pagegetter import PageGetter
+
+class MetadataIndexTestCase(unittest.TestCase):
+
+    def testMetadataIndex(self):
+        index = MetadataIndex()
+        self.failUnlessEqual(index.get("a"), None)
+        index.put("a", {"cache-etag":["123"]})
+        index.put("a", {"cache-etag":["456"]})
+        # Pending writes are read back before they are committed.
+        self.failUnlessEqual(index.get("a"), {"cache-etag":["456"]})
+        d = index.flush()
+        d.addCallback(self._testMetadataIndexCallback, index)
+        return d
+
+    def _testMetadataIndexCallback(self, data, index):
+        self.failUnlessEqual(index.get("a"), {"cache-etag":["456"]})
+        self.failUnlessEqual(len(index), 1)
+        index.delete("a")
+        self.failUnlessEqual(index.get("a"), None)
+        d = index.flush()
+        d.addCallback(self._testMetadataIndexCallback2, index)
+        return d
+
+    def _testMetadataIndexCallback2(self, data, index):
+        self.failUnlessEqual(index.get("a"), None)
+        self.failUnlessEqual(len(index), 0)
+
+    def testPersistence(self):
+        self.filename = self.mktemp()
+        index = MetadataIndex(self.filename)
+        index.put("a", {"cache-etag":["123"]})
+        d = index.flush()
+        d.addCallback(self._testPersistenceCallback)
+        return d
+
+    def _testPersistenceCallback(self, data):
+        index = MetadataIndex(self.filename)
+        self.failUnlessEqual(index.get("a"), {"cache-etag":["123"]})
+        index.clear()
+        self.failUnlessEqual(index.get("a"), None)
+        d = index.flush()
+        d.addCallback(self._testPersistenceCallback2)
+        return d
+
+    def _testPersistenceCallback2(self, data):
+        self.failUnlessEqual(len(MetadataIndex(self.filename)), 0)
+
+    def testPruning(self):
+        index = MetadataIndex(max_entries=10)
+        index.prune_chunk_size = 2
+        for i in range(20):
+            index.put(str(i), {})
+        d = index.flush()
+        d.addCallback(self._testPruningCallback, index)
+        return d
+
+    def _testPruningCallback(self, data, index):
+        self.failUnless(len(index) <= 10)
+        # Least recently written entries go first.
+        self.failUnlessEqual(index.get("0"), None)
+        self.failUnlessEqual(index.get("19"), {})
+
+    def testPageGetter(self):
+        self.mini_web_server = MiniWebServer()
+        self.s3 = FakeS3()
+        self.pg = PageGetter(
+            self.s3,
+            "bucket",
+            metadata_index=MetadataIndex())
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/helloworld",
+            cache=0,
+            confirm_cache_write=True)
+        d.addCallback(self._testPageGetterCallback)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def _testPageGetterCallback(self, data):
+        self.failUnlessEqual(self.s3.calls, ["headObject", "putObject"])
+        self.s3.calls = []
+        d = self.pg.getPage(
+            "http://127.0.0.1:8080/helloworld",
+            cache=0,
+            confirm_cache_write=True)
+        d.addCallback(self._testPageGetterCallback2)
+        return d
+
+    def _testPageGetterCallback2(self, data):
+        # Revalidated from the index without a HEAD request.
+        self.failIf("headObject" in self.s3.calls)
+
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
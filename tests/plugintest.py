@@ -0,0 +1,53 @@
+from twisted.trial import unittest
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+from awspider.plugin import AWSpiderPlugin
+from awspider.servers.base import BaseServer
+
+class FakePageGetter(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def getPage(self, url, **kwargs):
+        self.requests.append((url, kwargs.get("tenant")))
+        return succeed(None)
+
+class TenantPlugin(AWSpiderPlugin):
+
+    def fetch(self):
+        self.getPage("http://example.com/a")
+        d = Deferred()
+        reactor.callLater(0, d.callback, None)
+        d.addCallback(self._fetchCallback)
+        return d
+
+    def _fetchCallback(self, data):
+        return self.getPage("http://example.com/b")
+
+class PluginTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # The tenant tagging does not need a configured server.
+        self.server = BaseServer.__new__(BaseServer)
+        self.server.pg = FakePageGetter()
+        self.plugin = TenantPlugin(self.server)
+
+    def testTenant(self):
+        d = self.server._callFunction(self.plugin.fetch, {}, 
+            "tenantplugin/fetch")
+        d.addCallback(self._testTenantCallback)
+        return d
+
+    def _testTenantCallback(self, data):
+        # Pages requested from callbacks are tagged with the plugin's name.
+        self.failUnlessEqual(self.server.pg.requests, [
+            ("http://example.com/a", "tenantplugin/fetch"),
+            ("http://example.com/b", "tenantplugin")])
+        self.failUnlessEqual(self.server.current_tenant, None)
+
+    def testExplicitTenant(self):
+        self.plugin.getPage("http://example.com/a", tenant="other")
+        self.failUnlessEqual(self.server.pg.requests, 
+            [("http://example.com/a", "other")])
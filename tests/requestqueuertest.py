@@ -1,13 +1,25 @@
 from twisted.trial import unittest
-from twisted.internet.defer import Deferred
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, CancelledError, \
+    TimeoutError
+from twisted.internet.error import ConnectionRefusedError
+from twisted.python.failure import Failure
+from twisted.web.error import Error
 
-from awspider.requestqueuer import RequestQueuer
+from awspider.requestqueuer import RequestQueuer, HostQueue, \
+    QueuedRequest, PRIORITY_PEER, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, \
+    CIRCUIT_OPEN, _getRetryAfter
+from awspider.exceptions import CircuitOpenException
+from awspider.proxypool import ProxyPool
 
 import os
 import sys
+import time
+from collections import deque
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
 from miniwebserver import MiniWebServer
+from miniproxyserver import MiniProxyServer
 
 import twisted
 twisted.internet.base.DelayedCall.debug = True
@@ -38,6 +50,29 @@ class RequestQueuerTestCase(unittest.TestCase):
         self.failUnlessEqual(
             self.rq.getHostMaxRequestsPerSecond("example2.com"), 7)
             
+    def testHostMaxRequestsBurst(self):
+        self.failUnlessEqual(
+            self.rq.getHostMaxRequestsBurst("example.com"), 1)
+        self.rq.setHostMaxRequestsBurst("example2.com", 4)
+        self.failUnlessEqual(
+            self.rq.getHostMaxRequestsBurst("example2.com"), 4)
+
+    def testBurstRequests(self):
+        self.rq.setHostMaxRequestsPerSecond("127.0.0.1", 1)
+        self.rq.setHostMaxRequestsBurst("127.0.0.1", 3)
+        start = time.time()
+        deferreds = []
+        for i in range(3):
+            deferreds.append(self.rq.getPage(
+                "http://127.0.0.1:8080/helloworld", 
+                timeout=5))
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testBurstRequestsCallback, start)
+        return d
+
+    def _testBurstRequestsCallback(self, data, start):
+        self.failUnless(time.time() - start < 1)
+
     def testHostMaxSimultaneousRequests(self,):
         self.failUnlessEqual(
             self.rq.getHostMaxSimultaneousRequests("example.com"), 5)
@@ -46,6 +81,684 @@ class RequestQueuerTestCase(unittest.TestCase):
             self.rq.getHostMaxSimultaneousRequests("example2.com"),
             11)
             
+    def testIndependentQueuers(self):
+        rq = RequestQueuer(max_simultaneous_requests=1)
+        rq.setHostMaxRequestsPerSecond("example3.com", 9)
+        self.failUnlessEqual(
+            self.rq.getHostMaxRequestsPerSecond("example3.com"), 3)
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        self.failUnlessEqual(rq.getActive(), 1)
+        self.failUnlessEqual(self.rq.getActive(), 0)
+        self.failUnlessEqual(self.rq.getActiveRequestsByHost(), {})
+        return d
+
+    def testPriority(self):
+        rq = RequestQueuer(max_simultaneous_requests=1,
+            max_requests_per_host_per_second=0)
+        order = []
+        deferreds = []
+        for priority in [PRIORITY_BACKGROUND, PRIORITY_BACKGROUND, 
+                PRIORITY_INTERACTIVE, PRIORITY_PEER]:
+            d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5,
+                priority=priority)
+            d.addCallback(self._testPriorityCallback, order, priority)
+            deferreds.append(d)
+        self.failUnlessEqual(rq.getPendingRequestsByHost(), {"127.0.0.1":3})
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testPriorityCallback2, order)
+        return d
+
+    def _testPriorityCallback(self, data, order, priority):
+        order.append(priority)
+
+    def _testPriorityCallback2(self, data, order):
+        self.failUnlessEqual(order, [
+            PRIORITY_BACKGROUND, 
+            PRIORITY_PEER, 
+            PRIORITY_INTERACTIVE, 
+            PRIORITY_BACKGROUND])
+
+    def testWeightedFairQueuing(self):
+        rq = RequestQueuer(max_simultaneous_requests=1,
+            max_requests_per_host_per_second=0)
+        rq.setTenantWeight("b", 2)
+        self.failUnlessEqual(rq.getTenantWeight("a"), 1)
+        self.failUnlessEqual(rq.getTenantWeight("b"), 2)
+        self.failUnlessRaises(ValueError, rq.setTenantWeight, "c", 0)
+        order = []
+        deferreds = []
+        for tenant in ["a"] * 6 + ["b"] * 6:
+            d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5,
+                tenant=tenant)
+            d.addCallback(self._testPriorityCallback, order, tenant)
+            deferreds.append(d)
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testWeightedFairQueuingCallback, order)
+        return d
+
+    def _testWeightedFairQueuingCallback(self, data, order):
+        # The first request is sent before the others are queued, then 
+        # tenant b gets two requests for each of tenant a's.
+        self.failUnlessEqual("".join(order), "abbbabbabaaa")
+
+    def testHostQueue(self):
+        queue = HostQueue(2)
+        reqs = []
+        for tenant, finish, priority in [("a", 1, 1), ("a", 2, 1), 
+                ("b", 1.5, 1), ("b", 2, 1), ("a", 3, 0)]:
+            req = QueuedRequest("http://127.0.0.1:8080/helloworld", "GET",
+                None, {}, "RequestQueuer", 5, None, True, None, 0, None, 
+                "127.0.0.1", False, tenant, None, None, priority)
+            req.virtual_finish = finish
+            queue.append(req, priority)
+            reqs.append(req)
+        self.failUnlessEqual(len(queue), 5)
+        self.failUnlessEqual(queue.peek(), (0, 3))
+        # Cancelled requests are dropped when they reach the front.
+        reqs[2].cancelled = True
+        queue.discard()
+        order = []
+        while len(queue) > 0:
+            order.append(reqs.index(queue.popleft()))
+        # Equal tags go in the order they were added.
+        self.failUnlessEqual(order, [4, 0, 1, 3])
+        self.failUnlessRaises(IndexError, queue.popleft)
+
+    def testAdaptiveConcurrency(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            max_simultaneous_requests_per_host=5,
+            adaptive_concurrency=True)
+        self.failUnlessEqual(rq.getHostConcurrencyLimit("127.0.0.1"), 1)
+        deferreds = []
+        for i in range(0, 10):
+            deferreds.append(rq.getPage("http://127.0.0.1:8080/helloworld", 
+                timeout=5))
+        self.failUnlessEqual(rq.getActiveRequestsByHost(), {"127.0.0.1":1})
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testAdaptiveConcurrencyCallback, rq)
+        return d
+
+    def _testAdaptiveConcurrencyCallback(self, data, rq):
+        self.failUnless(rq.getHostConcurrencyLimit("127.0.0.1") > 1)
+        self.failUnless(rq.getHostConcurrencyLimit("127.0.0.1") <= 5)
+        rq.concurrency_limits["127.0.0.1"] = 4.0
+        error = Failure(Error("503", "Service Unavailable", ""))
+        rq._adaptConcurrency("127.0.0.1", {}, error=error)
+        self.failUnlessEqual(rq.getHostConcurrencyLimit("127.0.0.1"), 2)
+        rq.setHostAdaptiveConcurrency("127.0.0.1", False)
+        self.failUnlessEqual(rq.getHostConcurrencyLimit("127.0.0.1"), 5)
+
+    def testCoalescedRequests(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            coalesce_requests=True)
+        deferreds = []
+        for i in range(0, 3):
+            deferreds.append(rq.getPage("http://127.0.0.1:8080/random", 
+                timeout=5))
+        deferreds.append(rq.getPage("http://127.0.0.1:8080/random", 
+            headers={"X-Test":"1"}, timeout=5))
+        self.failUnlessEqual(rq.getActiveRequestsByHost(), {"127.0.0.1":2})
+        self.failUnlessEqual(rq.getPending(), 0)
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testCoalescedRequestsCallback, rq)
+        return d
+
+    def _testCoalescedRequestsCallback(self, data, rq):
+        responses = [x[1] for x in data]
+        self.failUnlessEqual(responses[0], responses[1])
+        self.failUnlessEqual(responses[0], responses[2])
+        self.failIf(responses[0] is responses[1])
+        self.failIfEqual(responses[0]["response"], responses[3]["response"])
+        self.failUnlessEqual(rq.coalesced_reqs, {})
+
+    def testCoalescedPriority(self):
+        rq = RequestQueuer(max_simultaneous_requests=1,
+            max_requests_per_host_per_second=0, coalesce_requests=True)
+        order = []
+        deferreds = []
+        for url, priority in [
+                ("http://127.0.0.1:8080/helloworld?a", PRIORITY_BACKGROUND),
+                ("http://127.0.0.1:8080/helloworld?b", PRIORITY_BACKGROUND),
+                ("http://127.0.0.1:8080/helloworld?c", PRIORITY_BACKGROUND),
+                ("http://127.0.0.1:8080/helloworld?c", PRIORITY_INTERACTIVE)]:
+            d = rq.getPage(url, timeout=5, priority=priority)
+            d.addCallback(self._testPriorityCallback, order, url)
+            deferreds.append(d)
+        # The interactive caller moved the shared request ahead of ?b.
+        req = self._getCoalescingRequest(rq, 
+            "http://127.0.0.1:8080/helloworld?c")
+        self.failUnlessEqual(req.priority, PRIORITY_INTERACTIVE)
+        self.failUnlessEqual(rq.getPending(), 2)
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testCoalescedPriorityCallback, order)
+        return d
+
+    def _testCoalescedPriorityCallback(self, data, order):
+        self.failUnlessEqual(order, [
+            "http://127.0.0.1:8080/helloworld?a", 
+            "http://127.0.0.1:8080/helloworld?c", 
+            "http://127.0.0.1:8080/helloworld?c", 
+            "http://127.0.0.1:8080/helloworld?b"])
+
+    def testCoalescedLowerPriority(self):
+        rq = RequestQueuer(max_simultaneous_requests=1,
+            max_requests_per_host_per_second=0, coalesce_requests=True)
+        deferreds = [rq.getPage("http://127.0.0.1:8080/helloworld?a", 
+            timeout=5)]
+        for priority in [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]:
+            deferreds.append(rq.getPage("http://127.0.0.1:8080/helloworld?b",
+                timeout=5, priority=priority, max_retries=priority))
+        # A background caller shares the interactive request without 
+        # lowering its priority, and raises its retries.
+        req = self._getCoalescingRequest(rq, 
+            "http://127.0.0.1:8080/helloworld?b")
+        self.failUnlessEqual(req.priority, PRIORITY_INTERACTIVE)
+        self.failUnlessEqual(req.max_retries, PRIORITY_BACKGROUND)
+        self.failUnlessEqual(rq.getPending(), 1)
+        return DeferredList(deferreds, fireOnOneErrback=True, 
+            consumeErrors=True)
+
+    def _getCoalescingRequest(self, rq, url):
+        return [x for x in rq.coalescing_reqs.values() if x.url == url][0]
+
+    def testRetries(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0, 
+            retry_backoff=0.01)
+        self.attempts = 0
+        self.get_page = rq._getPage
+        rq._getPage = self._countAttempts
+        d = rq.getPage("http://127.0.0.1:8081/helloworld", timeout=5, 
+            max_retries=2)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testRetriesErrback, rq, 3)
+        return d
+
+    def testNonIdempotentRequestsNotRetried(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0, 
+            retry_backoff=0.01)
+        self.attempts = 0
+        self.get_page = rq._getPage
+        rq._getPage = self._countAttempts
+        d = rq.getPage("http://127.0.0.1:8081/helloworld", method="POST",
+            postdata={"a":"b"}, timeout=5, max_retries=2)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testRetriesErrback, rq, 1)
+        return d
+
+    def _countAttempts(self, req):
+        self.attempts += 1
+        return self.get_page(req)
+
+    def _testRetriesErrback(self, error, rq, attempts):
+        self.failUnlessEqual(self.attempts, attempts)
+        self.failUnlessEqual(rq.getPending(), 0)
+        self.failUnlessEqual(rq.getActive(), 0)
+
+    def testRetryAfter(self):
+        error = Error("503", "Service Unavailable", "")
+        error.headers = {"retry-after":["120"]}
+        self.failUnlessEqual(_getRetryAfter(Failure(error)), 120)
+        error.headers = {}
+        self.failUnlessEqual(_getRetryAfter(Failure(error)), None)
+
+    def testCircuitBreaker(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            max_simultaneous_requests_per_host=1,
+            circuit_breaker_threshold=2,
+            circuit_breaker_timeout=0.2)
+        deferreds = []
+        for i in range(0, 4):
+            d = rq.getPage("http://127.0.0.1:8081/helloworld", timeout=5)
+            d.addCallback(self._unexpectedCallback)
+            d.addErrback(self._testCircuitBreakerErrback)
+            deferreds.append(d)
+        d = DeferredList(deferreds)
+        d.addCallback(self._testCircuitBreakerCallback, rq)
+        return d
+
+    def _testCircuitBreakerErrback(self, error):
+        return error.check(CircuitOpenException) is not None
+
+    def _testCircuitBreakerCallback(self, data, rq):
+        self.failUnlessEqual([x[1] for x in data], 
+            [False, False, True, True])
+        self.failUnlessEqual(rq.getCircuitBreakerStatesByHost(), 
+            {"127.0.0.1":"open"})
+        self.failUnlessEqual(rq.getPending(), 0)
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testCircuitBreakerErrback)
+        d.addCallback(self.failUnlessEqual, True)
+        d.addCallback(self._sleep, 0.3)
+        d.addCallback(self._testCircuitBreakerCallback2, rq)
+        return d
+
+    def _testCircuitBreakerCallback2(self, data, rq):
+        self.failUnlessEqual(rq.getCircuitBreakerStatesByHost(), 
+            {"127.0.0.1":"half-open"})
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        d.addCallback(self._testCircuitBreakerCallback3, rq)
+        return d
+
+    def _testCircuitBreakerCallback3(self, data, rq):
+        self.failUnlessEqual(rq.getCircuitBreakerStatesByHost(), 
+            {"127.0.0.1":"closed"})
+
+    def _sleep(self, data, seconds):
+        d = Deferred()
+        reactor.callLater(seconds, d.callback, data)
+        return d
+
+    def testBandwidthThrottle(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            max_bytes_per_second=200000)
+        start = time.time()
+        d = rq.getPage("http://127.0.0.1:8080/large", timeout=5)
+        d.addCallback(self._testBandwidthThrottleCallback, start)
+        # Let the throttle resume the transport after the last read.
+        d.addCallback(self._sleep, 0.5)
+        return d
+
+    def testHostBandwidthThrottle(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            persistent_connections=True)
+        rq.setHostMaxBytesPerSecond("127.0.0.1", 200000)
+        self.failUnlessEqual(rq.getHostMaxBytesPerSecond("127.0.0.1"), 
+            200000)
+        start = time.time()
+        d = rq.getPage("http://127.0.0.1:8080/large", timeout=5)
+        d.addCallback(self._testBandwidthThrottleCallback, start)
+        d.addCallback(self._sleep, 0.5)
+        d.addBoth(self._closeConnections, rq)
+        return d
+
+    def _testBandwidthThrottleCallback(self, data, start):
+        self.failUnlessEqual(len(data["response"]), 300000)
+        self.failUnless(time.time() - start > 0.3)
+
+    def testBandwidthThrottlePersistent(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            max_bytes_per_second=200000, persistent_connections=True)
+        start = time.time()
+        d = rq.getPage("http://127.0.0.1:8080/large", timeout=5)
+        d.addCallback(self._testBandwidthThrottleCallback, start)
+        d.addCallback(self._testBandwidthThrottlePersistentCallback, rq)
+        d.addBoth(self._closeConnections, rq)
+        return d
+
+    def _testBandwidthThrottlePersistentCallback(self, data, rq):
+        # The connection paused on its last read is reused right away.
+        connections = rq.persistent_client.pool._connections
+        self.failUnlessEqual(
+            len(connections[("http", "127.0.0.1", 8080)]), 1)
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=2)
+        d.addCallback(self._testBandwidthThrottlePersistentCallback2)
+        return d
+
+    def _testBandwidthThrottlePersistentCallback2(self, data):
+        self.failUnlessEqual(data["response"], "Hello World!")
+
+    def testCancelQueuedRequest(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            max_simultaneous_requests_per_host=1)
+        deferreds = []
+        for i in range(0, 3):
+            deferreds.append(rq.getPage("http://127.0.0.1:8080/helloworld", 
+                timeout=5))
+        self.failUnlessEqual(rq.getPendingRequestsByHost(), {"127.0.0.1":2})
+        deferreds[1].addCallback(self._unexpectedCallback)
+        deferreds[1].addErrback(self._testCancelErrback, CancelledError)
+        deferreds[1].cancel()
+        self.failUnlessEqual(rq.getPendingRequestsByHost(), {"127.0.0.1":1})
+        self.failUnlessEqual(rq.getPending(), 1)
+        d = DeferredList(deferreds, fireOnOneErrback=True)
+        d.addCallback(self._testCancelQueuedRequestCallback, rq)
+        return d
+
+    def _testCancelErrback(self, error, exception_type):
+        self.failUnless(error.check(exception_type))
+        return "cancelled"
+
+    def _testCancelQueuedRequestCallback(self, data, rq):
+        self.failUnlessEqual(data[1][1], "cancelled")
+        self.failUnlessEqual(data[2][1]["response"], "Hello World!")
+        self.failUnlessEqual(rq.getPending(), 0)
+        self.failUnlessEqual(rq.getActive(), 0)
+
+    def testCancelActiveRequest(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0)
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        self.failUnlessEqual(rq.getActive(), 1)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testCancelErrback, CancelledError)
+        d.cancel()
+        d.addCallback(self._sleep, 0.1)
+        d.addCallback(self._testCancelActiveRequestCallback, rq)
+        return d
+
+    def _testCancelActiveRequestCallback(self, data, rq):
+        self.failUnlessEqual(rq.getActive(), 0)
+
+    def testCancelCoalescedRequests(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            coalesce_requests=True)
+        deferreds = []
+        for i in range(0, 3):
+            d = rq.getPage("http://127.0.0.1:8080/slow", timeout=5)
+            d.addCallback(self._unexpectedCallback)
+            d.addErrback(self._testCancelErrback, CancelledError)
+            deferreds.append(d)
+        # The shared request keeps running while coalesced callers wait.
+        deferreds[0].cancel()
+        deferreds[1].cancel()
+        self.failUnlessEqual(rq.getActive(), 1)
+        deferreds[2].cancel()
+        d = DeferredList(deferreds)
+        d.addCallback(self._sleep, 0.1)
+        d.addCallback(self._testCancelCoalescedRequestsCallback, rq)
+        return d
+
+    def _testCancelCoalescedRequestsCallback(self, data, rq):
+        self.failUnlessEqual(rq.getActive(), 0)
+        self.failUnlessEqual(rq.coalesced_reqs, {})
+        self.failUnlessEqual(rq.coalescing_reqs, {})
+
+    def testDeadline(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=1)
+        deferreds = []
+        deferreds.append(rq.getPage("http://127.0.0.1:8080/helloworld", 
+            timeout=5))
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5, 
+            deadline=0.2)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testCancelErrback, TimeoutError)
+        deferreds.append(d)
+        start = time.time()
+        d = DeferredList(deferreds, fireOnOneErrback=True)
+        d.addCallback(self._testDeadlineCallback, rq, start)
+        # Let the rate limit timer for the dropped request run out.
+        d.addCallback(self._sleep, 1)
+        return d
+
+    def _testDeadlineCallback(self, data, rq, start):
+        self.failUnlessEqual(data[1][1], "cancelled")
+        self.failUnless(time.time() - start < 0.5)
+        self.failUnlessEqual(rq.getPending(), 0)
+
+    def testMinimumThroughput(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            min_bytes_per_second=100, throughput_window=0.3)
+        return self._testSlowTransfer(rq, "slow")
+
+    def testMinimumThroughputPersistent(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            min_bytes_per_second=100, throughput_window=0.3,
+            persistent_connections=True)
+        d = self._testSlowTransfer(rq, "slow")
+        d.addBoth(self._closeConnections, rq)
+        return d
+
+    def testFirstByteTimeout(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            first_byte_timeout=0.3)
+        return self._testSlowTransfer(rq, "stall")
+
+    def testFirstByteTimeoutPersistent(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            persistent_connections=True)
+        d = self._testSlowTransfer(rq, "stall", first_byte_timeout=0.3)
+        d.addBoth(self._closeConnections, rq)
+        return d
+
+    def _testSlowTransfer(self, rq, path, **kwargs):
+        start = time.time()
+        d = rq.getPage("http://127.0.0.1:8080/%s" % path, timeout=5, 
+            **kwargs)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testCancelErrback, TimeoutError)
+        d.addCallback(self._testSlowTransferCallback, rq, start)
+        return d
+
+    def _testSlowTransferCallback(self, data, rq, start):
+        self.failUnlessEqual(data, "cancelled")
+        self.failUnless(time.time() - start < 2)
+        self.failUnlessEqual(rq.getActive(), 0)
+
+    def testHedgedRequest(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0, hedge_ratio=1)
+        rq.hedge_min_samples = 1
+        rq.latency_samples["127.0.0.1"] = deque([0.1])
+        start = time.time()
+        d = rq.getPage("http://127.0.0.1:8080/alternate", timeout=5, 
+            hedge=True)
+        d.addCallback(self._testHedgedRequestCallback, rq, start)
+        d.addCallback(self._sleep, 0.1)
+        d.addCallback(self._testHedgedRequestCallback2, rq)
+        return d
+
+    def _testHedgedRequestCallback(self, data, rq, start):
+        self.failUnlessEqual(data["response"], "Hello World!")
+        self.failUnless(time.time() - start < 1)
+        self.failUnless(rq.hedge_tokens["127.0.0.1"] < 1)
+
+    def _testHedgedRequestCallback2(self, data, rq):
+        self.failUnlessEqual(rq.getActive(), 0)
+
+    def testHedgeLimits(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=1, 
+            max_requests_per_host_burst=1, 
+            max_simultaneous_requests_per_host=1)
+        req = QueuedRequest("http://127.0.0.1:8080/helloworld", "GET", None, 
+            {}, "RequestQueuer", 5, None, True, None, 0, None, "127.0.0.1", 
+            True, None, None, None, 1)
+        req.state = "active"
+        req.dispatch_time = time.time()
+        rq.hedge_tokens["127.0.0.1"] = 1
+        # No duplicate while the host has no free simultaneous requests.
+        rq.active_reqs["127.0.0.1"] = 1
+        rq._hedgeRequest(req, "127.0.0.1")
+        self.failUnlessEqual(rq.hedge_tokens["127.0.0.1"], 1)
+        # Or while its rate limit is used up.
+        rq.active_reqs["127.0.0.1"] = 0
+        rq._getRequestBucket("127.0.0.1").consume()
+        rq._hedgeRequest(req, "127.0.0.1")
+        self.failUnlessEqual(rq.hedge_tokens["127.0.0.1"], 1)
+        # Idle hosts are forgotten once too many are tracked.
+        rq.max_tracked_hosts = 1
+        rq.latency_samples["127.0.0.1"] = deque([0.1])
+        rq.pending_reqs["127.0.0.2"] = HostQueue(rq.priority_levels)
+        rq._recordLatency("127.0.0.2", req)
+        self.failUnlessEqual(rq.latency_samples.keys(), ["127.0.0.2"])
+        self.failUnlessEqual(rq.hedge_tokens, {})
+        
+    def testPruneIdleHosts(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=1)
+        # Idle, with a full bucket.
+        rq._getRequestBucket("a")
+        rq.concurrency_limits["a"] = 2.0
+        # Idle, with a bucket still refilling.
+        rq._getRequestBucket("b").consume()
+        rq.latency_averages["b"] = 0.1
+        # Active.
+        rq.active_reqs["c"] = 1
+        rq.concurrency_limits["c"] = 3.0
+        # Idle, with an open circuit.
+        rq.circuit_states["d"] = CIRCUIT_OPEN
+        rq.circuit_failures["d"] = 5
+        rq.active_reqs["d"] = 0
+        rq._pruneIdleHosts()
+        self.failUnlessEqual(rq.req_buckets.keys(), ["b"])
+        self.failUnlessEqual(rq.concurrency_limits, {"c":3.0})
+        self.failUnlessEqual(rq.latency_averages, {})
+        self.failUnlessEqual(rq.active_reqs, {"c":1})
+        self.failUnlessEqual(rq.circuit_failures, {"d":5})
+
+    def testHedgeProxyLimit(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0, 
+            hedge_ratio=1, proxies=ProxyPool(["127.0.0.1:8081"],
+                max_simultaneous_requests_per_proxy=1))
+        req = QueuedRequest("http://127.0.0.1:8080/helloworld", "GET", None, 
+            {}, "RequestQueuer", 5, None, True, None, 0, None, "127.0.0.1", 
+            True, None, None, None, 1)
+        req.state = "active"
+        rq.hedge_tokens["127.0.0.1"] = 1
+        # The original request holds the proxy's only slot.
+        proxy = rq.proxy_pool.acquire()
+        rq._hedgeRequest(req, "127.0.0.1")
+        self.failUnlessEqual(rq.hedge_tokens["127.0.0.1"], 1)
+        self.failUnlessEqual(rq.getActive(), 0)
+        rq.proxy_pool.release(proxy)
+
+    def testProxyPool(self):
+        self.mini_proxy_server = MiniProxyServer()
+        rq = RequestQueuer(proxies=["127.0.0.1:8081"])
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        d.addCallback(self._testProxyPoolCallback, rq)
+        d.addBoth(self._shutdownMiniProxyServer)
+        return d
+
+    def testProxyPoolPersistent(self):
+        self.mini_proxy_server = MiniProxyServer()
+        rq = RequestQueuer(proxies=["127.0.0.1:8081"], 
+            persistent_connections=True)
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        d.addCallback(self._testProxyPoolCallback, rq)
+        d.addBoth(self._closeConnections, rq)
+        d.addBoth(self._shutdownMiniProxyServer)
+        return d
+
+    def _testProxyPoolCallback(self, data, rq):
+        self.failUnlessEqual(data["response"], "Hello World!")
+        self.failUnlessEqual(self.mini_proxy_server.getRequests(), 
+            ["http://127.0.0.1:8080/helloworld"])
+        self.failUnlessEqual(rq.getProxyStates()["127.0.0.1:8081"]["active"],
+            0)
+
+    def _shutdownMiniProxyServer(self, data):
+        d = self.mini_proxy_server.shutdown()
+        d.addCallback(self._closeConnectionsCallback, data)
+        return d
+
+    def testProxyPoolSaturated(self):
+        self.mini_proxy_server = MiniProxyServer()
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            proxies=ProxyPool(["127.0.0.1:8081"],
+                max_simultaneous_requests_per_proxy=1))
+        deferreds = []
+        for url in ["http://127.0.0.1:8080/helloworld",
+                "http://localhost:8080/helloworld"]:
+            deferreds.append(rq.getPage(url, timeout=5))
+        d = rq.getPage("https://127.0.0.1:8084/", timeout=5)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testProxyPoolSaturatedErrback)
+        deferreds.append(d)
+        # The https request is sent directly while the second http request
+        # waits for the proxy.
+        self.failUnlessEqual(rq.getActive(), 2)
+        self.failUnlessEqual(rq.getPending(), 1)
+        d = DeferredList(deferreds, fireOnOneErrback=True, 
+            consumeErrors=True)
+        d.addCallback(self._testProxyPoolSaturatedCallback)
+        d.addBoth(self._shutdownMiniProxyServer)
+        return d
+
+    def _testProxyPoolSaturatedErrback(self, error):
+        error.trap(ConnectionRefusedError)
+
+    def _testProxyPoolSaturatedCallback(self, data):
+        self.failUnlessEqual(data[1][1]["response"], "Hello World!")
+        self.failUnlessEqual(self.mini_proxy_server.getRequests(),
+            ["http://127.0.0.1:8080/helloworld",
+             "http://localhost:8080/helloworld"])
+
+    def testProxyEjection(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            proxies=ProxyPool(["127.0.0.1:8082", "127.0.0.1:8083"], 
+                max_simultaneous_requests_per_proxy=1, 
+                failure_threshold=2))
+        deferreds = []
+        for i in range(0, 4):
+            d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+            d.addCallback(self._unexpectedCallback)
+            d.addErrback(self._testProxyEjectionErrback)
+            deferreds.append(d)
+        # One request per proxy at a time.
+        self.failUnlessEqual(rq.getActive(), 2)
+        d = DeferredList(deferreds)
+        d.addCallback(self._testProxyEjectionCallback, rq)
+        return d
+
+    def _testProxyEjectionErrback(self, error):
+        error.trap(ConnectionRefusedError)
+
+    def _testProxyEjectionCallback(self, data, rq):
+        states = rq.getProxyStates()
+        self.failUnless(states["127.0.0.1:8082"]["ejected"])
+        self.failUnless(states["127.0.0.1:8083"]["ejected"])
+
+    def testGetPages(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            max_simultaneous_requests_per_host=0)
+        self.requested = 0
+        self.results = []
+        d = rq.getPages(self._testGetPagesURLs(20), 
+            self._testGetPagesCallback, max_in_flight=3, timeout=5)
+        d.addCallback(self._testGetPagesCallback2)
+        return d
+
+    def _testGetPagesURLs(self, count):
+        for i in range(0, count):
+            self.requested += 1
+            yield "http://127.0.0.1:8080/helloworld"
+
+    def _testGetPagesCallback(self, data, url):
+        self.failUnlessEqual(data["response"], "Hello World!")
+        self.results.append(url)
+        self.failUnless(self.requested - len(self.results) < 3)
+
+    def _testGetPagesCallback2(self, count):
+        self.failUnlessEqual(count, 20)
+        self.failUnlessEqual(len(self.results), 20)
+
+    def testGetPagesFailure(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0)
+        urls = ["http://127.0.0.1:8080/helloworld", 
+            "http://127.0.0.1:8080/error"] + \
+            ["http://127.0.0.1:8080/helloworld"] * 10
+        self.results = []
+        d = rq.getPages(urls, self._testGetPagesFailureCallback, 
+            max_in_flight=1, timeout=5)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testGetPagesFailureErrback)
+        return d
+
+    def _testGetPagesFailureCallback(self, data, url):
+        self.results.append(url)
+
+    def _testGetPagesFailureErrback(self, error):
+        error.trap(Error)
+        self.failUnlessEqual(len(self.results), 1)
+
+    def testGetPagesURLsFailure(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0)
+        self.results = []
+        d = rq.getPages(self._testGetPagesURLsFailureURLs(), 
+            self._testGetPagesFailureCallback, max_in_flight=3, timeout=5)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testGetPagesURLsFailureErrback, rq)
+        return d
+
+    def _testGetPagesURLsFailureURLs(self):
+        for i in range(0, 5):
+            yield "http://127.0.0.1:8080/helloworld"
+        raise ValueError("Bad URL list.")
+
+    def _testGetPagesURLsFailureErrback(self, error, rq):
+        error.trap(ValueError)
+        # Requests already made were handled first.
+        self.failUnlessEqual(len(self.results), 5)
+        self.failUnlessEqual(rq.getActive(), 0)
+
     def testActive(self):
         self.failUnlessEqual(isinstance(self.rq.getActive(), int), True)
             
@@ -58,6 +771,73 @@ class RequestQueuerTestCase(unittest.TestCase):
     def testPendingRequestsByHost(self):
         self.failUnlessEqual(isinstance(self.rq.getPendingRequestsByHost(), dict), True)
 
+    def testRateLimitedRequests(self):
+        self.rq.setHostMaxRequestsPerSecond("127.0.0.1", 10)
+        start = time.time()
+        deferreds = []
+        for i in range(3):
+            deferreds.append(self.rq.getPage(
+                "http://127.0.0.1:8080/helloworld", 
+                timeout=5))
+        self.failUnlessEqual(self.rq.getPending() + self.rq.getActive(), 3)
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self._testRateLimitedRequestsCallback, start)
+        return d
+
+    def _testRateLimitedRequestsCallback(self, data, start):
+        self.failUnless(time.time() - start >= 0.2)
+        self.failUnlessEqual(self.rq.getPending(), 0)
+        self.failUnlessEqual(self.rq.getActive(), 0)
+
+    def testPersistentConnections(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            persistent_connections=True)
+        d = rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+        d.addCallback(self._testPersistentConnectionsCallback, rq)
+        d.addCallback(self._testPersistentConnectionsCallback2, rq)
+        d.addBoth(self._closeConnections, rq)
+        return d
+
+    def _testPersistentConnectionsCallback(self, data, rq):
+        self.failUnlessEqual(data["status"], 200)
+        self.failUnlessEqual(data["response"], "Hello World!")
+        self.failUnless("content-type" in data["headers"])
+        connections = rq.persistent_client.pool._connections
+        self.failUnlessEqual(
+            len(connections[("http", "127.0.0.1", 8080)]), 1)
+        self.connection = connections[("http", "127.0.0.1", 8080)][0]
+        return rq.getPage("http://127.0.0.1:8080/helloworld", timeout=5)
+
+    def _testPersistentConnectionsCallback2(self, data, rq):
+        connections = rq.persistent_client.pool._connections
+        self.failUnlessEqual(
+            connections[("http", "127.0.0.1", 8080)], 
+            [self.connection])
+
+    def testPersistentConnectionsOnFailure(self):
+        rq = RequestQueuer(max_requests_per_host_per_second=0,
+            persistent_connections=True)
+        d = rq.getPage("http://127.0.0.1:8080/doesnotexist", timeout=5)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testPersistentConnectionsOnFailureErrback)
+        d.addBoth(self._closeConnections, rq)
+        return d
+
+    def _testPersistentConnectionsOnFailureErrback(self, error):
+        self.failUnlessEqual(error.value.status, "404")
+        self.failUnless("content-type" in error.value.headers)
+
+    def _closeConnections(self, data, rq):
+        d = rq.closeConnections()
+        d.addCallback(self._closeConnectionsCallback, data)
+        return d
+
+    def _closeConnectionsCallback(self, ignored, data):
+        return data
+
+    def _unexpectedCallback(self, data):
+        self.fail("Expected an errback.")
+
     def _getPageErrback(self, error):
         return True
         
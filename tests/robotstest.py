@@ -0,0 +1,153 @@
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, CancelledError
+from twisted.internet.error import ConnectionRefusedError
+from twisted.python.failure import Failure
+from twisted.web.error import Error
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from miniwebserver import MiniWebServer
+
+import twisted
+twisted.internet.base.DelayedCall.debug = True
+
+from awspider.exceptions import RobotsDisallowedException
+from awspider.requestqueuer import RequestQueuer
+from awspider.robots import RobotsCache, parseRobots, isAllowed
+
+ROBOTS = """
+# Comment
+User-agent: awspider
+User-agent: otherbot
+Disallow: /search
+Allow: /search/about
+Disallow: /*.pdf$
+Crawl-delay: 2
+
+User-agent: *
+Disallow: /
+"""
+
+class FakeRequestQueuer(RequestQueuer):
+
+    """
+    RequestQueuer whose requests are answered by the test.
+    """
+
+    def __init__(self):
+        RequestQueuer.__init__(self, max_requests_per_host_per_second=0)
+        self.requests = []
+
+    def getPage(self, url, *args, **kwargs):
+        d = Deferred()
+        self.requests.append((url, d))
+        return d
+
+class RobotsTestCase(unittest.TestCase):
+
+    def testParseRobots(self):
+        rules, crawl_delay = parseRobots(ROBOTS, "AWSpider/0.3")
+        self.failUnlessEqual(crawl_delay, 2)
+        self.failUnless(isAllowed(rules, "/"))
+        self.failIf(isAllowed(rules, "/search?q=awspider"))
+        self.failUnless(isAllowed(rules, "/search/about"))
+        self.failIf(isAllowed(rules, "/files/report.pdf"))
+        self.failUnless(isAllowed(rules, "/files/report.pdf?page=2"))
+        rules, crawl_delay = parseRobots(ROBOTS, "SomeBot")
+        self.failUnlessEqual(crawl_delay, None)
+        self.failIf(isAllowed(rules, "/"))
+        rules, crawl_delay = parseRobots("", "AWSpider")
+        self.failUnless(isAllowed(rules, "/"))
+
+    def testRobotsCache(self):
+        self.mini_web_server = MiniWebServer()
+        self.rq = RequestQueuer(max_requests_per_host_per_second=0)
+        self.robots = RobotsCache(self.rq)
+        d = self.robots.getPage("http://127.0.0.1:8080/helloworld", 
+            timeout=5)
+        d.addCallback(self._testRobotsCacheCallback)
+        d.addBoth(self._shutdownMiniWebServer)
+        return d
+
+    def _testRobotsCacheCallback(self, data):
+        self.failUnlessEqual(data["response"], "Hello World!")
+        self.failUnlessEqual(
+            self.rq.getHostMaxRequestsPerSecond("127.0.0.1"), 
+            2.0)
+        d = self.robots.getPage("http://127.0.0.1:8080/private/helloworld")
+        self.failUnlessEqual(self.rq.getPending(), 0)
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testRobotsCacheErrback)
+        return d
+
+    def _testRobotsCacheErrback(self, error):
+        error.trap(RobotsDisallowedException)
+        d = self.robots.isAllowed("http://127.0.0.1:8080/private/public")
+        d.addCallback(self.failUnless)
+        return d
+
+    def testCancelPage(self):
+        rq = FakeRequestQueuer()
+        robots = RobotsCache(rq)
+        d = robots.getPage("http://example.com/a")
+        d.addCallback(self._unexpectedCallback)
+        d.addErrback(self._testCancelPageErrback)
+        rq.requests[0][1].callback({"response":""})
+        self.failUnlessEqual(rq.requests[1][0], "http://example.com/a")
+        d.cancel()
+        self.failUnless(rq.requests[1][1].called)
+        return d
+
+    def _testCancelPageErrback(self, error):
+        error.trap(CancelledError)
+
+    def testCrawlDelay(self):
+        rq = FakeRequestQueuer()
+        rq.setHostMaxRequestsPerSecond("example.com", 1)
+        rq.setHostMaxRequestsPerSecond("example.org", 0.1)
+        robots = RobotsCache(rq)
+        for host in ["example.com", "example.org"]:
+            robots.isAllowed("http://%s/" % host)
+            rq.requests.pop()[1].callback(
+                {"response":"User-agent: *\nCrawl-delay: 2"})
+        self.failUnlessEqual(rq.getHostMaxRequestsPerSecond("example.com"), 
+            0.5)
+        # The host's own limit is slower.
+        self.failUnlessEqual(rq.getHostMaxRequestsPerSecond("example.org"), 
+            0.1)
+        # The limit returns when the Crawl-delay expires or is removed.
+        robots.cache["http://example.com/robots.txt"] = ([], 0)
+        self.failUnlessEqual(rq.getHostMaxRequestsPerSecond("example.com"), 
+            0.5)
+        robots.isAllowed("http://example.com/")
+        self.failUnlessEqual(rq.getHostMaxRequestsPerSecond("example.com"), 
+            1)
+        rq.requests.pop()[1].callback({"response":""})
+        self.failUnlessEqual(rq.getHostMaxRequestsPerSecond("example.com"), 
+            1)
+
+    def testRobotsErrors(self):
+        rq = FakeRequestQueuer()
+        robots = RobotsCache(rq)
+        results = []
+        for host, error in [
+                ("a.example.com", Error("404", "Not Found", "")),
+                ("b.example.com", Error("503", "Service Unavailable", "")),
+                ("c.example.com", ConnectionRefusedError())]:
+            d = robots.isAllowed("http://%s/" % host)
+            d.addCallback(results.append)
+            rq.requests.pop()[1].errback(Failure(error))
+        self.failUnlessEqual(results, [True, False, False])
+
+    def _shutdownMiniWebServer(self, data):
+        d = self.mini_web_server.shutdown()
+        d.addCallback(self._shutdownMiniWebServerCallback, data)
+        return d
+
+    def _shutdownMiniWebServerCallback(self, ignored, data):
+        return data
+
+    def _unexpectedCallback(self, data):
+        self.fail("Expected an errback.")